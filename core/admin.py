@@ -1,6 +1,7 @@
 from django.contrib import admin
-from .models import Pin, Board, Profile, ForbiddenTag
+from .models import Pin, Board, Profile, ForbiddenTag, MediaBlob
 from django.utils.translation import gettext_lazy as _
+from .forms import PinForm
 
 admin.site.site_header = 'Админ-панель Pinterest Clone'
 admin.site.site_title = 'Админ Pinterest'
@@ -8,21 +9,28 @@ admin.site.index_title = 'Добро пожаловать в админ-пане
 
 @admin.register(ForbiddenTag)
 class ForbiddenTagAdmin(admin.ModelAdmin):
+    # 'тег' — точное совпадение, 'тег*' — префикс, '*тег' — суффикс, '*тег*' — подстрока
     list_display = ('tag',)
     search_fields = ('tag',)
 
 @admin.register(Pin)
 class PinAdmin(admin.ModelAdmin):
+    form = PinForm  # Та же проверка запрещённых тегов, что и на сайте
     list_display = ('title', 'user', 'created_at')
     search_fields = ('title', 'description')
     list_filter = ('user', 'created_at')
 
 @admin.register(Board)
 class BoardAdmin(admin.ModelAdmin):
-    list_display = ('title', 'user', 'created_at')
+    list_display = ('title', 'user', 'pin_count', 'created_at')
     search_fields = ('title',)
 
 @admin.register(Profile)
 class ProfileAdmin(admin.ModelAdmin):
     list_display = ('user', 'bio')
-    search_fields = ('user__username',)
\ No newline at end of file
+    search_fields = ('user__username',)
+@admin.register(MediaBlob)
+class MediaBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'created_at')
+    search_fields = ('name', 'sha256')
+    readonly_fields = ('name', 'sha256', 'size', 'refcount', 'phash', 'created_at')
@@ -0,0 +1,116 @@
+"""
+Сборка статики (manage.py build_assets → collectstatic с этим хранилищем).
+
+CSS минифицируется, у каждого файла в имени хэш содержимого (css/site.3f2a….css, как у
+ManifestStaticFilesStorage), а рядом лежат сжатые копии .gz и .br (если установлен brotli).
+Отдаёт их StaticMiddleware (core/serve.py): нужный вариант по Accept-Encoding и Cache-Control
+immutable для имён с хэшем — повторный визит не делает ни одного запроса за статикой.
+"""
+import gzip
+import re
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # Необязательная зависимость: без неё только .gz
+    brotli = None
+
+# Что имеет смысл сжимать: картинки и шрифты уже сжаты
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.json', '.map', '.txt', '.html', '.xml')
+# Мелкие файлы не сжимаем: выигрыш меньше заголовков
+COMPRESS_MIN_SIZE = 256
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_STRING_OR_COMMENT_RE = re.compile(r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\')|/\*.*?\*/', re.S)
+_CSS_SPACE_RE = re.compile(r'\s+')
+_CSS_PUNCTUATION_RE = re.compile(r' ?([{};,>]) ?')
+
+
+def _squeeze(css):
+    css = _CSS_SPACE_RE.sub(' ', css)
+    css = _CSS_PUNCTUATION_RE.sub(r'\1', css)
+    # Пробел перед двоеточием не трогаем: «a :hover» и «a:hover» — разные селекторы
+    return css.replace(': ', ':').replace(';}', '}')
+
+
+def minify_css(css):
+    """Убирает комментарии и лишние пробелы; строки в кавычках не меняются."""
+    parts, text, position = [], '', 0
+    for match in _CSS_STRING_OR_COMMENT_RE.finditer(css):
+        text += css[position:match.start()]
+        if match.group(1):
+            parts += [_squeeze(text), match.group(1)]
+            text = ''
+        else:
+            # Комментарий между словами заменяем пробелом, чтобы они не слиплись
+            text += ' '
+        position = match.end()
+    parts.append(_squeeze(text + css[position:]))
+    return ''.join(parts).strip()
+
+
+def compress(data):
+    """{расширение: сжатые байты} для вариантов, которые меньше оригинала."""
+    variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+    return {suffix: body for suffix, body in variants.items() if len(body) < len(data)}
+
+
+def is_compressible(name):
+    return name.endswith(COMPRESSIBLE_EXTENSIONS)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """ManifestStaticFilesStorage, который ещё минифицирует CSS до хэширования и пишет .gz/.br."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        # Хэш и замена url() считаются по исходникам (paths: имя → (хранилище, путь)), поэтому для CSS
+        # подставляем минифицированную копию из STATIC_ROOT. Неизменённые файлы collectstatic не копирует
+        # заново — там уже минифицированная копия, повторная минификация её не меняет
+        paths = dict(paths)
+        for name in paths:
+            if name.endswith('.css') and not name.endswith('.min.css'):
+                self._minify(name)
+                paths[name] = (self, name)
+        processed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                processed_names.update((name, hashed_name))
+            yield name, hashed_name, processed
+        # Сжимаем в конце: CSS переписывается (url() на имена с хэшем) за несколько проходов
+        for name in sorted(processed_names):
+            if is_compressible(name):
+                self._compress(name)
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            # Сборки ещё не было (нет манифеста или файла в STATIC_ROOT): адрес без хэша,
+            # его отдаст staticfiles при DEBUG или веб-сервер — только без вечного кэша
+            return name
+
+    def _minify(self, name):
+        with self.open(name) as f:
+            css = f.read().decode('utf-8')
+        minified = minify_css(css)
+        if len(minified) < len(css):
+            self._replace(name, minified.encode('utf-8'))
+
+    def _compress(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return
+        for suffix, body in compress(data).items():
+            self._replace(name + suffix, body)
+
+    def _replace(self, name, data):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(data))
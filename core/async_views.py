@@ -0,0 +1,156 @@
+"""
+Асинхронные версии главной, профиля и доски для запуска под ASGI (settings.ASYNC_VIEWS).
+
+Независимые чтения идут параллельно. Асинхронный ORM Django (aget, afirst) всё ещё выполняет
+запросы по одному в общем потоке запроса, поэтому его используем для одиночных выборок. Веер
+независимых запросов уходит в пул потоков, у каждого потока своё соединение с БД. Страница
+отдаётся потоком: шапка со стилями уходит сразу, фрагменты — по мере готовности.
+Синхронные версии в core/views.py остаются для WSGI и как запасной вариант.
+"""
+import asyncio
+import contextvars
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.decorators import login_required
+from django.db import close_old_connections
+from django.http import StreamingHttpResponse
+from django.middleware.csrf import get_token
+from django.shortcuts import aget_object_or_404
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import history, related, views
+from .forms import ProfileForm
+from .interests import interests_for
+from .models import Board, Profile, User
+
+
+def _read(func, *args):
+    # Поток пула живёт дольше запроса: соединение закрываем по CONN_MAX_AGE, как в конце обычного запроса
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def read(func, *args):
+    """Запускает синхронное чтение в пуле потоков; несколько таких вызовов идут параллельно."""
+    return asyncio.ensure_future(sync_to_async(_read, thread_sensitive=False)(func, *args))
+
+
+def reader(func, *args):
+    """Отложенный read(): для stream(), задачи стартуют уже в цикле событий, который читает ответ."""
+    return lambda: read(func, *args)
+
+
+def _launch(start):
+    return asyncio.ensure_future(start())
+
+
+async def _viewer(request):
+    user = await request.auser()
+    # Дальше request.user читают шаблоны и код в потоках — пусть не загружают пользователя заново
+    request.user = user
+    return user
+
+
+async def stream(request, template_name, context, parts, background=()):
+    """
+    Рендерит шаблон, подставив вместо фрагментов метки, и отдаёт его по частям:
+    текст до метки — сразу, фрагмент — когда будет готов.
+    parts — {имя переменной шаблона: функция, возвращающая awaitable с HTML}, background — такие же
+    функции для работы без результата. Все они запускаются вместе, когда начинается отдача тела:
+    под WSGI и в тестовом клиенте цикл событий view к этому моменту уже завершён.
+    """
+    markers = {name: f'<!--stream:{name}:{secrets.token_hex(8)}-->' for name in parts}
+    shell = await sync_to_async(render_to_string)(
+        template_name, {**context, **{name: mark_safe(marker) for name, marker in markers.items()}}, request=request,
+    )
+    # Ответ уходит раньше, чем отрендерены фрагменты с формами: кука CSRF должна попасть в заголовки
+    get_token(request)
+    order = sorted((shell.find(marker), name) for name, marker in markers.items())
+    # Контекст запроса (счётчики core/metrics.py) нужен и задачам, запущенным при отдаче тела
+    request_context = contextvars.copy_context()
+
+    async def body():
+        tasks = {name: request_context.run(_launch, start) for name, start in parts.items()}
+        pending = [request_context.run(_launch, start) for start in background]
+        rest = shell
+        for position, name in order:
+            if position < 0:  # Фрагмента нет в этой ветке шаблона
+                await tasks[name]
+                continue
+            head, _, rest = rest.partition(markers[name])
+            yield head
+            yield await tasks[name]
+        yield rest
+        await asyncio.gather(*pending)
+
+    return StreamingHttpResponse(body(), content_type='text/html; charset=utf-8')
+
+
+@login_required
+async def home(request):
+    query = request.GET.get('q')
+    viewer = await _viewer(request)
+
+    async def feed_html():
+        if query:
+            recommendations = (set(), set(), [])
+        else:
+            # Интересы и похожие пины — разные таблицы, читаем одновременно
+            interests, related_pins = read(interests_for, viewer), read(related.recommend_for, viewer)
+            (interest_tags, interest_users), pins = await interests, await related_pins
+            recommendations = (interest_tags, interest_users, pins)
+        return await read(views._home_feed_html, request, query, recommendations)
+
+    return await stream(request, 'core/home.html', {'query': query}, {
+        'feed_html': feed_html,
+        'users_html': reader(views._home_users_html, viewer, query),
+    }, [reader(history.record, viewer, query)] if query else [])
+
+
+@login_required
+async def profile(request, username=None):
+    if request.method == 'POST':
+        # Сохранение формы — редкая операция, её делает синхронная версия
+        return await sync_to_async(views.profile)(request, username)
+
+    viewer = await _viewer(request)
+    if username:
+        viewed_user = await aget_object_or_404(User.objects.select_related('profile'), username=username, is_active=True)
+    else:
+        viewed_user = viewer
+    is_own_profile = viewed_user.pk == viewer.pk
+
+    try:
+        # Чужой профиль уже загружен select_related, свой — ещё нет (ленивый доступ под async запрещён)
+        profile_obj = viewed_user.profile if username else await Profile.objects.aget(user=viewed_user)
+    except Profile.DoesNotExist:
+        # Старый аккаунт без профиля: пустой, несохранённый, как в views.profile
+        profile_obj = Profile(user=viewed_user)
+
+    return await stream(request, 'core/profile.html', {
+        'form': ProfileForm(instance=profile_obj) if is_own_profile else None,
+        'profile_user': viewed_user,
+        'profile': profile_obj,
+        'is_own_profile': is_own_profile,
+    }, {
+        'pins_html': reader(views._profile_pins_html, viewed_user, is_own_profile),
+        'boards_html': reader(views._profile_boards_html, viewed_user),
+    })
+
+
+@login_required
+async def board_detail(request, board_id):
+    viewer = await _viewer(request)
+    board = await aget_object_or_404(Board.objects.select_related('user'), id=board_id)
+    is_own_board = board.user_id == viewer.pk
+
+    return await stream(request, 'core/board_detail.html', {'board': board, 'is_own_board': is_own_board}, {
+        'pins_html': reader(views._board_pins_html, board, is_own_board),
+        'related_html': reader(views._board_related_html, board),
+    })
+
@@ -0,0 +1,307 @@
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import django
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from . import metrics
+from .models import Board, Pin, User
+
+SCENARIOS = ('home', 'search', 'profile', 'board_detail', 'add_to_board')
+# Сколько целей (пинов, досок, авторов) выбираем заранее — запросы ходят по ним случайно
+SAMPLE_SIZE = 500
+SEARCH_QUERIES = ('осень', 'кофе', 'горы море', 'кошки', 'рецепт торт', 'интерьер кухня', '#цветы', 'закат')
+
+
+class Targets:
+    """Случайные, но воспроизводимые (по seed) адреса для сценариев."""
+
+    def __init__(self, user, seed):
+        self.random = random.Random(seed)
+        self.pin_ids = list(Pin.objects.exclude(user=user).order_by('-pk').values_list('pk', flat=True)[:SAMPLE_SIZE])
+        self.board_ids = list(Board.objects.order_by('-pin_count').values_list('pk', flat=True)[:SAMPLE_SIZE])
+        self.usernames = list(User.objects.filter(pin__isnull=False).distinct().values_list('username', flat=True)[:SAMPLE_SIZE])
+        self.own_board_ids = list(Board.objects.filter(user=user).values_list('pk', flat=True))
+        if not (self.pin_ids and self.board_ids and self.usernames and self.own_board_ids):
+            raise ValueError('Мало данных: нужны чужие пины и доски у пользователя (см. seed_synthetic).')
+
+    def request(self, scenario):
+        """(метод, путь, данные POST) для одного запроса сценария."""
+        choice = self.random.choice
+        if scenario == 'home':
+            return 'GET', reverse('home'), None
+        if scenario == 'search':
+            return 'GET', reverse('home') + '?' + urlencode({'q': choice(SEARCH_QUERIES)}), None
+        if scenario == 'profile':
+            return 'GET', reverse('user_profile', args=[choice(self.usernames)]), None
+        if scenario == 'board_detail':
+            return 'GET', reverse('board_detail', args=[choice(self.board_ids)]), None
+        if scenario == 'add_to_board':
+            return 'POST', reverse('add_to_board', args=[choice(self.pin_ids)]), {'board_id': choice(self.own_board_ids)}
+        raise ValueError(f'Неизвестный сценарий: {scenario}')
+
+
+async def _consume(chunks):
+    return b''.join([chunk async for chunk in chunks])
+
+
+class ClientRunner:
+    """Тестовый клиент Django: без сети, вся обработка — в этом потоке."""
+
+    name = 'client'
+
+    def __init__(self, user):
+        self.client = Client()
+        self.client.force_login(user)
+
+    def __call__(self, method, path, data):
+        response = self.client.post(path, data) if method == 'POST' else self.client.get(path)
+        if response.streaming:
+            # Асинхронные view отдают страницу потоком — время считаем до последнего фрагмента
+            if response.is_async:
+                async_to_sync(_consume)(response.streaming_content)
+            else:
+                b''.join(response.streaming_content)
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerRunner:
+    """
+    Настоящий HTTP: поднимает WSGI (сервер разработки Django с потоками) или ASGI (uvicorn)
+    на свободном порту в этом же процессе — так метрики middleware видны бенчмарку.
+    """
+
+    def __init__(self, user, kind='wsgi'):
+        self.name = kind
+        client = Client()
+        client.force_login(user)
+        session = client.cookies[settings.SESSION_COOKIE_NAME].value
+        # CSRF: кука и заголовок с одним и тем же секретом
+        csrf = 'b' * 32
+        self.headers = {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={session}; {settings.CSRF_COOKIE_NAME}={csrf}',
+            'X-CSRFToken': csrf,
+        }
+        self.local = threading.local()
+        if kind == 'asgi':
+            self._start_asgi()
+        else:
+            self._start_wsgi()
+
+    def _start_wsgi(self):
+        from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+        from django.core.wsgi import get_wsgi_application
+
+        class QuietHandler(WSGIRequestHandler):
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler, allow_reuse_address=False)
+        self.server.set_app(get_wsgi_application())
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def _start_asgi(self):
+        try:
+            import uvicorn
+        except ImportError:
+            raise RuntimeError('Для --server asgi нужен uvicorn (pip install uvicorn).')
+        import socket
+
+        from django.core.asgi import get_asgi_application
+
+        sock = socket.socket()
+        sock.bind(('127.0.0.1', 0))
+        self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(get_asgi_application(), log_level='warning', lifespan='off'))
+        self.thread = threading.Thread(target=self.server.run, kwargs={'sockets': [sock]}, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+
+    def __call__(self, method, path, data):
+        headers = dict(self.headers)
+        body = None
+        if data is not None:
+            body = urlencode(data)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        # Одно keep-alive соединение на поток нагрузки
+        conn = getattr(self.local, 'conn', None)
+        if conn is not None:
+            try:
+                return self._send(conn, method, path, body, headers)
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                pass  # Сервер закрыл простаивавшее соединение — повторяем на новом
+        conn = self.local.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        return self._send(conn, method, path, body, headers)
+
+    def _send(self, conn, method, path, body, headers):
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            self.local.conn = None
+            conn.close()
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            self.local.conn = None
+            conn.close()
+        return response.status
+
+    def close(self):
+        if self.name == 'asgi':
+            self.server.should_exit = True
+        else:
+            self.server.shutdown()
+            self.server.server_close()
+        self.thread.join(5)
+
+
+def rss_mb():
+    """Текущая резидентная память процесса (Linux), иначе — пиковая."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    return round(peak / (1024 * 1024 if platform.system() == 'Darwin' else 1024), 1)
+
+
+def percentile(values, q):
+    """Перцентиль по ближайшему рангу из отсортированного списка."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values))) - 1))]
+
+
+def run_scenario(runner, targets, scenario, requests, warmup=5, concurrency=1):
+    for _ in range(warmup):
+        runner(*targets.request(scenario))
+    planned = [targets.request(scenario) for _ in range(requests)]
+    metrics.reset()
+    timings, errors = [], 0
+
+    def one(request):
+        started = time.perf_counter()
+        try:
+            status = runner(*request)
+        except Exception:
+            status = None
+        return (time.perf_counter() - started) * 1000, status
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(concurrency) as pool:
+            results = list(pool.map(one, planned))
+    else:
+        results = [one(request) for request in planned]
+    elapsed = time.perf_counter() - started
+
+    for duration, status in results:
+        timings.append(duration)
+        if status is None or status >= 400:
+            errors += 1
+    timings.sort()
+    # Запросы к БД считает MetricsMiddleware, складываем по всем view сценария (с учётом редиректов)
+    observed = metrics.totals()
+    handled = sum(view['sql_queries']['count'] for view in observed.values())
+    queries = sum(view['sql_queries']['sum'] for view in observed.values())
+    sql_time = sum(view['sql_duration_seconds']['sum'] for view in observed.values())
+    return {
+        'requests': requests,
+        'errors': errors,
+        'throughput_rps': round(requests / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(timings) / len(timings), 2) if timings else None,
+        'p50_ms': round(percentile(timings, 50), 2) if timings else None,
+        'p95_ms': round(percentile(timings, 95), 2) if timings else None,
+        'p99_ms': round(percentile(timings, 99), 2) if timings else None,
+        'queries_per_request': round(queries / handled, 2) if handled else None,
+        'sql_ms_per_request': round(sql_time * 1000 / handled, 2) if handled else None,
+        'rss_mb': rss_mb(),
+        # Куда ушли запросы: основная база или реплики (core/db.py)
+        'queries_by_database': {alias: stats['queries'] for alias, stats in metrics.databases().items()},
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(user, scenarios=SCENARIOS, requests=200, warmup=5, server='client', concurrency=1, seed=42):
+    """Прогоняет сценарии и возвращает отчёт, пригодный для json.dump и compare()."""
+    targets = Targets(user, seed)
+    runner = ClientRunner(user) if server == 'client' else ServerRunner(user, server)
+    try:
+        results = {
+            scenario: run_scenario(runner, targets, scenario, requests, warmup, concurrency if server != 'client' else 1)
+            for scenario in scenarios
+        }
+    finally:
+        runner.close()
+    return {
+        'started_at': timezone.now().isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'server': runner.name,
+        'concurrency': concurrency if server != 'client' else 1,
+        'seed': seed,
+        'data': {'pins': Pin.objects.count(), 'boards': Board.objects.count(), 'users': User.objects.count()},
+        'scenarios': results,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def save(report, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+def compare(report, baseline):
+    """Изменение ключевых показателей относительно прошлого отчёта, в процентах."""
+    changes = {}
+    for scenario, result in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if not before:
+            continue
+        changes[scenario] = {
+            key: round((result[key] - before[key]) / before[key] * 100, 1)
+            for key in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_per_request')
+            if result.get(key) is not None and before.get(key)
+        }
+    return changes
@@ -0,0 +1,259 @@
+import json
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.utils import timezone
+
+from . import thumbnails
+from .models import MediaBlob
+
+PHASH_BANDS = 4
+# Файл без ссылок, сохранённый позже этого, не удаляем: модель с ним могла ещё не сохраниться
+GC_GRACE = timedelta(hours=1)
+
+
+def dhash(path):
+    """64-битный разностный хэш: устойчив к масштабу, сжатию и небольшим правкам цвета."""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        image.draft('L', (64, 64))  # JPEG декодируется сразу в уменьшенном виде
+        small = image.convert('L').resize((9, 8), Image.LANCZOS)
+        pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def phash_fields(value):
+    if value is None:
+        return {}
+    fields = {'phash': value - (1 << 64) if value >= 1 << 63 else value}  # В знаковый BIGINT
+    for band in range(PHASH_BANDS):
+        fields[f'phash_band{band}'] = (value >> (16 * band)) & 0xFFFF
+    return fields
+
+
+def register(name, sha256, size, phash=None):
+    """Запись о файле после сохранения в хранилище. Повторная загрузка того же содержимого ничего не создаёт."""
+    blob, created = MediaBlob.objects.get_or_create(
+        name=name, defaults={'sha256': sha256, 'size': size, **phash_fields(phash)}
+    )
+    return blob, created
+
+
+def touch(name):
+    """
+    Продлевает отсрочку сборки мусора перед повторным использованием файла (core/storage.py).
+    UPDATE блокирует строку до конца транзакции: идущее удаление сначала завершится, и тогда
+    запись не найдётся (False) — файл нужно записать заново.
+    """
+    return bool(MediaBlob.objects.filter(name=name).update(stored_at=timezone.now()))
+
+
+def acquire(name):
+    if not name:
+        return
+    if not MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        # Файл, загруженный до появления хранилища, — заводим запись, чтобы считать ссылки
+        try:
+            size = default_storage.size(name)
+        except OSError:
+            size = 0
+        MediaBlob.objects.get_or_create(name=name, defaults={'sha256': '', 'size': size, 'refcount': 1})
+
+
+def release(name):
+    """Снимает ссылку. Когда ссылок не осталось — файл удаляется после коммита (сохранённый недавно — в gc_media_blobs)."""
+    if not name:
+        return
+    MediaBlob.objects.filter(name=name).update(refcount=F('refcount') - 1)
+    transaction.on_commit(lambda: _delete_if_unused(name))
+
+
+def release_many(references):
+    """{имя файла: сколько ссылок снять} одним UPDATE — для пакетного удаления (core/deletion.py)."""
+    references = {name: count for name, count in references.items() if name}
+    if not references:
+        return
+    MediaBlob.objects.filter(name__in=references).update(refcount=F('refcount') - Case(
+        *[When(name=name, then=Value(count)) for name, count in references.items()],
+        default=Value(0), output_field=IntegerField(),
+    ))
+    names = list(references)
+    transaction.on_commit(lambda: [_delete_if_unused(name) for name in names])
+
+
+def _delete_if_unused(name, now=None):
+    with transaction.atomic():
+        # Недавно сохранённый файл не трогаем: новую ссылку на него могли ещё не взять
+        blob = MediaBlob.objects.select_for_update().filter(
+            name=name, refcount__lte=0, stored_at__lt=(now or timezone.now()) - GC_GRACE,
+        ).first()
+        if blob is None:
+            return
+        blob.delete()
+        # Файл удаляем под блокировкой строки: storage._store ждёт её и после нас запишет файл заново
+        default_storage.delete(name)
+    # Превью названы по хэшу содержимого: удаляем, только если такого содержимого больше нет
+    if not blob.sha256 or not MediaBlob.objects.filter(sha256=blob.sha256).exists():
+        thumbnails.remove(name)
+    else:
+        thumbnails.forget(name)
+
+
+def collect_garbage(now=None):
+    """Удаляет файлы без ссылок (например, загруженные, но так и не сохранённые в модели)."""
+    now = now or timezone.now()
+    removed = 0
+    names = MediaBlob.objects.filter(refcount__lte=0, stored_at__lt=now - GC_GRACE).values_list('name', flat=True)
+    for name in names.iterator():
+        _delete_if_unused(name, now)
+        removed += 1
+    return removed
+
+
+# --- Файлы на диске, о которых не знает БД ---
+
+# Незаконченные загрузки живут по UploadSession, реестр превью проверяется отдельно (_sweep_registry)
+SWEEP_SKIP_DIRS = ('uploads', thumbnails.REGISTRY_DIR)
+THUMB_NAME_RE = re.compile(r'^([0-9a-f]{20})-\d+\.\w+$')
+
+
+def _walk(root, relative=''):
+    """(относительное имя, stat) всех файлов под root. Память — только на текущую глубину каталогов."""
+    with os.scandir(os.path.join(root, relative)) as entries:
+        for entry in entries:
+            name = f'{relative}/{entry.name}' if relative else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                if name not in SWEEP_SKIP_DIRS:
+                    yield from _walk(root, name)
+            elif entry.is_file(follow_symlinks=False):
+                yield name, entry.stat()
+
+
+def _live_names(names):
+    from .models import Pin, Profile
+
+    live = set(MediaBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    rest = [name for name in names if name not in live]
+    if rest:
+        # Файлы, загруженные до появления MediaBlob, известны только по полям моделей
+        for field in ('image', 'video', 'poster'):
+            live.update(Pin.all_objects.filter(**{f'{field}__in': rest}).values_list(field, flat=True))
+        live.update(Profile.objects.filter(avatar__in=rest).values_list('avatar', flat=True))
+    return live
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _sweep_registry(root, cutoff, batch_size, dry_run, removed):
+    """
+    Проходит реестр превью. Запись, чей исходник больше не нужен, удаляется; запись с пропавшей
+    копией тоже — при следующем показе превью пересоздадутся. Возвращает хэши содержимого нужных
+    исходников: производные с этими хэшами остаются.
+    """
+    live_hashes = set()
+    if not os.path.isdir(os.path.join(root, thumbnails.REGISTRY_DIR)):
+        return live_hashes  # Превью ещё ни разу не создавались
+    registry = ((name, info) for name, info in _walk(root, thumbnails.REGISTRY_DIR) if info.st_mtime < cutoff)
+    for batch in _batches(registry, batch_size):
+        entries = []
+        for name, info in batch:
+            if not name.endswith('.json'):
+                entries.append((name, info, None))  # .tmp, брошенный упавшим процессом
+                continue
+            try:
+                with open(os.path.join(root, name)) as f:
+                    entries.append((name, info, json.load(f)))
+            except ValueError:
+                entries.append((name, info, None))  # Битая запись
+            except OSError:
+                continue
+        sources = [entry['name'] for _, _, entry in entries if entry and entry.get('name')]
+        live = _live_names(sources) if sources else set()
+        for name, info, entry in entries:
+            # Записи без 'name' созданы до его появления: исходник не проверить, считаем нужным
+            if entry and (entry.get('name') in live or 'name' not in entry):
+                if entry.get('hash'):
+                    live_hashes.add(entry['hash'])
+                variants = entry.get('variants', {}).values()
+                if all(os.path.exists(os.path.join(root, relative)) for relative in variants):
+                    continue
+            if not dry_run:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    continue
+            removed[0] += 1
+            removed[1] += info.st_size
+    return live_hashes
+
+
+def sweep_orphans(now=None, batch_size=1000, dry_run=False):
+    """
+    Обходит MEDIA_ROOT и удаляет файлы старше GC_GRACE, на которые не ссылается ни MediaBlob, ни модель,
+    записи реестра превью без исходника и превью, которых нет ни в одной нужной записи.
+    Имена сверяются с БД пачками по batch_size. Возвращает (число файлов, байт).
+    """
+    cutoff = ((now or timezone.now()) - GC_GRACE).timestamp()
+    root = str(settings.MEDIA_ROOT)
+    removed = [0, 0]
+    live_hashes = _sweep_registry(root, cutoff, batch_size, dry_run, removed)
+
+    # Только что записанный файл пропускаем: модель с ним могла ещё не сохраниться
+    files = ((name, info) for name, info in _walk(root) if info.st_mtime < cutoff)
+    for batch in _batches(files, batch_size):
+        # Превью: thumbs/ab/<20 символов sha256>-<ширина>.<формат>
+        thumb_hashes = {}
+        for name, _ in batch:
+            match = THUMB_NAME_RE.match(os.path.basename(name))
+            if match and name.startswith(thumbnails.THUMBS_DIR + '/'):
+                thumb_hashes[name] = match.group(1)
+        others = [name for name, _ in batch if name not in thumb_hashes]
+        live = _live_names(others) if others else set()
+        for name, info in batch:
+            if name in live or thumb_hashes.get(name) in live_hashes:
+                continue
+            if not dry_run:
+                try:
+                    os.remove(os.path.join(root, name))
+                except OSError:
+                    continue
+            removed[0] += 1
+            removed[1] += info.st_size
+    return tuple(removed)
+
+
+def hamming(a, b):
+    return bin((a ^ b) & ((1 << 64) - 1)).count('1')
+
+
+def near_duplicates(blob, max_distance=3):
+    """
+    Похожие картинки. При расстоянии Хэмминга до 3 хотя бы одна из четырёх
+    16-битных полос совпадает точно, поэтому кандидатов ищем по индексам полос.
+    """
+    if blob.phash is None:
+        return []
+    condition = Q()
+    for band in range(PHASH_BANDS):
+        condition |= Q(**{f'phash_band{band}': getattr(blob, f'phash_band{band}')})
+    candidates = MediaBlob.objects.filter(condition).exclude(pk=blob.pk).only('name', 'phash')
+    return [other for other in candidates if hamming(blob.phash, other.phash) <= max_distance]
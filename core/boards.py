@@ -0,0 +1,129 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, F, Window
+from django.db.models.functions import RowNumber
+
+from . import engagement, fragments
+from .models import Board, Pin
+
+# Сколько пинов показывать на обложке доски
+COVER_SIZE = 4
+# Предел операций в одном пакетном запросе
+MAX_BATCH_OPERATIONS = 1000
+
+Membership = Board.pins.through
+
+
+def compute_stats(board_ids):
+    """Фактические {board_id: (pin_count, [id обложки])} — два запроса на любое число досок."""
+    board_ids = list(board_ids)
+    # Удалённые пины (core/deletion.py) не считаем, даже пока связи с ними ещё не вычищены
+    memberships = Membership.objects.filter(board_id__in=board_ids, pin__deleted_at__isnull=True)
+    counts = dict(
+        memberships
+        .values('board_id').annotate(total=Count('pk')).values_list('board_id', 'total')
+    )
+    covers = defaultdict(list)
+    # Первые COVER_SIZE пинов каждой доски в порядке добавления
+    rows = (
+        memberships
+        .annotate(position=Window(RowNumber(), partition_by=F('board_id'), order_by=F('pk').asc()))
+        .filter(position__lte=COVER_SIZE)
+        .order_by('board_id', 'position')
+        .values_list('board_id', 'pin_id')
+    )
+    for board_id, pin_id in rows:
+        covers[board_id].append(pin_id)
+    return {board_id: (counts.get(board_id, 0), covers[board_id]) for board_id in board_ids}
+
+
+def refresh(board_ids):
+    """Пересчитывает счётчик и обложку досок. Возвращает число досок, где данные разошлись."""
+    stats = compute_stats(board_ids)
+    changed = []
+    for board in Board.objects.filter(pk__in=stats).only('pk', 'pin_count', 'cover_pin_ids'):
+        pin_count, cover_pin_ids = stats[board.pk]
+        if board.pin_count != pin_count or board.cover_pin_ids != cover_pin_ids:
+            board.pin_count, board.cover_pin_ids = pin_count, cover_pin_ids
+            changed.append(board)
+    Board.objects.bulk_update(changed, ['pin_count', 'cover_pin_ids'])
+    return len(changed)
+
+
+def attach_covers(boards):
+    """Проставляет board.cover_pins одним запросом на все доски страницы."""
+    boards = list(boards)
+    pins = Pin.objects.in_bulk({pin_id for board in boards for pin_id in board.cover_pin_ids})
+    for board in boards:
+        board.cover_pins = [pins[pin_id] for pin_id in board.cover_pin_ids if pin_id in pins]
+    return boards
+
+
+# --- Пакетное добавление и удаление пинов ---
+
+class BatchRejected(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_operations(items):
+    """[{"board": 1, "pin": 2}, ...] -> [(1, 2), ...] без повторов."""
+    if not isinstance(items, list):
+        raise BatchRejected('Операции передаются списком.')
+    try:
+        return list(dict.fromkeys((int(item['board']), int(item['pin'])) for item in items))
+    except (KeyError, TypeError, ValueError):
+        raise BatchRejected('Каждая операция — объект с полями board и pin.')
+
+
+def apply_batch(user, add, remove):
+    """
+    Добавляет и убирает пары (доска, пин) одной транзакцией: права проверяются одним запросом,
+    связи пишутся bulk_create и удаляются по одному DELETE на доску.
+    """
+    if len(add) + len(remove) > MAX_BATCH_OPERATIONS:
+        raise BatchRejected(f'Не больше {MAX_BATCH_OPERATIONS} операций за запрос.')
+    if set(add) & set(remove):
+        raise BatchRejected('Одна и та же пара не может быть и в add, и в remove.')
+    board_ids = {board_id for board_id, _ in add + remove}
+    owned = set(Board.objects.filter(pk__in=board_ids, user=user).values_list('pk', flat=True))
+    if board_ids - owned:
+        raise BatchRejected(f'Нет доступа к доскам: {sorted(board_ids - owned)}', status=403)
+    pin_ids = {pin_id for _, pin_id in add}
+    missing = pin_ids - set(Pin.objects.filter(pk__in=pin_ids).values_list('pk', flat=True))
+    if missing:
+        raise BatchRejected(f'Пины не найдены: {sorted(missing)}', status=404)
+
+    with transaction.atomic():
+        # Уже существующие связи — одним запросом по уникальному индексу (board_id, pin_id)
+        present = set(
+            Membership.objects.filter(board_id__in=board_ids, pin_id__in={pin_id for _, pin_id in add + remove})
+            .values_list('board_id', 'pin_id')
+        )
+        to_add = [pair for pair in add if pair not in present]
+        Membership.objects.bulk_create(
+            [Membership(board_id=board_id, pin_id=pin_id) for board_id, pin_id in to_add], ignore_conflicts=True
+        )
+        by_board = defaultdict(list)
+        for board_id, pin_id in remove:
+            if (board_id, pin_id) in present:
+                by_board[board_id].append(pin_id)
+        removed = 0
+        for board_id, pins in by_board.items():
+            removed += Membership.objects.filter(board_id=board_id, pin_id__in=pins).delete()[0]
+        # bulk_create и delete() не вызывают m2m_changed — пересчитываем и считаем сохранения сами
+        refresh(board_ids)
+        engagement.record_saves([pin_id for _, pin_id in to_add])
+        transaction.on_commit(lambda: [fragments.invalidate_board(board_id, user.pk) for board_id in board_ids])
+
+    return {
+        'added': len(to_add),
+        'removed': removed,
+        'boards': {
+            board_id: {'pin_count': pin_count, 'cover_pin_ids': cover_pin_ids}
+            for board_id, pin_count, cover_pin_ids in Board.objects.filter(pk__in=board_ids)
+            .values_list('pk', 'pin_count', 'cover_pin_ids')
+        },
+    }
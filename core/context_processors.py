@@ -0,0 +1,10 @@
+from . import viewer as viewer_context
+
+
+def viewer(request):
+    """{{ viewer.profile }} и {{ viewer.boards }} во всех шаблонах, отрендеренных с request."""
+    lazy = getattr(request, 'viewer', None)
+    if lazy is None:
+        # Без ViewerMiddleware (например, в тестах с урезанным MIDDLEWARE) — отдельный ленивый объект
+        lazy = viewer_context.lazy(request)
+    return {'viewer': lazy}
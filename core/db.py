@@ -0,0 +1,164 @@
+"""
+Чтение с реплик, запись — в основную базу (settings.DATABASE_ROUTERS).
+
+На реплики уходят только чтения GET-запросов к view из REPLICA_READ_VIEWS. После любого изменяющего
+запроса (загрузка пина, добавление в доску) пользователь REPLICA_STICKY_SECONDS читает с основной
+базы — кука ставится в ReplicaMiddleware, — чтобы сразу увидеть свои изменения. Внутри транзакции
+и после записи в том же запросе чтения тоже идут в основную базу.
+"""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.utils import DatabaseError
+
+STICKY_COOKIE = 'db_primary_until'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Сессии — только с основной базы: отставшая реплика «разлогинила» бы пользователя
+PRIMARY_ONLY_APPS = ('sessions',)
+
+_state = ContextVar('core_db_state', default=None)
+_health_lock = threading.Lock()
+# alias -> (исправна ли, когда проверять снова)
+_health = {}
+
+
+class RequestState:
+    def __init__(self, request=None, replicas_allowed=False):
+        self.request = request
+        self.replicas_allowed = replicas_allowed
+        self.wrote = False
+        self.replica_reads = 0
+
+
+def replica_aliases():
+    return [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS and alias.startswith('replica')]
+
+
+def replica_reads():
+    """Сколько чтений текущего запроса ушло на реплики — см. fragments.get_or_render."""
+    state = _state.get()
+    return state.replica_reads if state is not None else 0
+
+
+def max_lag():
+    return getattr(settings, 'REPLICA_MAX_LAG', 10)
+
+
+def sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+@contextmanager
+def request_state(request):
+    token = _state.set(RequestState(request))
+    try:
+        yield _state.get()
+    finally:
+        _state.reset(token)
+
+
+@contextmanager
+def use_replicas():
+    """Разрешает чтение с реплик вне запроса — для тяжёлых отчётов и сборок, где отставание не важно."""
+    token = _state.set(RequestState(replicas_allowed=True))
+    try:
+        yield
+    finally:
+        _state.reset(token)
+
+
+def _request_allows_replicas(state):
+    if state.replicas_allowed:
+        return True
+    request = state.request
+    if request is None or request.method not in SAFE_METHODS:
+        return False
+    # До разбора URL (сессия, пользователь в middleware) имени view ещё нет — читаем с основной
+    match = getattr(request, 'resolver_match', None)
+    if match is None or match.url_name not in getattr(settings, 'REPLICA_READ_VIEWS', ()):
+        return False
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) < time.time()
+    except ValueError:
+        return True
+
+
+# --- Исправность реплик ---
+
+def replica_lag(alias):
+    """Отставание реплики MySQL в секундах; None — не реплика MySQL или не известно."""
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute('SHOW REPLICA STATUS')
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        columns = [column[0] for column in cursor.description]
+    lag = dict(zip(columns, row)).get('Seconds_Behind_Source')
+    return None if lag is None else int(lag)
+
+
+def check(alias):
+    """Проверяет соединение (и отставание для MySQL). Неисправную реплику пропускаем до следующей проверки."""
+    connection = connections[alias]
+    try:
+        connection.ensure_connection()
+        healthy = connection.is_usable()
+        lag = replica_lag(alias) if healthy else None
+        if lag is not None and lag > max_lag():
+            healthy = False
+    except DatabaseError:
+        healthy = False
+        connection.close_if_unusable_or_obsolete()
+    with _health_lock:
+        _health[alias] = (healthy, time.monotonic() + getattr(settings, 'REPLICA_HEALTH_INTERVAL', 10))
+    return healthy
+
+
+def is_healthy(alias):
+    with _health_lock:
+        healthy, recheck_at = _health.get(alias, (True, 0))
+    if time.monotonic() >= recheck_at:
+        return check(alias)
+    return healthy
+
+
+def health():
+    """{алиас: исправна ли} по последней проверке — для /metrics/."""
+    with _health_lock:
+        return {alias: healthy for alias, (healthy, _) in _health.items()}
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state.wrote or model._meta.app_label in PRIMARY_ONLY_APPS:
+            return DEFAULT_DB_ALIAS
+        if not _request_allows_replicas(state) or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        replicas = replica_aliases()
+        random.shuffle(replicas)
+        alias = next((alias for alias in replicas if is_healthy(alias)), DEFAULT_DB_ALIAS)
+        if alias != DEFAULT_DB_ALIAS:
+            state.replica_reads += 1
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы, объекты из них можно связывать
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return False if db in replica_aliases() else None
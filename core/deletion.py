@@ -0,0 +1,144 @@
+"""
+Удаление в два шага.
+
+Запрос только помечает пин, доску или аккаунт удалёнными (deleted_at, is_active=False) — всё сразу
+пропадает из выдачи: менеджер objects у Pin и Board их не видит. Строки вычищает run_deletions
+пачками по BATCH_SIZE прямыми DELETE ... WHERE id IN (...), без загрузки объектов и каскадов ORM.
+То, что при обычном delete() делают сигналы (индекс поиска, ссылки на файлы, счётчики досок, кэш
+фрагментов), делается явно для всей пачки. Файлы без ссылок удаляются после коммита (blobs.release_many).
+"""
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.utils import timezone
+from taggit.models import TaggedItem
+
+from . import blobs, boards, fragments, tagstats, viewer
+from .models import AccountDeletion, Board, MediaJob, Pin, Profile, SearchHistory, SearchIndexEntry, User
+
+BATCH_SIZE = 500
+
+Membership = Board.pins.through
+
+
+def _raw_delete(queryset):
+    # Один DELETE по условию queryset: без выборки строк, сигналов и каскадов
+    return queryset._raw_delete(queryset.db)
+
+
+def _untag(pins):
+    """Пины пропали из выдачи — снимаем их со счётчиков тегов (TagCount) одним запросом."""
+    counts = Counter(
+        TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Pin), object_id__in=pins.values('pk'))
+        .values_list('tag_id', flat=True)
+    )
+    if counts:
+        tagstats.record_untagged_many(counts)
+
+
+# --- Мгновенная часть: вызывается из view ---
+
+def delete_pin(pin):
+    with transaction.atomic():
+        pins = Pin.objects.filter(pk=pin.pk)
+        _untag(pins)
+        if not pins.update(deleted_at=timezone.now()):
+            return
+        board_ids = list(Membership.objects.filter(pin_id=pin.pk).values_list('board_id', flat=True))
+        boards.refresh(board_ids)
+        fragments.invalidate_pin(pin)
+
+
+def delete_board(board):
+    Board.objects.filter(pk=board.pk).update(deleted_at=timezone.now())
+    fragments.invalidate_board(board.pk, board.user_id)
+    viewer.invalidate(board.user_id)  # update() не шлёт post_save: убираем доску из «Сохранить в доску»
+
+
+def delete_account(user):
+    """
+    Закрывает вход и скрывает всё содержимое пользователя несколькими UPDATE, не трогая строк по одной.
+    Счётчики чужих досок с его пинами пересчитает run_deletions, когда будет удалять связи.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # is_active=False: ModelBackend больше не пускает и по уже выданным сессиям
+        User.objects.filter(pk=user.pk).update(is_active=False)
+        AccountDeletion.objects.get_or_create(user=user)
+        pins = Pin.objects.filter(user=user)
+        _untag(pins)
+        pins.update(deleted_at=now)
+        Board.objects.filter(user=user).update(deleted_at=now)
+        fragments.bump(fragments.USER, user.pk)
+
+
+# --- Фоновая часть: run_deletions ---
+
+def purge_pins(pin_ids):
+    """Вычищает пачку пинов и всё, что на них ссылается."""
+    pin_ids = list(pin_ids)
+    with transaction.atomic():
+        references = Counter(
+            name
+            for names in Pin.all_objects.filter(pk__in=pin_ids).values_list('image', 'video', 'poster')
+            for name in names if name
+        )
+        board_ids = set(Membership.objects.filter(pin_id__in=pin_ids).values_list('board_id', flat=True))
+        _raw_delete(Membership.objects.filter(pin_id__in=pin_ids))
+        _raw_delete(TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Pin), object_id__in=pin_ids))
+        _raw_delete(MediaJob.objects.filter(pin_id__in=pin_ids))
+        _raw_delete(SearchIndexEntry.objects.filter(kind=SearchIndexEntry.KIND_PIN, object_id__in=pin_ids))
+        deleted = _raw_delete(Pin.all_objects.filter(pk__in=pin_ids))
+        blobs.release_many(references)
+        boards.refresh(board_ids)
+        for board_id, owner_id in Board.objects.filter(pk__in=board_ids).values_list('pk', 'user_id'):
+            fragments.invalidate_board(board_id, owner_id)
+    return deleted
+
+
+def purge_boards(board_ids):
+    board_ids = list(board_ids)
+    with transaction.atomic():
+        _raw_delete(Membership.objects.filter(board_id__in=board_ids))
+        _raw_delete(SearchIndexEntry.objects.filter(kind=SearchIndexEntry.KIND_BOARD, object_id__in=board_ids))
+        return _raw_delete(Board.all_objects.filter(pk__in=board_ids))
+
+
+def purge_account(user, batch_size=BATCH_SIZE):
+    """
+    Вызывается, когда пины и доски пользователя уже вычищены: история поиска — пачками,
+    остальное (профиль, статистика, интересы, незаконченные загрузки) мало — обычным delete().
+    """
+    while True:
+        pks = list(SearchHistory.objects.filter(user=user).values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            break
+        _raw_delete(SearchHistory.objects.filter(pk__in=pks))
+    profile = Profile.objects.filter(user=user).first()
+    if profile is not None:
+        profile.delete()  # post_delete снимет ссылку на аватар
+    user.delete()
+
+
+def run_once(batch_size=BATCH_SIZE):
+    """
+    Одна пачка работы: удалённые пины, потом доски, потом аккаунты, у которых больше ничего не осталось.
+    Возвращает {что: сколько удалено}; пустой словарь — делать нечего.
+    """
+    pin_ids = list(Pin.all_objects.filter(deleted_at__isnull=False).values_list('pk', flat=True)[:batch_size])
+    if pin_ids:
+        return {'pins': purge_pins(pin_ids)}
+    board_ids = list(Board.all_objects.filter(deleted_at__isnull=False).values_list('pk', flat=True)[:batch_size])
+    if board_ids:
+        return {'boards': purge_boards(board_ids)}
+    deletion = AccountDeletion.objects.select_related('user').order_by('requested_at').first()
+    if deletion is None:
+        return {}
+    user = deletion.user
+    if Pin.objects.filter(user=user).exists() or Board.objects.filter(user=user).exists():
+        # Пины и доски, созданные уже после запроса на удаление (загрузка шла параллельно)
+        delete_account(user)
+        return {'accounts': 0}
+    purge_account(user)
+    return {'accounts': 1}
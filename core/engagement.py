@@ -0,0 +1,193 @@
+import atexit
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, F, FloatField, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Pin
+
+# Популярность = log2(1 + вовлечённость) + возраст / период полураспада (как у Reddit):
+# пин на POPULARITY_HALF_LIFE_HOURS новее равен пину с вдвое большей вовлечённостью.
+# Старые пины «остывают» сами по себе, пересчитывать все оценки по расписанию не нужно —
+# только при изменении счётчиков пина (и не чаще раза в снимок, см. publish).
+EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+# Показ в ленте — слабый сигнал (наверху ленты пин как раз потому, что популярен), сохранение — сильный
+VIEW_WEIGHT = 0.1
+SAVE_WEIGHT = 10
+# Строк в одном UPDATE ... CASE
+FLUSH_CHUNK = 500
+# Оценки пересчитываются раз в снимок, а лента весь снимок видит оценки до пересчёта: порядок
+# неподвижен, и курсор ленты не пропускает и не повторяет пины (core/feed.py)
+DEFAULT_SNAPSHOT_MINUTES = 15
+
+_lock = threading.Lock()
+_views = Counter()
+_saves = Counter()
+_flushed_at = time.monotonic()
+_published = None
+
+
+def flush_size():
+    return getattr(settings, 'ENGAGEMENT_FLUSH_SIZE', 500)
+
+
+def flush_interval():
+    return getattr(settings, 'ENGAGEMENT_FLUSH_INTERVAL', 10)
+
+
+def half_life_seconds():
+    return getattr(settings, 'POPULARITY_HALF_LIFE_HOURS', 72) * 3600
+
+
+def snapshot_seconds():
+    return getattr(settings, 'POPULARITY_SNAPSHOT_MINUTES', DEFAULT_SNAPSHOT_MINUTES) * 60
+
+
+def current_snapshot(now=None):
+    """Номер снимка оценок: сколько целых периодов POPULARITY_SNAPSHOT_MINUTES прошло с EPOCH."""
+    return int(((now or time.time()) - EPOCH.timestamp()) // snapshot_seconds())
+
+
+def score(views, saves, created_at):
+    engagement = views * VIEW_WEIGHT + saves * SAVE_WEIGHT
+    return math.log2(1 + engagement) + (created_at - EPOCH).total_seconds() / half_life_seconds()
+
+
+def record_views(pin_ids):
+    """Пины показали в ленте. Только счётчик в памяти процесса — в БД попадёт пачкой при flush()."""
+    with _lock:
+        _views.update(pin_ids)
+
+
+def record_saves(pin_ids):
+    """Пины сохранили в доски (повторы в pin_ids — несколько сохранений)."""
+    with _lock:
+        _saves.update(pin_ids)
+
+
+def flush_due():
+    with _lock:
+        pending = len(_views.keys() | _saves.keys())
+    return pending >= flush_size() or (pending and time.monotonic() - _flushed_at >= flush_interval())
+
+
+def flush():
+    """
+    Прибавляет накопленные показы и сохранения одним UPDATE на пачку пинов. Оценку пересчитает
+    publish() на границе следующего снимка — до неё пин помечен pending_snapshot.
+    """
+    global _flushed_at
+    with _lock:
+        views, saves = _views.copy(), _saves.copy()
+        _views.clear()
+        _saves.clear()
+        _flushed_at = time.monotonic()
+    pks = sorted(views.keys() | saves.keys())
+    snapshot = current_snapshot()
+    for start in range(0, len(pks), FLUSH_CHUNK):
+        chunk = pks[start:start + FLUSH_CHUNK]
+        Pin.objects.filter(pk__in=chunk).update(
+            view_count=F('view_count') + _case(chunk, views),
+            save_count=F('save_count') + _case(chunk, saves),
+            # Уже ждущий пересчёта пин оставляем в раннем снимке: его оценку опубликует ближайшая граница
+            pending_snapshot=Coalesce('pending_snapshot', Value(snapshot)),
+        )
+    return len(pks)
+
+
+def _case(pks, counts):
+    whens = [When(pk=pk, then=Value(counts[pk])) for pk in pks if counts[pk]]
+    if not whens:
+        return Value(0)
+    return Case(*whens, default=Value(0), output_field=IntegerField())
+
+
+def publish(snapshot=None):
+    """
+    Пересчитывает оценку пинов, чьи счётчики изменились в прошлых снимках. Зовётся после ответа
+    (сигнал request_finished, core/signals.py), а не при отрисовке ленты; из любого процесса и сколько
+    угодно раз — результат тот же, а в пределах снимка процесс проверяет это одним запросом.
+    """
+    global _published
+    snapshot = current_snapshot() if snapshot is None else snapshot
+    if _published == snapshot:
+        return 0
+    last_pk, total = 0, 0
+    while True:
+        pending = _publishable(Pin.objects.filter(pk__gt=last_pk), snapshot).order_by('pk')
+        pks = list(pending.values_list('pk', flat=True)[:FLUSH_CHUNK])
+        if not pks:
+            break
+        with transaction.atomic():
+            total += rescore(pks, snapshot)
+        last_pk = pks[-1]
+    _published = snapshot
+    return total
+
+
+def _publishable(queryset, snapshot):
+    # Пин переоценивается не чаще раза в два снимка: тогда previous_popularity — оценка и в текущем,
+    # и в прошлом снимке, и курсор из прошлого снимка продолжает свой порядок (core/feed.py).
+    # Пропущенные пины остаются pending и попадут в следующий снимок
+    return queryset.filter(
+        Q(scored_snapshot__lt=snapshot - 1) | Q(scored_snapshot__isnull=True),
+        pending_snapshot__lt=snapshot,
+    )
+
+
+def rescore(pks, snapshot=None, force=False):
+    """
+    Пересчитывает popularity пинов одним UPDATE ... CASE, прежнюю оценку сохраняет в previous_popularity.
+    Без force условие publish() повторяется в самом UPDATE: второй процесс, выбравший те же пины,
+    ничего не меняет (и не затирает previous_popularity уже новой оценкой). С force оценка действует
+    в ленте сразу (scored_snapshot пустой, как у нового пина).
+    """
+    snapshot = current_snapshot() if snapshot is None else snapshot
+    rows = Pin.objects.filter(pk__in=pks).values_list('pk', 'view_count', 'save_count', 'created_at')
+    scores = {pk: score(views, saves, created_at) for pk, views, saves, created_at in rows}
+    if not scores:
+        return 0
+    pins = Pin.objects.filter(pk__in=scores)
+    if not force:
+        pins = _publishable(pins, snapshot)
+    # previous_popularity первым: MySQL присваивает слева направо и видит уже новые значения
+    return pins.update(
+        previous_popularity=F('popularity'),
+        popularity=Case(*[When(pk=pk, then=Value(value)) for pk, value in scores.items()],
+                        output_field=FloatField()),
+        scored_snapshot=None if force else snapshot,
+        pending_snapshot=None,
+    )
+
+
+atexit.register(flush)
+
+
+def rescore_all(from_boards=False, batch_size=FLUSH_CHUNK):
+    """
+    Пересчитывает оценку всех пинов — после смены POPULARITY_HALF_LIFE_HOURS или весов.
+    from_boards: взять save_count из числа досок с пином (для данных, собранных до появления счётчиков).
+    """
+    last_pk, total = 0, 0
+    while True:
+        pks = list(Pin.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return total
+        with transaction.atomic():
+            if from_boards:
+                saved = dict(
+                    Pin.boards.through.objects.filter(pin_id__in=pks)
+                    .values('pin_id').annotate(boards=Count('board_id')).values_list('pin_id', 'boards')
+                )
+                Pin.objects.filter(pk__in=pks).update(save_count=Case(
+                    *[When(pk=pk, then=Value(count)) for pk, count in saved.items()],
+                    default=Value(0), output_field=IntegerField(),
+                ))
+            total += rescore(pks, force=True)
+        last_pk = pks[-1]
@@ -0,0 +1,122 @@
+import base64
+
+from django.db.models import Case, When, Value, IntegerField, Exists, OuterRef, Q, prefetch_related_objects
+from taggit.models import TaggedItem
+
+from . import engagement
+from .models import Pin
+from .search import get_backend
+
+# Сколько пинов отдаём за одну страницу ленты (и за одну подгрузку при скролле)
+FEED_PAGE_SIZE = 24
+
+# Корзины релевантности: сначала пины по интересам, потом все остальные
+BUCKET_RELEVANT = 0
+BUCKET_OTHER = 1
+
+
+def encode_cursor(snapshot, pin, popularity):
+    """Курсор = (снимок оценок, корзина, popularity, id) последнего пина страницы."""
+    raw = f"{snapshot}|{pin.relevance_bucket}|{popularity!r}|{pin.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Возвращает (snapshot, bucket, popularity, id) или None, если курсор пустой/битый."""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        snapshot, bucket, popularity, pk = raw.split('|')
+        return int(snapshot), int(bucket), float(popularity), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def feed_queryset(viewer, query=None, interest_tags=(), interest_users=(), related_pins=()):
+    """
+    Лента для пользователя: чужие пины, отсортированные по
+    (relevance_bucket, -popularity, -id). popularity учитывает и свежесть пина,
+    и показы с сохранениями (core/engagement.py). Ничего не загружает в память —
+    только строит запрос, страницы режет paginate() (она же подгружает теги).
+    """
+    # В ленту попадают только обработанные пины (см. core/media.py)
+    pins = Pin.objects.exclude(user=viewer).filter(processing_status=Pin.STATUS_READY)
+
+    if query:
+        # Ранжированный поиск: relevance_bucket = -score, см. core/search.py
+        pins = get_backend().search_pins(pins, query)
+    else:
+        relevant = Q()
+        if related_pins:
+            # Похожие на сохранённые пользователем (core/related.py)
+            relevant |= Q(pk__in=related_pins)
+        if interest_users:
+            relevant |= Q(user__id__in=interest_users)
+        if interest_tags:
+            relevant |= Exists(TaggedItem.objects.filter(
+                object_id=OuterRef('pk'),
+                content_type__app_label='core',
+                content_type__model='pin',
+                tag__name__in=interest_tags,
+            ))
+        if relevant:
+            bucket = Case(
+                When(relevant, then=Value(BUCKET_RELEVANT)),
+                default=Value(BUCKET_OTHER),
+                output_field=IntegerField(),
+            )
+        else:
+            bucket = Value(BUCKET_OTHER, output_field=IntegerField())
+        pins = pins.annotate(relevance_bucket=bucket)
+
+    return (
+        pins
+        .select_related('user', 'user__profile')
+        .order_by('relevance_bucket', '-popularity', '-id')
+    )
+
+
+def _after(queryset, position, field):
+    _, bucket, popularity, pk = position
+    return queryset.filter(
+        Q(relevance_bucket__gt=bucket)
+        | Q(relevance_bucket=bucket, **{f'{field}__lt': popularity})
+        | Q(relevance_bucket=bucket, **{field: popularity}, id__lt=pk)
+    )
+
+
+def paginate(queryset, cursor=None, page_size=FEED_PAGE_SIZE):
+    """
+    Keyset-пагинация: берём page_size + 1 строк после курсора.
+    Возвращает (список пинов, курсор следующей страницы или None).
+
+    Весь снимок лента видит оценки, какими они были до его пересчёта (engagement.publish идёт после
+    ответа, когда-то внутри снимка): у пинов, переоценённых в этом снимке, — previous_popularity.
+    Поэтому внутри снимка порядок неподвижен, сколько бы ни пересчитывали. Пин переоценивается не чаще
+    раза в два снимка, так что курсор из предыдущего снимка продолжает свой порядок так же;
+    курсор старше — продолжается по оценкам текущего снимка.
+    """
+    snapshot = engagement.current_snapshot()
+    position = decode_cursor(cursor)
+    if position and position[0] >= snapshot - 1:
+        snapshot = position[0]
+    # Переоценённых в снимке немного — их берём отдельным запросом по индексу scored_snapshot,
+    # остальные идут по индексу popularity, и две отсортированные выборки сливаются
+    kept = queryset.filter(Q(scored_snapshot__lt=snapshot) | Q(scored_snapshot__isnull=True))
+    moved = queryset.filter(scored_snapshot__gte=snapshot).order_by('relevance_bucket', '-previous_popularity', '-id')
+    if position:
+        kept = _after(kept, position, 'popularity')
+        moved = _after(moved, position, 'previous_popularity')
+    scored = [(pin, pin.popularity) for pin in kept[:page_size + 1]]
+    scored += [(pin, pin.previous_popularity) for pin in moved[:page_size + 1]]
+    scored.sort(key=lambda item: (item[0].relevance_bucket, -item[1], -item[0].pk))
+
+    next_cursor = None
+    if len(scored) > page_size:
+        scored = scored[:page_size]
+        next_cursor = encode_cursor(snapshot, *scored[-1])
+    pins = [pin for pin, _ in scored]
+    # Теги — одним запросом на страницу, а не на каждую из двух выборок
+    prefetch_related_objects(pins, 'tags')
+    return pins, next_cursor
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import deque
+
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils.text import slugify
+
+from .models import ForbiddenTag
+
+# Версия списка запрещённых тегов берётся из самой таблицы (число строк, последний id, время
+# последней правки) — её видят все процессы. Процесс сверяет её не чаще раза в VERSION_CHECK_INTERVAL
+# секунд и пересобирает матчер только при расхождении; правки в своём процессе видны сразу (bump_version).
+VERSION_CHECK_INTERVAL = 5
+
+_lock = threading.Lock()
+_matcher = None
+_matcher_version = None
+_checked_at = 0
+
+
+class ForbiddenTagsError(ValidationError):
+    """Среди тегов пина есть запрещённые. Формы показывают её у поля tags, views — как ошибку ввода."""
+
+    def __init__(self, forbidden):
+        self.forbidden = list(forbidden)
+        super().__init__(f'Запрещённые теги: {", ".join(self.forbidden)}. Пин не сохранён.')
+
+
+def normalize(tag):
+    return tag.strip().lower().replace('ё', 'е')
+
+
+class ForbiddenTagMatcher:
+    """
+    Скомпилированный список запрещённых тегов.
+    Форматы записей ForbiddenTag.tag:
+        'тег'    — точное совпадение
+        'тег*'   — тег начинается с 'тег'
+        '*тег'   — тег заканчивается на 'тег'
+        '*тег*'  — 'тег' встречается где угодно
+    Префиксы, суффиксы и подстроки ищутся одним проходом автомата Ахо–Корасик.
+    """
+
+    EXACT, PREFIX, SUFFIX, SUBSTRING = 'exact', 'prefix', 'suffix', 'substring'
+
+    def __init__(self, patterns):
+        self.exact = {}
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for raw in patterns:
+            pattern = normalize(raw)
+            if pattern.startswith('*') and pattern.endswith('*') and len(pattern) > 2:
+                self._add(pattern[1:-1], self.SUBSTRING, raw)
+            elif pattern.endswith('*') and len(pattern) > 1:
+                self._add(pattern[:-1], self.PREFIX, raw)
+            elif pattern.startswith('*') and len(pattern) > 1:
+                self._add(pattern[1:], self.SUFFIX, raw)
+            elif pattern.strip('*'):
+                self.exact[pattern] = raw
+        self._build()
+
+    def _add(self, word, kind, raw):
+        state = 0
+        for char in word:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append((len(word), kind, raw))
+
+    def _build(self):
+        # Ссылки неудач строим обходом в ширину
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def match(self, tag):
+        """Возвращает запись ForbiddenTag, под которую попал тег, или None."""
+        tag = normalize(tag)
+        if tag in self.exact:
+            return self.exact[tag]
+        state = 0
+        for position, char in enumerate(tag):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for length, kind, raw in self.output[state]:
+                if (
+                    kind == self.SUBSTRING
+                    or (kind == self.PREFIX and position + 1 == length)
+                    or (kind == self.SUFFIX and position + 1 == len(tag))
+                ):
+                    return raw
+        return None
+
+    def find(self, tags):
+        """Список запрещённых тегов из переданных (сверяем и имя, и слаг тега)."""
+        return [
+            tag for tag in tags
+            if self.match(tag) is not None or self.match(slugify(tag, allow_unicode=True)) is not None
+        ]
+
+
+def current_version():
+    return tuple(ForbiddenTag.objects.aggregate(Count('pk'), Max('pk'), Max('updated_at')).values())
+
+
+def bump_version():
+    """Список изменили в этом процессе: сверить версию при следующей проверке, не дожидаясь интервала."""
+    global _checked_at
+    _checked_at = 0
+
+
+def get_matcher():
+    """Матчер текущей версии. Список из БД загружается только когда он изменился."""
+    global _matcher, _matcher_version, _checked_at
+    if _matcher is not None and time.monotonic() - _checked_at < VERSION_CHECK_INTERVAL:
+        return _matcher
+    version = current_version()
+    with _lock:
+        if _matcher is None or version != _matcher_version:
+            patterns = ForbiddenTag.objects.exclude(tag__exact='').values_list('tag', flat=True)
+            _matcher = ForbiddenTagMatcher(patterns)
+            _matcher_version = version
+        _checked_at = time.monotonic()
+    return _matcher
+
+
+def find_forbidden(tags):
+    return get_matcher().find(tags)
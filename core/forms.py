@@ -2,6 +2,7 @@ from django import forms
 from django.contrib.auth.models import User
 from django.contrib.auth.forms import UserCreationForm
 from .models import Pin, Board, Profile
+from .forbidden import ForbiddenTagsError, find_forbidden
 
 # Новая форма регистрации
 class RegisterForm(UserCreationForm):
@@ -35,11 +36,10 @@ class RegisterForm(UserCreationForm):
         user.email = self.cleaned_data['email']
         if commit:
             user.save()
-            # Создаём/обновляем профиль с ником
-            Profile.objects.update_or_create(
-                user=user,
-                defaults={'display_name': self.cleaned_data['display_name']}
-            )
+            # Профиль уже создан сигналом post_save (core/signals.py) — записываем ник
+            profile = user.profile
+            profile.display_name = self.cleaned_data['display_name']
+            profile.save()
         return user
 
 # Верни старые формы — они нужны для загрузки пинов и досок
@@ -51,6 +51,14 @@ class PinForm(forms.ModelForm):
             'tags': forms.TextInput(attrs={'placeholder': 'Введите теги через запятую, например: осень, природа'}),
         }
 
+    def clean_tags(self):
+        # Проверяем теги до сохранения: отклонённый пин не пишется в БД вообще
+        tags = self.cleaned_data['tags']
+        forbidden = find_forbidden(tags)
+        if forbidden:
+            raise ForbiddenTagsError(forbidden)
+        return tags
+
 
 # В forms.py добавьте/исправьте BoardForm для показа только своих пинов
 class BoardForm(forms.ModelForm):
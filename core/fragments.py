@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+from . import db
+
+# Версия у каждого пользователя и каждой доски. Ключ фрагмента включает версии всего,
+# от чего он зависит: после изменения старые записи просто перестают читаться
+# и вытесняются по таймауту, удалять их по одной не нужно.
+VERSION_KEY = 'core:fragments:{kind}:{pk}:version'
+FRAGMENT_KEY = 'core:fragments:{name}:{variant}:{versions}'
+
+USER = 'user'
+BOARD = 'board'
+# Профиль и доски зрителя (core/viewer.py): меняются реже, чем пины пользователя
+VIEWER = 'viewer'
+
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+
+def _version_key(kind, pk):
+    return VERSION_KEY.format(kind=kind, pk=pk)
+
+
+def versions(*deps):
+    """Текущие версии зависимостей [(kind, pk), ...] одним запросом к кэшу."""
+    keys = [_version_key(kind, pk) for kind, pk in deps]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), timeout=None)
+            found[key] = cache.get(key)
+    return [found[key] for key in keys]
+
+
+def bump(kind, pk):
+    key = _version_key(kind, pk)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Ключа нет (кэш очищен) — любое новое значение делает старые фрагменты недоступными
+        cache.set(key, time.time_ns(), timeout=None)
+
+
+def invalidate_board(board_id, owner_id):
+    # Доска видна и на своей странице, и в профиле владельца
+    bump(BOARD, board_id)
+    bump(USER, owner_id)
+
+
+def invalidate_pin(pin):
+    """Пин показывается в профиле автора и на всех досках, куда его добавили."""
+    from .models import Board
+
+    bump(USER, pin.user_id)
+    for board_id, owner_id in Board.objects.filter(pins=pin).values_list('pk', 'user_id'):
+        invalidate_board(board_id, owner_id)
+
+
+def get_or_render(name, deps, render, variant=''):
+    """
+    Значение из кэша или результат render() — HTML фрагмента, число или другой объект для кэша.
+    variant различает версии для разных зрителей (например, 'owner' и 'public').
+    """
+    key = FRAGMENT_KEY.format(
+        name=name, variant=variant,
+        versions='.'.join(f'{kind}{pk}-{version}' for (kind, pk), version in zip(deps, versions(*deps))),
+    )
+    value = cache.get(key)
+    with _stats_lock:
+        _stats['hits' if value is not None else 'misses'] += 1
+    if value is None:
+        replica_reads = db.replica_reads()
+        value = render()
+        timeout = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600)
+        if db.replica_reads() > replica_reads:
+            # Отрисовано по реплике: она могла ещё не получить изменение, из-за которого сменилась
+            # версия, — храним не дольше допустимого отставания, чтобы не закрепить старые данные
+            timeout = min(timeout, db.max_lag())
+        cache.set(key, value, timeout)
+    return value
+
+
+def stats():
+    """Счётчики попаданий и промахов этого процесса."""
+    with _stats_lock:
+        hits, misses = _stats['hits'], _stats['misses']
+    total = hits + misses
+    return {'hits': hits, 'misses': misses, 'hit_ratio': round(hits / total, 3) if total else None}
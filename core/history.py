@@ -0,0 +1,175 @@
+import atexit
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, Max, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import interests, tagstats
+from .models import SearchHistory, SearchQueryStat
+
+# Сырые записи SearchHistory храним столько, дальше остаётся только SearchQueryStat
+RETENTION = timedelta(days=90)
+RECENT_LIMIT = 10
+# Сколько пользователей помнить для склейки повторов подряд
+LAST_QUERIES_SIZE = 10000
+# Повтор склеивается, если с прошлого такого же запроса прошло меньше этого (обновление страницы,
+# прокрутка ленты продлевают окно); тот же запрос позже — уже новый поиск
+REPEAT_WINDOW = timedelta(minutes=1)
+SPACES_RE = re.compile(r'\s+')
+
+_lock = threading.Lock()
+_buffer = []
+_last_query = OrderedDict()
+_flushed_at = time.monotonic()
+
+
+def flush_size():
+    return getattr(settings, 'SEARCH_HISTORY_FLUSH_SIZE', 100)
+
+
+def flush_interval():
+    return getattr(settings, 'SEARCH_HISTORY_FLUSH_INTERVAL', 5)
+
+
+def normalize(query):
+    return SPACES_RE.sub(' ', query.strip().lower())[:200]
+
+
+def record(user, query, now=None):
+    """
+    Запоминает поиск в буфере процесса. Тот же запрос подряд от того же пользователя в пределах
+    REPEAT_WINDOW (обновление страницы, прокрутка ленты) не пишется повторно.
+    Буфер сбрасывается пачкой при FLUSH_SIZE записях или раз в FLUSH_INTERVAL секунд.
+    """
+    key = normalize(query)
+    if not key:
+        return
+    now = now or timezone.now()
+    with _lock:
+        last_key, last_seen = _last_query.get(user.pk, (None, None))
+        _last_query[user.pk] = (key, now)
+        _last_query.move_to_end(user.pk)
+        if last_key == key and now - last_seen < REPEAT_WINDOW:
+            return
+        if len(_last_query) > LAST_QUERIES_SIZE:
+            _last_query.popitem(last=False)
+        _buffer.append(SearchHistory(user=user, query=query[:200], timestamp=now))
+        due = len(_buffer) >= flush_size()
+    if due or flush_due():
+        flush()
+
+
+def flush_due():
+    return bool(_buffer) and time.monotonic() - _flushed_at >= flush_interval()
+
+
+def flush():
+    """Пишет накопленные поиски одним bulk_create и обновляет сжатую статистику."""
+    global _flushed_at
+    with _lock:
+        items = _buffer[:]
+        _buffer.clear()
+        _flushed_at = time.monotonic()
+    if not items:
+        return 0
+    with transaction.atomic():
+        SearchHistory.objects.bulk_create(items)
+        _update_stats(items)
+    # bulk_create не шлёт post_save — интересы и статистику тегов обновляем сами:
+    # интересы — одной записью на пользователя за всю пачку
+    by_user = defaultdict(list)
+    for item in items:
+        by_user[item.user_id].append((item.query, item.timestamp))
+        tagstats.record_search(item.query, now=item.timestamp)
+    author_cache = {}
+    for user_id, searches in by_user.items():
+        interests.record_searches(user_id, searches, author_cache)
+    return len(items)
+
+
+def _update_stats(items):
+    counts = Counter()
+    last_searched = {}
+    for item in items:
+        key = (item.user_id, normalize(item.query))
+        counts[key] += 1
+        last_searched[key] = max(last_searched.get(key, item.timestamp), item.timestamp)
+    SearchQueryStat.objects.bulk_create(
+        [SearchQueryStat(user_id=user_id, query=query, last_searched=last_searched[user_id, query])
+         for user_id, query in counts],
+        ignore_conflicts=True,
+    )
+    condition = Q()
+    for user_id, query in counts:
+        condition |= Q(user_id=user_id, query=query)
+    ids = {
+        (user_id, query): pk
+        for pk, user_id, query in SearchQueryStat.objects.filter(condition).values_list('pk', 'user_id', 'query')
+    }
+    # Все строки пачки — одним UPDATE с CASE по id
+    SearchQueryStat.objects.filter(pk__in=ids.values()).update(
+        count=F('count') + Case(
+            *[When(pk=pk, then=Value(counts[key])) for key, pk in ids.items()],
+            default=Value(0), output_field=IntegerField(),
+        ),
+        last_searched=Greatest('last_searched', Case(
+            *[When(pk=pk, then=Value(last_searched[key])) for key, pk in ids.items()],
+            output_field=DateTimeField(),
+        )),
+    )
+
+
+atexit.register(flush)
+
+
+def recent_searches(user, limit=RECENT_LIMIT):
+    """Последние разные запросы пользователя — из сжатой статистики, одним запросом по индексу."""
+    return list(
+        SearchQueryStat.objects.filter(user=user).order_by('-last_searched')
+        .values('query', 'count', 'last_searched')[:limit]
+    )
+
+
+def rollup(now=None, batch_size=5000):
+    """Удаляет сырые записи старше RETENTION: всё нужное уже учтено в SearchQueryStat."""
+    cutoff = (now or timezone.now()) - RETENTION
+    removed = 0
+    while True:
+        pks = list(SearchHistory.objects.filter(timestamp__lt=cutoff).values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return removed
+        removed += SearchHistory.objects.filter(pk__in=pks).delete()[0]
+
+
+def rebuild_stats():
+    """
+    Пересчитывает SearchQueryStat по всей оставшейся SearchHistory. Нужен один раз для истории,
+    записанной до появления статистики, — после удаления старых записей счётчики уменьшатся.
+    """
+    rows = (
+        SearchHistory.objects.values('user_id', 'query')
+        .annotate(total=Count('pk'), last=Max('timestamp'))
+        .values_list('user_id', 'query', 'total', 'last')
+    )
+    stats = {}
+    for user_id, query, total, last in rows.iterator(5000):
+        key = (user_id, normalize(query))
+        count, previous = stats.get(key, (0, last))
+        stats[key] = (count + total, max(previous, last))
+    with transaction.atomic():
+        SearchQueryStat.objects.all().delete()
+        SearchQueryStat.objects.bulk_create(
+            [
+                SearchQueryStat(user_id=user_id, query=query, count=count, last_searched=last)
+                for (user_id, query), (count, last) in stats.items()
+            ],
+            batch_size=1000,
+        )
+    return len(stats)
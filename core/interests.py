@@ -0,0 +1,147 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .models import SearchHistory, UserInterest
+
+# Вес интереса уменьшается вдвое за это время
+HALF_LIFE_DAYS = 14
+# Сколько тегов/авторов храним на пользователя
+MAX_ENTRIES = 50
+# Интересы слабее этого порога лента не учитывает
+MIN_WEIGHT = 0.05
+# Сколько авторов максимум привязываем к одному поисковому запросу
+MAX_AUTHORS_PER_QUERY = 20
+
+
+def decay_factor(since, now):
+    days = max((now - since).total_seconds(), 0) / 86400
+    return 0.5 ** (days / HALF_LIFE_DAYS)
+
+
+def parse_query(query, author_cache=None):
+    """
+    Разбирает поисковый запрос: '#тег' -> ([тег], []),
+    иначе -> ([], id пользователей, чей логин содержит запрос).
+    """
+    q = query.strip().lower()
+    if not q or q == '#':
+        return [], []
+    if q.startswith('#'):  # Если как тег
+        return [q[1:]], []
+
+    if author_cache is not None and q in author_cache:
+        return [], author_cache[q]
+    author_ids = list(
+        User.objects.filter(username__icontains=q).values_list('id', flat=True)[:MAX_AUTHORS_PER_QUERY]
+    )
+    if author_cache is not None:
+        author_cache[q] = author_ids
+    return [], author_ids
+
+
+def _add(weights, keys, amount):
+    for key in keys:
+        key = str(key)
+        weights[key] = weights.get(key, 0) + amount
+
+
+def _decay(weights, factor):
+    return {key: value * factor for key, value in weights.items()}
+
+
+def _trim(weights):
+    # Оставляем самые сильные интересы и выбрасываем выдохшиеся
+    top = sorted(weights.items(), key=lambda item: item[1], reverse=True)[:MAX_ENTRIES]
+    return {key: round(value, 4) for key, value in top if value >= MIN_WEIGHT}
+
+
+def record_search(user, query, now=None):
+    """Инкрементально обновляет UserInterest после одного поиска."""
+    record_searches(user.pk, [(query, now or timezone.now())])
+
+
+def record_searches(user_id, searches, author_cache=None):
+    """
+    Учитывает пачку поисков одного пользователя [(запрос, время)] — одним UPDATE строки UserInterest.
+    Порядок тот же, что при поиске по одному: затухание до времени запроса, затем +1.
+    """
+    parsed = []
+    for query, moment in sorted(searches, key=lambda search: search[1]):
+        tags, authors = parse_query(query, author_cache)
+        if tags or authors:
+            parsed.append((tags, authors, moment))
+    if not parsed:
+        return
+
+    with transaction.atomic():
+        interest, created = UserInterest.objects.select_for_update().get_or_create(
+            user_id=user_id, defaults={'updated_at': parsed[0][2]}
+        )
+        for tags, authors, moment in parsed:
+            factor = decay_factor(interest.updated_at, moment)
+            interest.tags = _decay(interest.tags, factor)
+            interest.authors = _decay(interest.authors, factor)
+            _add(interest.tags, tags, 1.0)
+            _add(interest.authors, authors, 1.0)
+            interest.updated_at = max(interest.updated_at, moment)
+        interest.tags = _trim(interest.tags)
+        interest.authors = _trim(interest.authors)
+        interest.save()
+
+
+def interests_for(user):
+    """Одна строка на запрос: (теги, id авторов) для ленты."""
+    interest = UserInterest.objects.filter(user=user).only('tags', 'authors').first()
+    if interest is None:
+        return set(), set()
+    tags = {tag for tag, weight in interest.tags.items() if weight >= MIN_WEIGHT}
+    authors = {int(pk) for pk, weight in interest.authors.items() if weight >= MIN_WEIGHT}
+    return tags, authors
+
+
+def rebuild_interests(batch_size=500, now=None):
+    """
+    Пересчитывает UserInterest для всех пользователей по SearchHistory.
+    Историю читаем потоком, упорядоченной по пользователю, поэтому в памяти
+    только интересы одного пользователя и кэш разобранных запросов.
+    """
+    now = now or timezone.now()
+    author_cache = {}
+    batch = []
+    total = 0
+
+    def flush():
+        nonlocal total
+        UserInterest.objects.filter(user_id__in=[i.user_id for i in batch]).delete()
+        UserInterest.objects.bulk_create(batch)
+        total += len(batch)
+        batch.clear()
+
+    current_user, tags, authors = None, {}, {}
+    rows = (
+        SearchHistory.objects.order_by('user_id', 'timestamp')
+        .values_list('user_id', 'query', 'timestamp')
+        .iterator(chunk_size=2000)
+    )
+    for user_id, query, timestamp in rows:
+        if user_id != current_user:
+            if current_user is not None and (tags or authors):
+                batch.append(UserInterest(user_id=current_user, tags=_trim(tags), authors=_trim(authors), updated_at=now))
+            current_user, tags, authors = user_id, {}, {}
+            if len(batch) >= batch_size:
+                flush()
+
+        q_tags, q_authors = parse_query(query, author_cache)
+        weight = decay_factor(timestamp, now)
+        _add(tags, q_tags, weight)
+        _add(authors, q_authors, weight)
+
+    if current_user is not None and (tags or authors):
+        batch.append(UserInterest(user_id=current_user, tags=_trim(tags), authors=_trim(authors), updated_at=now))
+    if batch:
+        flush()
+
+    # У кого истории больше нет — интересы тоже не нужны
+    UserInterest.objects.exclude(user_id__in=SearchHistory.objects.values('user_id')).delete()
+    return total
@@ -0,0 +1,67 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import benchmarks
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный прогон главной, поиска, профиля, доски и добавления в доску: '
+        'p50/p95/p99, SQL-запросы на запрос, память. Отчёт сохраняется в JSON для сравнения релизов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', default='synthetic0', help='От чьего имени ходить (см. seed_synthetic)')
+        parser.add_argument('--scenarios', nargs='+', choices=benchmarks.SCENARIOS, default=list(benchmarks.SCENARIOS))
+        parser.add_argument('--requests', type=int, default=200, help='Запросов на сценарий')
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument(
+            '--server', choices=['client', 'wsgi', 'asgi'], default='client',
+            help=(
+                'client — тестовый клиент Django, wsgi/asgi — локальный HTTP-сервер в этом процессе. '
+                'Асинхронные view включает DJANGO_ASYNC_VIEWS=1'
+            ),
+        )
+        parser.add_argument('--concurrency', type=int, default=1, help='Параллельных соединений (для wsgi/asgi)')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Файл отчёта (по умолчанию var/benchmarks/<время>.json)')
+        parser.add_argument('--compare', help='Прошлый отчёт: показать изменения в процентах')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет пользователя {options["user"]}. Сначала: manage.py seed_synthetic')
+        try:
+            report = benchmarks.run(
+                user, options['scenarios'], options['requests'], options['warmup'],
+                options['server'], options['concurrency'], options['seed'],
+            )
+        except (ValueError, RuntimeError) as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'{"сценарий":<14}{"p50":>9}{"p95":>9}{"p99":>9}{"SQL/запр":>10}{"ошибок":>8}{"RSS, МБ":>9}')
+        for scenario, result in report['scenarios'].items():
+            self.stdout.write(
+                f'{scenario:<14}{result["p50_ms"]:>9.1f}{result["p95_ms"]:>9.1f}{result["p99_ms"]:>9.1f}'
+                f'{result["queries_per_request"] or 0:>10.1f}{result["errors"]:>8}{result["rss_mb"]:>9.1f}'
+            )
+
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as f:
+                baseline = json.load(f)
+            report['compared_to'] = {'revision': baseline.get('revision'), 'started_at': baseline.get('started_at')}
+            report['changes_percent'] = benchmarks.compare(report, baseline)
+            for scenario, changes in report['changes_percent'].items():
+                self.stdout.write(f'{scenario:<14}' + ', '.join(f'{key} {value:+.1f}%' for key, value in changes.items()))
+
+        output = options['output'] or os.path.join(
+            settings.BASE_DIR, 'var', 'benchmarks', f'{timezone.now():%Y%m%d-%H%M%S}.json'
+        )
+        benchmarks.save(report, output)
+        self.stdout.write(self.style.SUCCESS(f'Отчёт сохранён: {output}'))
@@ -0,0 +1,101 @@
+import random
+import statistics
+import tempfile
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taggit.models import Tag, TaggedItem
+
+from core.models import Board, Pin
+from core.related import RECENT_SAVES, RelatedModel, build, CURRENT_FILE
+
+TAG_COUNT = 2000
+PINS_PER_BOARD = 40
+
+
+class Command(BaseCommand):
+    help = 'Замеряет сборку модели похожих пинов и время ответа на синтетических данных (в откатываемой транзакции)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        # Популярность тегов и досок — по закону Ципфа, как в реальных данных
+        self.tag_weights = [1 / rank for rank in range(1, TAG_COUNT + 1)]
+
+        with transaction.atomic():
+            user, _ = User.objects.get_or_create(username='related_benchmark')
+            self.tags = [
+                Tag.objects.get_or_create(name=f'related-benchmark-{i}', defaults={'slug': f'related-benchmark-{i}'})[0]
+                for i in range(TAG_COUNT)
+            ]
+            self.content_type = ContentType.objects.get_for_model(Pin)
+            created = 0
+
+            for size in sorted(options['sizes']):
+                while created < size:
+                    count = min(options['batch_size'], size - created)
+                    self._create_pins(user, count)
+                    created += count
+
+                with tempfile.TemporaryDirectory() as directory:
+                    started = time.perf_counter()
+                    build(directory, full=True)
+                    full_time = time.perf_counter() - started
+
+                    # Небольшое изменение: один пин сохранили в новую доску
+                    board = Board.objects.create(user=user, title='benchmark')
+                    board.pins.add(*Pin.objects.filter(user=user).order_by('?')[:PINS_PER_BOARD])
+                    started = time.perf_counter()
+                    _, recomputed = build(directory)
+                    incremental_time = time.perf_counter() - started
+
+                    with open(f'{directory}/{CURRENT_FILE}') as f:
+                        model = RelatedModel(f'{directory}/{f.read().strip()}')
+                    pin_ids = list(model.index)
+                    timings = []
+                    for _ in range(options['repeat']):
+                        query = random.sample(pin_ids, min(RECENT_SAVES, len(pin_ids)))
+                        started = time.perf_counter()
+                        model.similar(query, 50)
+                        timings.append((time.perf_counter() - started) * 1000)
+                    timings.sort()
+
+                self.stdout.write(
+                    f'{size:>9} пинов: полная сборка {full_time:6.1f} с, '
+                    f'инкрементальная {incremental_time:6.1f} с ({recomputed} строк), '
+                    f'запрос p50 {statistics.median(timings):.2f} мс, p95 {timings[int(len(timings) * 0.95)]:.2f} мс'
+                )
+
+            transaction.set_rollback(True)
+
+    def _create_pins(self, user, count):
+        pins = Pin.objects.bulk_create([
+            Pin(user=user, title='benchmark', image='pins/images/benchmark.jpg') for _ in range(count)
+        ])
+        if pins[0].pk is None:
+            # Бэкенды без RETURNING (MySQL) не проставляют pk после bulk_create
+            pins = list(Pin.objects.filter(user=user).order_by('-pk')[:count])
+        TaggedItem.objects.bulk_create([
+            TaggedItem(tag=tag, content_type=self.content_type, object_id=pin.pk)
+            for pin in pins
+            for tag in set(random.choices(self.tags, self.tag_weights, k=3))
+        ])
+        # Доски — случайные подборки по ~40 пинов
+        boards = Board.objects.bulk_create([
+            Board(user=user, title='benchmark') for _ in range(count // PINS_PER_BOARD * 2)
+        ])
+        if boards and boards[0].pk is None:
+            boards = list(Board.objects.filter(user=user).order_by('-pk')[:len(boards)])
+        Board.pins.through.objects.bulk_create([
+            Board.pins.through(board_id=board.pk, pin_id=pin.pk)
+            for board in boards
+            for pin in random.sample(pins, min(PINS_PER_BOARD, len(pins)))
+        ], ignore_conflicts=True)
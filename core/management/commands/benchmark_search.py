@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taggit.models import Tag, TaggedItem
+
+from core.feed import FEED_PAGE_SIZE
+from core.models import Pin, SearchIndexEntry
+from core.search import InvertedIndexBackend, LikeSearchBackend
+
+SYLLABLES = [
+    'ко', 'ра', 'ли', 'не', 'ма', 'ос', 'ень', 'лес', 'то', 'ви', 'да', 'ру', 'ше', 'зи', 'ча',
+    'ka', 'lo', 'mi', 'ne', 'ro', 'sa', 'tu', 'vi', 'de', 'ga',
+]
+VOCABULARY_SIZE = 5000
+QUERY_RANKS = [1, 10, 100, 1000]  # Популярные и редкие слова
+
+
+def make_vocabulary(size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(random.choices(SYLLABLES, k=random.randint(2, 4))))
+    return sorted(words)
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск через инвертированный индекс и через icontains на синтетических пинах (в откатываемой транзакции)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        backends = {'like': LikeSearchBackend(), 'index': InvertedIndexBackend()}
+        # Слова выбираются по закону Ципфа: немного частых и длинный хвост редких
+        self.words = make_vocabulary(VOCABULARY_SIZE)
+        self.weights = [1 / rank for rank in range(1, VOCABULARY_SIZE + 1)]
+        queries = [self.words[rank - 1] for rank in QUERY_RANKS]
+        queries.append(f'{self.words[0]} {self.words[50]}')
+
+        # Всё создаём в транзакции и откатываем — база остаётся нетронутой
+        with transaction.atomic():
+            user, _ = User.objects.get_or_create(username='search_benchmark')
+            tags = [Tag.objects.get_or_create(name=word, defaults={'slug': word})[0] for word in self.words[:200]]
+            content_type = ContentType.objects.get_for_model(Pin)
+            created = 0
+
+            for size in sorted(options['sizes']):
+                started = time.perf_counter()
+                last_pk = Pin.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+                while created < size:
+                    count = min(options['batch_size'], size - created)
+                    self._create_pins(user, tags, content_type, count)
+                    created += count
+                generate_time = time.perf_counter() - started
+
+                started = time.perf_counter()
+                new_pins = Pin.objects.filter(pk__gt=last_pk).select_related('user').prefetch_related('tags')
+                backends['index'].index_queryset(SearchIndexEntry.KIND_PIN, new_pins, options['batch_size'])
+                index_time = time.perf_counter() - started
+
+                self.stdout.write(f'\n{size} пинов (генерация {generate_time:.1f} с, индексация {index_time:.1f} с)')
+                for query in queries:
+                    line = [f'  {query!r:22}']
+                    for name, backend in backends.items():
+                        timings = []
+                        for _ in range(options['repeat']):
+                            started = time.perf_counter()
+                            list(
+                                backend.search_pins(Pin.objects.all(), query)
+                                .order_by('relevance_bucket', '-created_at', '-id')[:FEED_PAGE_SIZE]
+                            )
+                            timings.append((time.perf_counter() - started) * 1000)
+                        line.append(f'{name}: {statistics.median(timings):8.1f} мс')
+                    self.stdout.write('  '.join(line))
+
+            transaction.set_rollback(True)
+
+    def _create_pins(self, user, tags, content_type, count):
+        pins = Pin.objects.bulk_create([
+            Pin(
+                user=user,
+                title=' '.join(random.choices(self.words, self.weights, k=3)),
+                description=' '.join(random.choices(self.words, self.weights, k=12)),
+                image='pins/images/benchmark.jpg',
+            )
+            for _ in range(count)
+        ])
+        if pins[0].pk is None:
+            # Бэкенды без RETURNING (MySQL) не проставляют pk после bulk_create
+            pins = list(Pin.objects.filter(user=user).order_by('-pk')[:count])
+        TaggedItem.objects.bulk_create([
+            TaggedItem(tag=tag, content_type=content_type, object_id=pin.pk)
+            for pin in pins
+            for tag in random.sample(tags, 2)
+        ])
@@ -0,0 +1,41 @@
+import os
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from core import assets
+
+
+def _kb(size):
+    return f'{size / 1024:.1f} КБ' if size is not None else '—'
+
+
+class Command(BaseCommand):
+    help = 'Собирает статику в STATIC_ROOT: минифицирует CSS, добавляет хэш в имена, пишет .gz и .br'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clear', action='store_true', help='Сначала удалить старую сборку')
+
+    def handle(self, *args, **options):
+        call_command('collectstatic', interactive=False, clear=options['clear'], verbosity=0)
+        if assets.brotli is None:
+            self.stdout.write(self.style.WARNING('brotli не установлен — только .gz (pip install brotli)'))
+
+        # Отчёт по нашим файлам (без статики админки): исходник → сборка → сжатые копии
+        for directory in settings.STATICFILES_DIRS:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in sorted(filenames):
+                    source = os.path.join(dirpath, filename)
+                    name = os.path.relpath(source, directory).replace(os.sep, '/')
+                    built = staticfiles_storage.stored_name(name)
+                    sizes = [
+                        staticfiles_storage.size(variant) if staticfiles_storage.exists(variant) else None
+                        for variant in (built, built + '.gz', built + '.br')
+                    ]
+                    self.stdout.write(
+                        f'{built}: {_kb(os.path.getsize(source))} → {_kb(sizes[0])} '
+                        f'(gzip {_kb(sizes[1])}, br {_kb(sizes[2])})'
+                    )
+        self.stdout.write(self.style.SUCCESS(f'Статика собрана в {settings.STATIC_ROOT}'))
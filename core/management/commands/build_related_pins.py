@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.related import TOP_K, build
+
+
+class Command(BaseCommand):
+    help = 'Собирает модель похожих пинов (по общим доскам и тегам) для блока «Похожие пины» и ленты'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Пересчитать все пины, а не только изменившиеся')
+        parser.add_argument('--k', type=int, default=TOP_K, help='Сколько похожих хранить на пин')
+        parser.add_argument('--directory', help='Куда сохранить модель (по умолчанию settings.RELATED_PINS_DIR)')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total, computed = build(options['directory'], k=options['k'], full=options['full'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Пинов: {total}, пересчитано: {computed} за {elapsed:.1f} с'))
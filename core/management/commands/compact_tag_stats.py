@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from core.tagstats import compact, rebuild_counts
+
+
+class Command(BaseCommand):
+    help = 'Сворачивает старую почасовую статистику тегов в суточную и удаляет устаревшую'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild-counts', action='store_true',
+                            help='Заодно пересчитать число пинов по тегам по taggit_taggeditem')
+
+    def handle(self, *args, **options):
+        compacted, removed = compact()
+        self.stdout.write(self.style.SUCCESS(f'Свёрнуто суток: {compacted}, удалено строк: {removed}'))
+        if options['rebuild_counts']:
+            total = rebuild_counts()
+            self.stdout.write(self.style.SUCCESS(f'Пересчитано тегов: {total}'))
@@ -0,0 +1,35 @@
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import transfer
+from core.models import Pin, User
+
+
+class Command(BaseCommand):
+    help = 'Выгружает пины пользователя в ZIP: pins.jsonl и файлы медиа (см. core/transfer.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('output', help='Файл архива; "-" — в stdout')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет пользователя {options["username"]}')
+        started = time.perf_counter()
+        if options['output'] == '-':
+            transfer.write_archive(user, sys.stdout.buffer, options['batch_size'])
+            return
+        with open(options['output'], 'wb') as out:
+            transfer.write_archive(user, out, options['batch_size'])
+        count = Pin.objects.filter(user=user).count()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Выгружено пинов: {count} ({os.path.getsize(options["output"]) / 1024 / 1024:.1f} МБ) '
+            f'за {elapsed:.1f} с, {count / elapsed if elapsed else 0:.0f} пинов/с'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from core.blobs import near_duplicates
+from core.models import MediaBlob
+
+
+class Command(BaseCommand):
+    help = 'Ищет почти одинаковые изображения (пережатые, уменьшенные копии) по перцептивному хэшу'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-distance', type=int, default=3,
+                            help='Максимальное число различающихся бит хэша (не больше 3 для поиска по полосам)')
+
+    def handle(self, *args, **options):
+        seen = set()
+        groups = 0
+        blobs = MediaBlob.objects.filter(phash__isnull=False, refcount__gt=0).order_by('pk')
+        for blob in blobs.iterator():
+            if blob.pk in seen:
+                continue
+            similar = [b for b in near_duplicates(blob, options['max_distance']) if b.pk not in seen]
+            if not similar:
+                continue
+            groups += 1
+            seen.add(blob.pk)
+            seen.update(b.pk for b in similar)
+            self.stdout.write(blob.name)
+            for other in similar:
+                self.stdout.write(f'    {other.name}')
+        self.stdout.write(self.style.SUCCESS(f'Групп похожих изображений: {groups}'))
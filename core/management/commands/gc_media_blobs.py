@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.blobs import collect_garbage
+
+
+class Command(BaseCommand):
+    help = 'Удаляет медиафайлы, на которые не ссылается ни один пин или профиль'
+
+    def handle(self, *args, **options):
+        removed = collect_garbage()
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {removed}'))
@@ -0,0 +1,46 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import transfer
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует пины из архива export_pins (или pins.jsonl с каталогом media/ рядом) пачками. '
+        'Прерванный импорт продолжается с последней записанной пачки'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Кому принадлежат импортированные пины')
+        parser.add_argument('source', help='ZIP-архив или pins.jsonl')
+        parser.add_argument('--media-dir', help='Откуда брать файлы для pins.jsonl (по умолчанию — его каталог)')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--checkpoint', help='Файл с номером последней строки (по умолчанию <source>.checkpoint)')
+        parser.add_argument('--restart', action='store_true', help='Начать с начала, забыв checkpoint')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f'Нет пользователя {options["username"]}')
+        checkpoint = options['checkpoint'] or f'{options["source"]}.checkpoint'
+        if options['restart'] and os.path.exists(checkpoint):
+            os.remove(checkpoint)
+        try:
+            source = transfer.open_source(options['source'], options['media_dir'])
+        except (transfer.ImportRejected, OSError) as e:
+            raise CommandError(str(e))
+
+        importer = transfer.Importer(
+            user, source, options['batch_size'], checkpoint, log=lambda message: self.stdout.write(message),
+        )
+        try:
+            importer.run()
+        finally:
+            source.close()
+        self.stdout.write(self.style.SUCCESS(
+            f'Импортировано пинов: {importer.imported}, отклонено: {importer.rejected}, '
+            f'{importer.rate:.0f} пинов/с. Обработку медиа выполнит run_media_worker'
+        ))
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс пинов, досок и пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        total = get_backend().rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано объектов: {total} за {elapsed:.1f} с'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.interests import rebuild_interests
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает интересы пользователей (UserInterest) по истории поиска'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        total = rebuild_interests(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Интересы пересчитаны: {total} пользователей'))
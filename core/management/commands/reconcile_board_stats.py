@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from core.boards import refresh
+from core.models import Board
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает pin_count и обложки досок и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = repaired = 0
+        last_id = 0
+        while True:
+            board_ids = list(
+                Board.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not board_ids:
+                break
+            repaired += refresh(board_ids)
+            checked += len(board_ids)
+            last_id = board_ids[-1]
+        self.stdout.write(self.style.SUCCESS(f'Проверено досок: {checked}, исправлено: {repaired}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core import engagement
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает популярность пинов для ленты (после смены POPULARITY_HALF_LIFE_HOURS или весов)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=engagement.FLUSH_CHUNK)
+        parser.add_argument(
+            '--from-boards', action='store_true',
+            help='Взять число сохранений из досок — для пинов, сохранённых до появления счётчиков',
+        )
+
+    def handle(self, *args, **options):
+        engagement.flush()
+        total = engagement.rescore_all(from_boards=options['from_boards'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Пересчитана популярность пинов: {total}'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core.history import RETENTION, rebuild_stats, rollup
+
+
+class Command(BaseCommand):
+    help = f'Удаляет записи истории поиска старше {RETENTION.days} дней: частоты запросов остаются в SearchQueryStat'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rebuild-stats', action='store_true',
+                            help='Сначала пересчитать SearchQueryStat по всей истории (один раз после обновления)')
+
+    def handle(self, *args, **options):
+        if options['rebuild_stats']:
+            total = rebuild_stats()
+            self.stdout.write(self.style.SUCCESS(f'Статистика пересчитана: {total} запросов'))
+        removed = rollup(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Удалено записей истории: {removed}'))
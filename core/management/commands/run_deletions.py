@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import deletion
+
+
+class Command(BaseCommand):
+    help = 'Фоновое удаление пинов, досок и аккаунтов, помеченных удалёнными, пачками (core/deletion.py)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=deletion.BATCH_SIZE)
+        parser.add_argument('--sleep', type=float, default=5.0, help='Пауза, когда удалять нечего (сек)')
+        parser.add_argument('--pause', type=float, default=0.0, help='Пауза между пачками, чтобы не нагружать БД')
+        parser.add_argument('--once', action='store_true', help='Удалить всё помеченное и выйти')
+
+    def handle(self, *args, **options):
+        while True:
+            done = deletion.run_once(options['batch_size'])
+            if not done:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+            self.stdout.write(', '.join(f'{what}: {count}' for what, count in done.items()))
+            time.sleep(options['pause'])
+        self.stdout.write(self.style.SUCCESS('Помеченное удалено'))
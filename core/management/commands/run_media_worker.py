@@ -0,0 +1,43 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.media import claim_jobs, run_job, worker_id
+
+
+class Command(BaseCommand):
+    help = 'Фоновая обработка медиа пинов (EXIF, размеры, кадр-превью видео, перекодирование)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=2, help='Сколько задач обрабатывать параллельно')
+        parser.add_argument('--max-attempts', type=int, default=3, help='Попыток до статуса "ошибка"')
+        parser.add_argument('--sleep', type=float, default=2.0, help='Пауза, когда очередь пуста (сек)')
+        parser.add_argument('--once', action='store_true', help='Обработать очередь и выйти')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        me = worker_id()
+        self.stdout.write(f'Воркер {me}, потоков: {concurrency}')
+
+        def work(job):
+            # У каждого потока своё соединение с БД — закрываем, чтобы не копить
+            try:
+                return run_job(job, options['max_attempts'])
+            finally:
+                close_old_connections()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            while True:
+                jobs = claim_jobs(concurrency, me)
+                if not jobs:
+                    if options['once']:
+                        break
+                    time.sleep(options['sleep'])
+                    continue
+                if concurrency == 1:
+                    results = [run_job(job, options['max_attempts']) for job in jobs]
+                else:
+                    results = list(pool.map(work, jobs))
+                self.stdout.write(f'Обработано: {results.count(True)}, с ошибкой: {results.count(False)}')
@@ -0,0 +1,204 @@
+import io
+import time
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from taggit.models import Tag, TaggedItem
+
+from core import boards as board_stats, engagement, tagstats
+from core.models import Board, MediaBlob, Pin, Profile
+from core.search import get_backend
+
+# Слова для заголовков, описаний, досок и тегов — чтобы поиск находил что-то осмысленное
+WORDS = (
+    'осень кофе горы море кошки собаки интерьер кухня рецепт торт платье мода свадьба сад цветы '
+    'лес город ночь закат рисунок акварель фото путешествия дом декор книги спорт йога бег '
+    'велосипед машины архитектура мост река озеро зима снег лето пляж весна дерево минимализм '
+    'винтаж ретро неон портрет пейзаж макро еда завтрак ужин десерт чай выпечка вязание'
+).split()
+# Размеры заглушек: разные пропорции, как у настоящих пинов в сетке
+IMAGE_SIZES = ((60, 80), (60, 60), (60, 100), (80, 60), (60, 120))
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, пинами, досками и тегами для нагрузочных тестов. '
+        'Популярность тегов, авторов и пинов в досках — по закону Ципфа'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--pins', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=5000)
+        parser.add_argument('--boards-per-user', type=int, default=5)
+        parser.add_argument('--pins-per-board', type=int, default=30, help='Среднее число пинов в доске')
+        parser.add_argument('--tags-per-pin', type=int, default=3, help='Максимум тегов у пина')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Показатель распределения Ципфа')
+        parser.add_argument('--images', type=int, default=16, help='Сколько разных картинок-заглушек')
+        parser.add_argument('--prefix', default='synthetic', help='Префикс имён пользователей')
+        parser.add_argument('--password', default='synthetic', help='Общий пароль пользователей')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--no-index', action='store_true', help='Не перестраивать поисковый индекс')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['pins'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь и один пин.')
+        if User.objects.filter(username__startswith=options['prefix']).exists():
+            raise CommandError(f'Пользователи с префиксом "{options["prefix"]}" уже есть — укажите другой --prefix.')
+
+        self.rng = np.random.default_rng(options['seed'])
+        self.cdf = {}
+        self.batch_size = options['batch_size']
+        self.zipf = options['zipf']
+        started = time.perf_counter()
+
+        user_ids = self._create_users(options['users'], options['prefix'], options['password'])
+        self._log('Пользователи', len(user_ids), started)
+        tag_ids = self._create_tags(options['tags'], options['prefix'])
+        self._log('Теги', len(tag_ids), started)
+        images = self._create_images(options['images'])
+        pin_ids = self._create_pins(options['pins'], user_ids, tag_ids, images, options['tags_per_pin'])
+        self._log('Пины', len(pin_ids), started)
+        board_ids = self._create_boards(user_ids, pin_ids, options['boards_per_user'], options['pins_per_board'])
+        self._log('Доски', len(board_ids), started)
+
+        # bulk_create не шлёт сигналов — денормализованные данные досчитываем сами
+        for start in range(0, len(board_ids), self.batch_size):
+            board_stats.refresh(board_ids[start:start + self.batch_size])
+        tagstats.rebuild_counts()
+        tagstats.bump_version()
+        # Сохранения — из состава досок, показов у новых пинов нет
+        engagement.rescore_all(from_boards=True, batch_size=self.batch_size)
+        if not options['no_index']:
+            get_backend().rebuild(batch_size=1000)
+            self._log('Поисковый индекс', len(pin_ids), started)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано: {len(user_ids)} пользователей, {len(pin_ids)} пинов, {len(board_ids)} досок, '
+            f'{len(tag_ids)} тегов за {time.perf_counter() - started:.1f} с. '
+            f'Вход: {options["prefix"]}0 / {options["password"]}'
+        ))
+
+    def _log(self, what, count, started):
+        self.stdout.write(f'{what}: {count} ({time.perf_counter() - started:.1f} с)')
+
+    def _zipf_choice(self, n, size):
+        """Индексы 0..n-1: первый выпадает чаще всех, k-й — в k^s раз реже."""
+        if n not in self.cdf:
+            weights = np.cumsum(1 / np.arange(1, n + 1) ** self.zipf)
+            self.cdf[n] = weights / weights[-1]
+        # Обратная функция распределения: O(log n) на выборку вместо O(n) у rng.choice(p=...)
+        return np.minimum(np.searchsorted(self.cdf[n], self.rng.random(size), side='right'), n - 1)
+
+    def _words(self, count):
+        return ' '.join(WORDS[i] for i in self.rng.integers(0, len(WORDS), count))
+
+    def _bulk_create(self, model, objects, **kwargs):
+        """Вставляет пачку и возвращает pk (MySQL не проставляет их после bulk_create)."""
+        created = model.objects.bulk_create(objects, **kwargs)
+        if created and created[0].pk is None:
+            return list(model.objects.order_by('-pk').values_list('pk', flat=True)[:len(created)])[::-1]
+        return [obj.pk for obj in created]
+
+    def _create_users(self, count, prefix, password):
+        # Хэш пароля считаем один раз: PBKDF2 на каждого пользователя занял бы часы
+        password = make_password(password)
+        user_ids = []
+        for start in range(0, count, self.batch_size):
+            with transaction.atomic():
+                ids = self._bulk_create(User, [
+                    User(username=f'{prefix}{i}', password=password, first_name=self._words(1).capitalize())
+                    for i in range(start, min(count, start + self.batch_size))
+                ])
+                Profile.objects.bulk_create([
+                    Profile(user_id=user_id, display_name=f'{prefix} {user_id}', bio=self._words(8)) for user_id in ids
+                ])
+            user_ids += ids
+        return np.array(user_ids)
+
+    def _create_tags(self, count, prefix):
+        names = [WORDS[i % len(WORDS)] + (str(i // len(WORDS)) if i >= len(WORDS) else '') for i in range(count)]
+        existing = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+        missing = [name for name in names if name not in existing]
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            Tag.objects.bulk_create([Tag(name=name, slug=f'{prefix}-{name}') for name in batch])
+        existing = dict(Tag.objects.filter(name__in=names).values_list('name', 'pk'))
+        # Порядок важен: первые теги — самые популярные
+        return np.array([existing[name] for name in names])
+
+    def _create_images(self, count):
+        from PIL import Image
+
+        names = []
+        for i in range(count):
+            width, height = IMAGE_SIZES[i % len(IMAGE_SIZES)]
+            color = tuple(int(c) for c in self.rng.integers(0, 256, 3))
+            buffer = io.BytesIO()
+            Image.new('RGB', (width, height), color).save(buffer, 'JPEG', quality=70)
+            name = default_storage.save(f'pins/images/synthetic-{i}.jpg', ContentFile(buffer.getvalue()))
+            names.append((name, width, height))
+        return names
+
+    def _create_pins(self, count, user_ids, tag_ids, images, tags_per_pin):
+        content_type = ContentType.objects.get_for_model(Pin)
+        references = np.zeros(len(images), dtype=np.int64)
+        pin_ids = []
+        for start in range(0, count, self.batch_size):
+            size = min(self.batch_size, count - start)
+            authors = user_ids[self._zipf_choice(len(user_ids), size)]
+            image_indexes = self.rng.integers(0, len(images), size)
+            np.add.at(references, image_indexes, 1)
+            with transaction.atomic():
+                ids = self._bulk_create(Pin, [
+                    Pin(
+                        user_id=int(author), title=self._words(3).capitalize(), description=self._words(12),
+                        image=images[index][0], width=images[index][1], height=images[index][2],
+                        processing_status=Pin.STATUS_READY,
+                    )
+                    for author, index in zip(authors, image_indexes)
+                ])
+                tagged = set()
+                for pin_id, tag_count in zip(ids, self.rng.integers(1, tags_per_pin + 1, size)):
+                    for tag_index in self._zipf_choice(len(tag_ids), tag_count):
+                        tagged.add((pin_id, int(tag_ids[tag_index])))
+                TaggedItem.objects.bulk_create([
+                    TaggedItem(content_type=content_type, object_id=pin_id, tag_id=tag_id) for pin_id, tag_id in tagged
+                ], batch_size=self.batch_size)
+            pin_ids += ids
+        # Ссылки на картинки-заглушки, чтобы gc_media_blobs их не удалил
+        for (name, _, _), refs in zip(images, references):
+            MediaBlob.objects.filter(name=name).update(refcount=F('refcount') + int(refs))
+        return np.array(pin_ids)
+
+    def _create_boards(self, user_ids, pin_ids, boards_per_user, pins_per_board):
+        through = Board.pins.through
+        # Популярными оказываются случайные пины, а не только самые старые
+        pin_ids = self.rng.permutation(pin_ids)
+        board_ids = []
+        owners = np.repeat(user_ids, boards_per_user)
+        for start in range(0, len(owners), self.batch_size):
+            batch = owners[start:start + self.batch_size]
+            with transaction.atomic():
+                ids = self._bulk_create(Board, [Board(user_id=int(owner), title=self._words(2).capitalize()) for owner in batch])
+                # Размер доски — геометрическое распределение, состав — популярные пины чаще
+                sizes = np.minimum(self.rng.geometric(1 / max(pins_per_board, 1), len(ids)), len(pin_ids))
+                rows = {
+                    (board_id, int(pin_ids[index]))
+                    for board_id, board_size in zip(ids, sizes)
+                    for index in self._zipf_choice(len(pin_ids), board_size)
+                }
+                through.objects.bulk_create(
+                    [through(board_id=board_id, pin_id=pin_id) for board_id, pin_id in rows],
+                    batch_size=self.batch_size, ignore_conflicts=True,
+                )
+            board_ids += ids
+        return board_ids
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.blobs import sweep_orphans
+from core.uploads import expire_sessions
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет из MEDIA_ROOT файлы и превью, о которых не знает БД (осиротевшие после удалений и сбоев), '
+        'и брошенные загрузки по частям'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Сколько имён сверять с БД за раз')
+        parser.add_argument('--dry-run', action='store_true', help='Только посчитать')
+
+    def handle(self, *args, **options):
+        sessions, parts = expire_sessions(dry_run=options['dry_run'])
+        verb = 'Можно удалить' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(f'{verb} брошенных загрузок: {sessions}, брошенных файлов .part и .chunk: {parts}'))
+        count, size = sweep_orphans(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(f'{verb} файлов: {count} ({size / 1024 / 1024:.1f} МБ)'))
@@ -0,0 +1,203 @@
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import blobs, fragments
+from .models import MediaJob, Pin
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повтором: RETRY_DELAY * 2^(попытка - 1)
+RETRY_DELAY = timedelta(seconds=30)
+# Задача в статусе running без отметки воркера дольше MEDIA_JOB_STALE_MINUTES считается брошенной
+# (воркер упал). Живой воркер отмечается в run_after каждую треть этого срока (heartbeat)
+DEFAULT_STALE_MINUTES = 15
+
+
+def stale_after():
+    return timedelta(minutes=getattr(settings, 'MEDIA_JOB_STALE_MINUTES', DEFAULT_STALE_MINUTES))
+
+
+def heartbeat_interval():
+    return stale_after().total_seconds() / 3
+
+
+def enqueue(pin):
+    """Ставит пин в очередь обработки. Сам запрос только пишет файл и строку задачи."""
+    Pin.objects.filter(pk=pin.pk).update(processing_status=Pin.STATUS_PENDING)
+    pin.processing_status = Pin.STATUS_PENDING
+    fragments.invalidate_pin(pin)
+    return MediaJob.objects.create(pin=pin)
+
+
+def claim_jobs(limit, worker_id):
+    """
+    Забирает до limit готовых задач. SELECT ... FOR UPDATE SKIP LOCKED позволяет
+    нескольким воркерам работать с одной очередью, не получая одни и те же задачи.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        # Возвращаем в очередь задачи упавших воркеров
+        MediaJob.objects.filter(
+            status=MediaJob.STATUS_RUNNING, run_after__lt=now - stale_after()
+        ).update(status=MediaJob.STATUS_PENDING, locked_by='')
+
+        queryset = MediaJob.objects.filter(status=MediaJob.STATUS_PENDING, run_after__lte=now).order_by('run_after')
+        if connection.features.has_select_for_update_skip_locked:
+            queryset = queryset.select_for_update(skip_locked=True)
+        job_ids = list(queryset.values_list('pk', flat=True)[:limit])
+        # run_after у running-задачи = момент захвата или последней отметки heartbeat, по нему ищем брошенные
+        MediaJob.objects.filter(pk__in=job_ids, status=MediaJob.STATUS_PENDING).update(
+            status=MediaJob.STATUS_RUNNING, locked_by=worker_id, run_after=now, attempts=F('attempts') + 1
+        )
+    return list(MediaJob.objects.filter(pk__in=job_ids, locked_by=worker_id).select_related('pin'))
+
+
+@contextmanager
+def heartbeat(job):
+    """
+    Пока идёт обработка, отдельный поток сдвигает run_after задачи: долгое перекодирование
+    (MEDIA_TRANSCODE_HOOKS) не примут за брошенное и не отдадут второму воркеру.
+    """
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(heartbeat_interval()):
+                alive = MediaJob.objects.filter(
+                    pk=job.pk, status=MediaJob.STATUS_RUNNING, locked_by=job.locked_by,
+                ).update(run_after=timezone.now())
+                if not alive:
+                    logger.warning('Задачу пина %s забрал другой воркер', job.pin_id)
+                    return
+        finally:
+            # У потока своё соединение с БД
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'media-heartbeat-{job.pk}', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job, max_attempts):
+    try:
+        with heartbeat(job):
+            process_pin(job.pin)
+    except Exception as exc:
+        logger.exception('Ошибка обработки пина %s', job.pin_id)
+        if job.attempts >= max_attempts:
+            MediaJob.objects.filter(pk=job.pk).update(status=MediaJob.STATUS_FAILED, last_error=str(exc))
+            Pin.objects.filter(pk=job.pin_id).update(processing_status=Pin.STATUS_FAILED)
+            fragments.invalidate_pin(job.pin)
+        else:
+            MediaJob.objects.filter(pk=job.pk).update(
+                status=MediaJob.STATUS_PENDING,
+                last_error=str(exc),
+                locked_by='',
+                run_after=timezone.now() + RETRY_DELAY * 2 ** (job.attempts - 1),
+            )
+        return False
+
+    MediaJob.objects.filter(pk=job.pk).update(status=MediaJob.STATUS_DONE, last_error='')
+    # Если пока шла обработка пин перезалили, у него уже новая задача в очереди
+    if not MediaJob.objects.filter(pin_id=job.pin_id, status=MediaJob.STATUS_PENDING).exists():
+        Pin.objects.filter(pk=job.pin_id).update(processing_status=Pin.STATUS_READY)
+        # update() сигналов не вызывает: статус в профиле обновляем сами
+        fragments.invalidate_pin(job.pin)
+    return True
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+# --- Шаги обработки ---
+
+def process_pin(pin):
+    fields = {}
+    if pin.image:
+        fields.update(strip_exif(pin.image))
+    if pin.video:
+        poster = extract_poster(pin.video.path)
+        if poster:
+            fields['poster'] = poster
+        for path in getattr(settings, 'MEDIA_TRANSCODE_HOOKS', []):
+            # Хук получает пин и путь к видео, например для перекодирования в H.264
+            import_string(path)(pin, pin.video.path)
+    if fields:
+        # Файлы, на которые пин переходит: очищенная картинка и постер
+        replaced = {
+            field: getattr(pin, field).name for field in ('image', 'poster')
+            if field in fields and fields[field] != getattr(pin, field).name
+        }
+        with transaction.atomic():
+            # update() вместо save(): без full_clean и сигналов переиндексации. Условие на старые
+            # имена — если файл за время обработки перезалили, его не затираем
+            updated = Pin.objects.filter(pk=pin.pk, **replaced).update(**fields)
+            if updated:
+                # Сигналы update() не вызывает — ссылки на файлы считаем сами
+                for field, old_name in replaced.items():
+                    blobs.acquire(fields[field])
+                    blobs.release(old_name)
+        # Если не обновили, у новых файлов нет ссылок — их удалит gc_media_blobs
+
+
+def strip_exif(image):
+    """
+    Удаляет EXIF (в т.ч. геолокацию), поворачивает по ориентации и возвращает размеры.
+    Файлы адресуются хэшем содержимого, поэтому очищенная копия сохраняется как новый файл
+    и возвращается в 'image'; старый освобождает process_pin.
+    """
+    from django.core.files.storage import default_storage
+    from PIL import Image, ImageOps
+
+    with Image.open(image.path) as source:
+        if not source.getexif() or getattr(source, 'is_animated', False):
+            return {'width': source.width, 'height': source.height}
+        image_format = source.format
+        cleaned = ImageOps.exif_transpose(source)
+        cleaned.info.pop('exif', None)
+        cleaned.info.pop('xmp', None)
+        with tempfile.TemporaryFile() as tmp:
+            cleaned.save(tmp, image_format, **({'quality': 95} if image_format == 'JPEG' else {}))
+            name = default_storage.save(
+                image.field.generate_filename(image.instance, os.path.basename(image.name)), File(tmp),
+            )
+    return {'image': name, 'width': cleaned.width, 'height': cleaned.height}
+
+
+def extract_poster(path):
+    """Кадр для превью видео через ffmpeg. Если ffmpeg не установлен — пропускаем."""
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        return None
+    from django.core.files.storage import default_storage
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        target = os.path.join(tmp_dir, 'poster.jpg')
+        subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-ss', '1', '-i', path, '-frames:v', '1', target],
+            check=True, timeout=120,
+        )
+        if not os.path.exists(target):
+            return None
+        name = os.path.splitext(os.path.basename(path))[0] + '.jpg'
+        with open(target, 'rb') as f:
+            return default_storage.save(f'pins/posters/{name}', File(f))
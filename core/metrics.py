@@ -0,0 +1,343 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from . import db, fragments
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм (как le в Prometheus); последняя корзина — +Inf
+BUCKETS = {
+    'request_duration_seconds': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'sql_queries': (1, 2, 5, 10, 20, 50, 100, 200, 500),
+    'sql_duration_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+    'template_duration_seconds': (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+    'response_size_bytes': (512, 2048, 8192, 32768, 131072, 524288, 2097152),
+}
+HELP = {
+    'request_duration_seconds': 'Время обработки запроса',
+    'sql_queries': 'SQL-запросов за запрос',
+    'sql_duration_seconds': 'Время SQL за запрос',
+    'template_duration_seconds': 'Время рендеринга шаблонов за запрос',
+    'response_size_bytes': 'Размер ответа',
+}
+PREFIX = 'pinterest_'
+# Скользящее окно: ROLLING_SLOTS корзин по ROLLING_SLOT секунд
+ROLLING_SLOT = 60
+ROLLING_SLOTS = 5
+
+_current = ContextVar('core_metrics_current', default=None)
+_lock = threading.Lock()
+_totals = {}
+_rolling = deque()
+_budget_exceeded = {}
+_databases = {}
+DATABASE_COUNTERS = ('queries', 'seconds', 'errors', 'connections')
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class RequestMetrics:
+    """Счётчики одного запроса (или блока track())."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        # Счётчики по алиасам баз: в общий реестр процесса сливаются один раз в конце track()
+        self.databases = {}
+        # Асинхронные view читают из нескольких потоков пула сразу (core/async_views.py)
+        self.lock = threading.Lock()
+
+    def as_dict(self):
+        return {
+            'sql_queries': self.queries,
+            'sql_duration_seconds': self.sql_time,
+            'template_duration_seconds': self.template_time,
+        }
+
+
+def _execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    alias = context['connection'].alias
+    started = time.perf_counter()
+    failed = False
+    try:
+        return execute(sql, params, many, context)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        if metrics is None:
+            # Вне запроса (команды, фоновые потоки) — сразу в общий реестр
+            with _lock:
+                _count_query(_databases, alias, elapsed, failed)
+        else:
+            # В запросе — только его собственная блокировка: запросы разных потоков не ждут друг друга
+            with metrics.lock:
+                metrics.queries += 1
+                metrics.sql_time += elapsed
+                _count_query(metrics.databases, alias, elapsed, failed)
+
+
+def _count_query(databases, alias, elapsed, failed):
+    # По алиасам (основная база, реплики) — все запросы процесса, не только внутри track()
+    stats = databases.setdefault(alias, dict.fromkeys(DATABASE_COUNTERS, 0))
+    stats['queries'] += 1
+    stats['seconds'] += elapsed
+    stats['errors'] += failed
+
+
+@contextmanager
+def track():
+    """
+    Считает SQL-запросы, время SQL и рендеринга шаблонов внутри блока:
+
+        with metrics.track() as m:
+            client.get('/')
+        assert m.queries <= 10
+    """
+    metrics = RequestMetrics()
+    token = _current.set(metrics)
+    try:
+        with _wrap_connections():
+            yield metrics
+    finally:
+        _current.reset(token)
+        with metrics.lock, _lock:
+            for alias, stats in metrics.databases.items():
+                total = _databases.setdefault(alias, dict.fromkeys(DATABASE_COUNTERS, 0))
+                for name, value in stats.items():
+                    total[name] += value
+
+
+@contextmanager
+def _wrap_connections():
+    wrapped = []
+    try:
+        for connection in connections.all(initialized_only=True):
+            if _execute_wrapper not in connection.execute_wrappers:
+                connection.execute_wrappers.append(_execute_wrapper)
+                wrapped.append(connection)
+        yield
+    finally:
+        for connection in wrapped:
+            connection.execute_wrappers.remove(_execute_wrapper)
+
+
+def install():
+    """
+    Время шаблонов: оборачиваем django.template.base.Template.render один раз при старте.
+    Вложенные {% include %} тоже вызывают render — считаем только внешний вызов.
+    Новым соединениям обёртку SQL ставит обработчик connection_created (вне track() она ничего не делает):
+    так считаются и запросы из потоков пула асинхронных view, соединения которых живут дольше запроса.
+    """
+    from django.db.backends.signals import connection_created
+    from django.template.base import Template
+
+    if getattr(Template.render, '_core_metrics', False):
+        return
+    original = Template.render
+
+    def render(self, context):
+        metrics = _current.get()
+        if metrics is None:
+            return original(self, context)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return original(self, context)
+        finally:
+            metrics.template_depth -= 1
+            if not metrics.template_depth:
+                metrics.template_time += time.perf_counter() - started
+
+    render._core_metrics = True
+    Template.render = render
+
+    def wrap_new_connection(sender, connection, **kwargs):
+        with _lock:
+            _databases.setdefault(connection.alias, dict.fromkeys(DATABASE_COUNTERS, 0))['connections'] += 1
+        if _execute_wrapper not in connection.execute_wrappers:
+            connection.execute_wrappers.append(_execute_wrapper)
+
+    connection_created.connect(wrap_new_connection, weak=False, dispatch_uid='core.metrics')
+
+
+# --- Бюджеты запросов ---
+
+def query_budget(view_name):
+    return getattr(settings, 'QUERY_BUDGETS', {}).get(view_name)
+
+
+def check_budget(view_name, metrics):
+    """
+    Сравнивает число SQL-запросов с QUERY_BUDGETS[view_name]. Превышение пишется в лог,
+    а при QUERY_BUDGET_STRICT (включают в тестах) — QueryBudgetExceeded.
+    """
+    budget = query_budget(view_name)
+    if budget is None or metrics.queries <= budget:
+        return
+    with _lock:
+        _budget_exceeded[view_name] = _budget_exceeded.get(view_name, 0) + 1
+    message = f'{view_name}: {metrics.queries} SQL-запросов при бюджете {budget}'
+    if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+# --- Гистограммы ---
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def merge(self, other):
+        for i, count in enumerate(other.counts):
+            self.counts[i] += count
+        self.sum += other.sum
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def quantile(self, q):
+        """Оценка квантиля: верхняя граница корзины, в которую он попал."""
+        total = self.count
+        if not total:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * total:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+
+
+def _new_histograms():
+    return {name: Histogram(bounds) for name, bounds in BUCKETS.items()}
+
+
+def observe(view_name, duration, metrics, response_size=None):
+    values = dict(metrics.as_dict(), request_duration_seconds=duration)
+    if response_size is not None:
+        values['response_size_bytes'] = response_size
+    slot = int(time.time() // ROLLING_SLOT)
+    with _lock:
+        if not _rolling or _rolling[-1][0] != slot:
+            _rolling.append((slot, {}))
+        while _rolling and _rolling[0][0] <= slot - ROLLING_SLOTS:
+            _rolling.popleft()
+        for target in (_totals, _rolling[-1][1]):
+            histograms = target.setdefault(view_name, _new_histograms())
+            for name, value in values.items():
+                histograms[name].observe(value)
+
+
+def rolling_summary():
+    """Медиана, p95 и число запросов по каждому view за последние ROLLING_SLOTS минут."""
+    oldest = int(time.time() // ROLLING_SLOT) - ROLLING_SLOTS + 1
+    merged = {}
+    with _lock:
+        for slot, views in _rolling:
+            if slot < oldest:
+                continue
+            for view_name, histograms in views.items():
+                target = merged.setdefault(view_name, _new_histograms())
+                for name, histogram in histograms.items():
+                    target[name].merge(histogram)
+    return {
+        view_name: {
+            name: {'count': h.count, 'p50': h.quantile(0.5), 'p95': h.quantile(0.95)}
+            for name, h in histograms.items() if h.count
+        }
+        for view_name, histograms in merged.items()
+    }
+
+
+def totals():
+    """Число наблюдений и сумма каждой метрики по view с запуска процесса (или с reset())."""
+    with _lock:
+        return {
+            view_name: {name: {'count': h.count, 'sum': h.sum} for name, h in histograms.items()}
+            for view_name, histograms in _totals.items()
+        }
+
+
+def _format(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def prometheus():
+    """Накопленные с запуска процесса метрики в текстовом формате Prometheus."""
+    with _lock:
+        snapshot = {
+            view_name: {name: (h.bounds, h.counts[:], h.sum) for name, h in histograms.items()}
+            for view_name, histograms in _totals.items()
+        }
+        exceeded = dict(_budget_exceeded)
+    lines = []
+    for name in BUCKETS:
+        metric = PREFIX + name
+        lines += [f'# HELP {metric} {HELP[name]}', f'# TYPE {metric} histogram']
+        for view_name in sorted(snapshot):
+            bounds, counts, total = snapshot[view_name][name]
+            cumulative = 0
+            for bound, count in zip(bounds + (float('inf'),), counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{view="{view_name}",le="{_format(bound)}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{view="{view_name}"}} {_format(total)}')
+            lines.append(f'{metric}_count{{view="{view_name}"}} {cumulative}')
+    metric = PREFIX + 'query_budget_exceeded_total'
+    lines += [f'# HELP {metric} Запросы сверх бюджета SQL', f'# TYPE {metric} counter']
+    lines += [f'{metric}{{view="{view_name}"}} {count}' for view_name, count in sorted(exceeded.items())]
+    by_alias = databases()
+    for name, kind, help_text in (
+        ('queries', 'counter', 'SQL-запросов по алиасу базы'),
+        ('seconds', 'counter', 'Время SQL по алиасу базы'),
+        ('errors', 'counter', 'Ошибок SQL по алиасу базы'),
+        ('connections', 'counter', 'Открыто соединений по алиасу базы'),
+    ):
+        metric = f'{PREFIX}db_{name}_total'
+        lines += [f'# HELP {metric} {help_text}', f'# TYPE {metric} {kind}']
+        lines += [f'{metric}{{alias="{alias}"}} {_format(stats[name])}' for alias, stats in sorted(by_alias.items())]
+    metric = PREFIX + 'db_replica_up'
+    lines += [f'# HELP {metric} Реплика исправна по последней проверке', f'# TYPE {metric} gauge']
+    lines += [f'{metric}{{alias="{alias}"}} {int(up)}' for alias, up in sorted(db.health().items())]
+    cache = fragments.stats()
+    for name in ('hits', 'misses'):
+        metric = f'{PREFIX}fragment_cache_{name}_total'
+        lines += [f'# TYPE {metric} counter', f'{metric} {cache[name]}']
+    return '\n'.join(lines) + '\n'
+
+
+def databases():
+    """Счётчики SQL по алиасам баз с запуска процесса."""
+    with _lock:
+        return {alias: dict(stats) for alias, stats in _databases.items()}
+
+
+def reset():
+    with _lock:
+        _databases.clear()
+        _totals.clear()
+        _rolling.clear()
+        _budget_exceeded.clear()
@@ -0,0 +1,177 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.http import Http404, HttpResponseNotFound
+
+from . import db, metrics, serve, viewer
+
+
+class MetricsMiddleware:
+    """
+    Для каждого запроса считает SQL-запросы, время SQL и шаблонов, размер ответа
+    и складывает их в гистограммы по имени маршрута из core.urls (см. core/metrics.py).
+    Ставится первым в MIDDLEWARE, чтобы учитывать запросы сессий и авторизации.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        # Под ASGI работаем асинхронно, иначе Django прогонял бы всю цепочку через потоки
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        metrics.install()
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with metrics.track() as current:
+            response = self.get_response(request)
+        return self._record(request, response, current, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with metrics.track() as current:
+            response = await self.get_response(request)
+        return self._record(request, response, current, started)
+
+    def _record(self, request, response, current, started):
+        if not response.streaming:
+            self._observe(request, current, started, len(response.content))
+            return response
+        # Потоковый ответ (core/async_views.py) досчитывает фрагменты уже после view —
+        # метрики записываем, когда отдан последний кусок
+        chunks = response.streaming_content
+        if response.is_async:
+            async def content():
+                size = 0
+                try:
+                    async for chunk in chunks:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    self._observe(request, current, started, size)
+        else:
+            def content():
+                size = 0
+                try:
+                    for chunk in chunks:
+                        size += len(chunk)
+                        yield chunk
+                finally:
+                    self._observe(request, current, started, size)
+        response.streaming_content = content()
+        return response
+
+    def _observe(self, request, current, started, size):
+        duration = time.perf_counter() - started
+        match = getattr(request, 'resolver_match', None)
+        # Ненайденные адреса складываем в одну метку, чтобы не плодить ряды
+        view_name = (match.url_name or match.view_name) if match else 'unresolved'
+        metrics.observe(view_name, duration, current, size)
+        metrics.check_budget(view_name, current)
+
+
+class MediaMiddleware:
+    """
+    Отдаёт MEDIA_URL до сессий и авторизации (core/serve.py): запросы кусков видео
+    при перемотке не должны ходить в БД за сессией. MEDIA_SERVE = False — медиа отдаёт веб-сервер.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.MEDIA_URL
+
+    def __call__(self, request):
+        if getattr(settings, 'MEDIA_SERVE', True) and request.path.startswith(self.prefix):
+            try:
+                return serve.serve_media(request, request.path[len(self.prefix):])
+            except Http404:
+                return HttpResponseNotFound()
+        return self.get_response(request)
+
+
+class StaticMiddleware:
+    """
+    Отдаёт собранную статику (manage.py build_assets) до сессий и авторизации: сжатую заранее копию
+    и вечный кэш для имён с хэшем (core/serve.py). Файла нет в STATIC_ROOT — запрос идёт дальше
+    (при DEBUG его отдаст staticfiles). STATIC_SERVE = False — статику отдаёт веб-сервер.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.prefix = settings.STATIC_URL
+
+    def __call__(self, request):
+        if getattr(settings, 'STATIC_SERVE', True) and request.path.startswith(self.prefix):
+            try:
+                return serve.serve_static(request, request.path[len(self.prefix):])
+            except Http404:
+                pass
+        return self.get_response(request)
+
+
+class ReplicaMiddleware:
+    """
+    Запоминает текущий запрос для ReplicaRouter (core/db.py) и после изменяющего запроса
+    ставит куку: следующие REPLICA_STICKY_SECONDS пользователь читает с основной базы.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with db.request_state(request):
+            response = self.get_response(request)
+        return self._stick(request, response)
+
+    async def __acall__(self, request):
+        with db.request_state(request):
+            response = await self.get_response(request)
+        return self._stick(request, response)
+
+    def _stick(self, request, response):
+        if request.method not in db.SAFE_METHODS and db.replica_aliases():
+            seconds = db.sticky_seconds()
+            response.set_cookie(
+                db.STICKY_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds, httponly=True, samesite='Lax',
+            )
+        return response
+
+
+class ViewerMiddleware:
+    """
+    request.viewer — профиль и доски текущего пользователя (core/viewer.py), загружаются при первом
+    обращении. Ставится после AuthenticationMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request.viewer = viewer.lazy(request)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        request.viewer = viewer.lazy(request)
+        return await self.get_response(request)
@@ -1,16 +1,45 @@
+import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import User
 from taggit.managers import TaggableManager
 from django.core.exceptions import ValidationError
 from django.utils.translation import gettext_lazy as _
 
+class ActiveManager(models.Manager):
+    """Без помеченных удалёнными: они пропадают сразу, а строки вычищает run_deletions (core/deletion.py)"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
 class ForbiddenTag(models.Model):
+    # 'тег' — точное совпадение, 'тег*' — префикс, '*тег' — суффикс, '*тег*' — подстрока (core/forbidden.py)
     tag = models.CharField(max_length=100, unique=True)
+    # По времени правки процессы замечают, что список изменился
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def clean(self):
+        word = self.tag.strip().strip('*')
+        if not word:
+            raise ValidationError({'tag': _('Шаблон не может состоять из одних звёздочек.')})
+        if '*' in word:
+            raise ValidationError({'tag': _('Звёздочка допускается только в начале или в конце шаблона.')})
 
     def __str__(self):
         return self.tag
 
 class Pin(models.Model):
+    # Статус фоновой обработки медиа (см. core/media.py и run_media_worker)
+    STATUS_PENDING = 'pending'
+    STATUS_READY = 'ready'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Обрабатывается'),
+        (STATUS_READY, 'Готов'),
+        (STATUS_FAILED, 'Ошибка обработки'),
+    ]
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     image = models.ImageField(upload_to='pins/images/', null=True, blank=True)
     video = models.FileField(upload_to='pins/videos/', null=True, blank=True)
@@ -18,12 +47,34 @@ class Pin(models.Model):
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     tags = TaggableManager()
+    processing_status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_READY, db_index=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    poster = models.ImageField(upload_to='pins/posters/', null=True, blank=True)
+    # Показы в ленте и сохранения в доски (пишутся пачками, см. core/engagement.py) и оценка для ленты
+    view_count = models.PositiveIntegerField(default=0, editable=False)
+    save_count = models.PositiveIntegerField(default=0, editable=False)
+    popularity = models.FloatField(default=0, editable=False)
+    # Оценка пересчитывается раз в снимок (engagement.publish): pending_snapshot — снимок, в котором
+    # изменились счётчики, scored_snapshot и previous_popularity — когда оценку последний раз сменили
+    # и какой она была до того (до конца того снимка лента видит прежнюю, см. core/feed.py)
+    pending_snapshot = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    scored_snapshot = models.PositiveIntegerField(null=True, blank=True, editable=False, db_index=True)
+    previous_popularity = models.FloatField(default=0, editable=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
+    objects = ActiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [models.Index(fields=['processing_status', '-popularity', '-id'])]
 
     def clean(self):
         if not self.image and not self.video:
             raise ValidationError(_('Нужно загрузить изображение или видео.'))
 
-        # Убрали проверку тегов отсюда — она будет в сигнале
+        # Теги здесь не проверить: они пишутся после пина (save_m2m). Запрещённые теги отсекает
+        # PinForm.clean_tags, страховка — сигнал check_forbidden_tags (core/signals.py)
 
     def save(self, *args, **kwargs):
         self.full_clean()
@@ -37,6 +88,13 @@ class Board(models.Model):
     title = models.CharField(max_length=200)
     pins = models.ManyToManyField(Pin, related_name='boards')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Денормализованные данные для карточки доски, их ведёт core/boards.py
+    pin_count = models.PositiveIntegerField(default=0, editable=False)
+    cover_pin_ids = models.JSONField(default=list, blank=True, editable=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False, db_index=True)
+
+    objects = ActiveManager()
+    all_objects = models.Manager()
 
     def __str__(self):
         return self.title
@@ -50,10 +108,167 @@ class Profile(models.Model):
     def __str__(self):
         return self.display_name or self.user.username
 
+class AccountDeletion(models.Model):
+    """Аккаунт удалён пользователем: вход закрыт, пины и доски скрыты, строки вычищает run_deletions"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='deletion')
+    requested_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Удаление {self.user_id} от {self.requested_at:%Y-%m-%d %H:%M}"
+
 class SearchHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     query = models.CharField(max_length=200)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # default, а не auto_now_add: записи пишутся пачками (core/history.py) и хранят время самого поиска
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'timestamp'])]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.query}"
+
+
+class SearchQueryStat(models.Model):
+    """Сжатая история: сколько раз и когда последний раз пользователь искал запрос, см. core/history.py"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_stats')
+    query = models.CharField(max_length=200)
+    count = models.PositiveIntegerField(default=0)
+    last_searched = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'query'], name='core_searchquerystat_user_query')]
+        indexes = [models.Index(fields=['user', '-last_searched'])]
+
+    def __str__(self):
+        return f"{self.user_id}: {self.query} ×{self.count}"
+
+class UserInterest(models.Model):
+    """Предрасчитанные интересы пользователя (теги и авторы с весами), см. core/interests.py"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='interest')
+    tags = models.JSONField(default=dict, blank=True)     # {"тег": вес}
+    authors = models.JSONField(default=dict, blank=True)  # {"user_id": вес}
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"Интересы {self.user.username}"
+
+
+class SearchIndexEntry(models.Model):
+    """Строка инвертированного индекса: терм -> объект (пин, доска, пользователь), см. core/search.py"""
+    KIND_PIN = 'pin'
+    KIND_BOARD = 'board'
+    KIND_USER = 'user'
+    KIND_CHOICES = [(KIND_PIN, 'Пин'), (KIND_BOARD, 'Доска'), (KIND_USER, 'Пользователь')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    term = models.CharField(max_length=64)
+    weight = models.PositiveSmallIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term', 'object_id']),
+            models.Index(fields=['kind', 'object_id', 'term']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id} {self.term}"
+
+
+
+class MediaJob(models.Model):
+    """Задача фоновой обработки медиа пина. Очередь живёт в БД, брокер не нужен."""
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_RUNNING, 'Выполняется'),
+        (STATUS_DONE, 'Готово'),
+        (STATUS_FAILED, 'Ошибка'),
+    ]
+
+    pin = models.ForeignKey(Pin, on_delete=models.CASCADE, related_name='media_jobs')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_after'])]
+
+    def __str__(self):
+        return f"Обработка пина {self.pin_id}: {self.status}"
+
+
+class UploadSession(models.Model):
+    """Докачиваемая загрузка большого видео по частям (см. core/uploads.py)"""
+    STATUS_OPEN = 'open'
+    STATUS_COMPLETE = 'complete'
+    STATUS_CHOICES = [(STATUS_OPEN, 'Загружается'), (STATUS_COMPLETE, 'Завершена')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    sha256 = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_OPEN)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.filename} ({self.offset}/{self.size})"
+
+
+class MediaBlob(models.Model):
+    """Файл в контент-адресуемом хранилище (core/storage.py): хранится один раз, сколько бы раз его ни загрузили"""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64)
+    size = models.PositiveBigIntegerField()
+    refcount = models.IntegerField(default=0)
+    # Перцептивный хэш (dHash, 64 бита) и его четыре 16-битные полосы для поиска похожих картинок
+    phash = models.BigIntegerField(null=True, blank=True)
+    phash_band0 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_band1 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_band2 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    phash_band3 = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Когда файл последний раз сохраняли (в т.ч. повторно, то же содержимое): от этого момента
+    # считается отсрочка сборки мусора, пока новая ссылка ещё не взята
+    stored_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [models.Index(fields=['refcount', 'stored_at'])]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+
+class TagStat(models.Model):
+    """Использование тега за час (или за сутки после compact_tag_stats), см. core/tagstats.py"""
+    tag = models.ForeignKey('taggit.Tag', on_delete=models.CASCADE, related_name='stats')
+    hour = models.DateTimeField()
+    added = models.PositiveIntegerField(default=0)     # Сколько раз тег поставили пинам
+    searches = models.PositiveIntegerField(default=0)  # Сколько раз искали '#тег'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tag', 'hour'], name='core_tagstat_tag_hour')]
+        indexes = [models.Index(fields=['hour', 'tag'])]
+
+    def __str__(self):
+        return f"{self.tag_id} @ {self.hour:%Y-%m-%d %H:00}"
+
+
+class TagCount(models.Model):
+    """Сколько пинов сейчас с тегом — для облака тегов и подсказок без подсчёта по taggit_taggeditem"""
+    tag = models.OneToOneField('taggit.Tag', on_delete=models.CASCADE, primary_key=True, related_name='usage')
+    pins = models.IntegerField(default=0, db_index=True)
 
     def __str__(self):
-        return f"{self.user.username}: {self.query}"
\ No newline at end of file
+        return f"{self.tag_id}: {self.pins}"
@@ -0,0 +1,301 @@
+import json
+import os
+import shutil
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+
+from .models import Board, Pin
+
+# Сколько похожих пинов храним на каждый пин
+TOP_K = 50
+# Признак (доска или тег) у большего числа пинов ничего не говорит о сходстве,
+# а пар даёт квадратично много — такие пропускаем, как стоп-слова
+MAX_FEATURE_PINS = 2000
+# Сколько пар (пин, пин) обрабатываем за один блок — ограничивает память при сборке
+PAIR_BUDGET = 4_000_000
+# Как часто процесс проверяет, не собрана ли новая модель
+RELOAD_INTERVAL = 30
+# Сколько последних сохранённых пользователем пинов учитывать в рекомендациях
+RECENT_SAVES = 20
+CURRENT_FILE = 'CURRENT'
+
+Membership = Board.pins.through
+
+_lock = threading.Lock()
+_model = None
+_checked_at = 0
+
+
+def model_dir():
+    return getattr(settings, 'RELATED_PINS_DIR', os.path.join(settings.BASE_DIR, 'var', 'related'))
+
+
+# --- Сборка модели ---
+
+def load_features():
+    """
+    Признаки пинов: доски, в которые их сохранили, и теги.
+    Возвращает (отсортированные id пинов, отсортированные ключи pin_id << 32 | признак),
+    где признак = board_id * 2 для досок и tag_id * 2 + 1 для тегов.
+    """
+    import numpy as np
+    from taggit.models import TaggedItem
+
+    pair = np.dtype((np.int64, 2))
+    pin_ids = np.fromiter(Pin.objects.order_by('pk').values_list('pk', flat=True).iterator(10000), dtype=np.int64)
+    boards = np.fromiter(Membership.objects.values_list('pin_id', 'board_id').iterator(10000), dtype=pair)
+    tags = np.fromiter(
+        TaggedItem.objects.filter(content_type=ContentType.objects.get_for_model(Pin))
+        .values_list('object_id', 'tag_id').iterator(10000),
+        dtype=pair,
+    )
+    keys = np.concatenate([
+        (boards[:, 0] << 32) | (boards[:, 1] * 2),
+        (tags[:, 0] << 32) | (tags[:, 1] * 2 + 1),
+    ])
+    keys = np.unique(keys)
+    return pin_ids, keys[np.isin(keys >> 32, pin_ids)]
+
+
+def _ranges(starts, lengths):
+    """Склейка диапазонов [start, start + length) в один массив индексов без цикла на Python."""
+    import numpy as np
+
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return np.arange(lengths.sum()) + offsets
+
+
+def compute(pin_ids, keys, rows, k=TOP_K):
+    """
+    Top-k похожих для строк rows (индексы в pin_ids). Сходство — косинус по признакам
+    с весами IDF: общая редкая доска или тег значит больше, чем популярный.
+    Возвращает (neighbors: id пинов, scores) формы (len(rows), k); пустые места — 0.
+    """
+    import numpy as np
+
+    n = len(pin_ids)
+    neighbors = np.zeros((len(rows), k), dtype=np.int64)
+    scores = np.zeros((len(rows), k), dtype=np.float32)
+    if not len(keys) or not len(rows):
+        return neighbors, scores
+
+    row = np.searchsorted(pin_ids, keys >> 32)
+    features, column = np.unique(keys & 0xFFFFFFFF, return_inverse=True)
+    df = np.bincount(column, minlength=len(features))
+    weight = np.log(n / np.maximum(df, 1)) ** 2
+    # Признак, который есть у всех пинов, весит 0: он не отличает пины и дал бы нулевые нормы
+    useful = ((df > 1) & (df <= MAX_FEATURE_PINS) & (weight > 0))[column]
+    row, column = row[useful], column[useful]
+    norms = np.sqrt(np.bincount(row, weights=weight[column], minlength=n))
+
+    # Списки пинов по признаку (как в инвертированном индексе) и признаки по пину (row уже отсортирован)
+    by_feature = np.argsort(column, kind='stable')
+    postings = row[by_feature]
+    feature_start = np.concatenate([[0], np.cumsum(np.bincount(column, minlength=len(features)))])
+    row_start = np.searchsorted(row, np.arange(n + 1))
+    used_df = np.diff(feature_start)
+
+    # Делим строки на блоки так, чтобы в каждом было не больше PAIR_BUDGET пар
+    rows = np.asarray(rows)
+    entry_pairs = used_df[column]
+    row_cost = np.bincount(row, weights=entry_pairs, minlength=n)[rows]
+    block_of = ((np.cumsum(row_cost) - row_cost) // PAIR_BUDGET).astype(np.int64)
+    output_position = np.full(n, -1, dtype=np.int64)
+    output_position[rows] = np.arange(len(rows))
+
+    for block in np.unique(block_of):
+        block_rows = rows[block_of == block]
+        entries = _ranges(row_start[block_rows], row_start[block_rows + 1] - row_start[block_rows])
+        if not len(entries):
+            continue
+        counts = entry_pairs[entries]
+        left = np.repeat(row[entries], counts)
+        right = postings[_ranges(feature_start[column[entries]], counts)]
+        pair_weight = np.repeat(weight[column[entries]], counts)
+        other = left != right
+        left, right, pair_weight = left[other], right[other], pair_weight[other]
+        if not len(left):
+            continue
+
+        pairs, inverse = np.unique(left * n + right, return_inverse=True)
+        similarity = np.bincount(inverse, weights=pair_weight)
+        left, right = pairs // n, pairs % n
+        # Пары без общего признака с ненулевым весом не считаем: деление на 0 дало бы NaN
+        valid = (norms[left] > 0) & (norms[right] > 0)
+        left, right, similarity = left[valid], right[valid], similarity[valid]
+        if not len(left):
+            continue
+        similarity /= norms[left] * norms[right]
+
+        # Внутри каждой строки — по убыванию сходства, берём первые k
+        order = np.lexsort((-similarity, left))
+        left, right, similarity = left[order], right[order], similarity[order]
+        rank = np.arange(len(left)) - np.searchsorted(left, left)
+        top = rank < k
+        neighbors[output_position[left[top]], rank[top]] = pin_ids[right[top]]
+        scores[output_position[left[top]], rank[top]] = similarity[top]
+    return neighbors, scores
+
+
+def build(directory=None, k=TOP_K, full=False):
+    """
+    Собирает модель и публикует её атомарной заменой файла CURRENT.
+    Без full пересчитываются только пины, у которых изменились признаки, и пины,
+    делящие с ними доску или тег; остальные строки берутся из прошлой сборки.
+    Веса IDF при этом для старых строк не обновляются — полную сборку стоит запускать периодически.
+    Возвращает (всего пинов, пересчитано строк).
+    """
+    import numpy as np
+
+    directory = directory or model_dir()
+    pin_ids, keys = load_features()
+    previous = None if full else _open(directory)
+
+    if previous is not None and previous.neighbors.shape[1] == k:
+        old_keys = np.load(os.path.join(previous.path, 'features.npy'))
+        changed = np.setxor1d(old_keys, keys, assume_unique=True)
+        dirty = np.union1d(np.unique(changed >> 32), np.setdiff1d(pin_ids, previous.index, assume_unique=True))
+        touched_features = np.unique(changed & 0xFFFFFFFF)
+        touched_features = np.union1d(touched_features, np.unique(keys[np.isin(keys >> 32, dirty)] & 0xFFFFFFFF))
+        # Слишком частые и единичные признаки в сходстве не участвуют — соседей через них не ищем
+        touched_features = np.intersect1d(
+            touched_features, np.union1d(_informative(old_keys), _informative(keys)), assume_unique=True
+        )
+        affected = np.union1d(dirty, np.unique(keys[np.isin(keys & 0xFFFFFFFF, touched_features)] >> 32))
+        rows = np.searchsorted(pin_ids, np.intersect1d(affected, pin_ids, assume_unique=True))
+
+        neighbors = np.zeros((len(pin_ids), k), dtype=np.int64)
+        scores = np.zeros((len(pin_ids), k), dtype=np.float32)
+        _, old_rows, new_rows = np.intersect1d(previous.index, pin_ids, assume_unique=True, return_indices=True)
+        neighbors[new_rows] = previous.neighbors[old_rows]
+        scores[new_rows] = previous.scores[old_rows]
+        neighbors[rows], scores[rows] = compute(pin_ids, keys, rows, k)
+    else:
+        rows = np.arange(len(pin_ids))
+        neighbors, scores = compute(pin_ids, keys, rows, k)
+
+    _publish(directory, pin_ids, keys, neighbors, scores, k)
+    return len(pin_ids), len(rows)
+
+
+def _informative(keys):
+    import numpy as np
+
+    features, counts = np.unique(keys & 0xFFFFFFFF, return_counts=True)
+    return features[(counts > 1) & (counts <= MAX_FEATURE_PINS)]
+
+
+def _publish(directory, pin_ids, keys, neighbors, scores, k):
+    import numpy as np
+
+    version = str(time.time_ns())
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    np.save(os.path.join(path, 'index.npy'), pin_ids)
+    np.save(os.path.join(path, 'neighbors.npy'), neighbors)
+    np.save(os.path.join(path, 'scores.npy'), scores.astype(np.float32))
+    np.save(os.path.join(path, 'features.npy'), keys)
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'version': version, 'k': k, 'pins': len(pin_ids), 'built_at': time.time()}, f)
+
+    tmp = os.path.join(directory, f'{CURRENT_FILE}.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(directory, CURRENT_FILE))
+
+    # Старые сборки удаляем, оставляя предыдущую: её ещё могут читать процессы
+    versions = sorted(name for name in os.listdir(directory) if name.isdigit())
+    for name in versions[:-2]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+# --- Чтение модели ---
+
+class RelatedModel:
+    """Собранная модель, открытая через memory map: в память читаются только нужные строки."""
+
+    def __init__(self, path):
+        import numpy as np
+
+        self.path = path
+        self.version = os.path.basename(path)
+        self.index = np.load(os.path.join(path, 'index.npy'), mmap_mode='r')
+        self.neighbors = np.load(os.path.join(path, 'neighbors.npy'), mmap_mode='r')
+        self.scores = np.load(os.path.join(path, 'scores.npy'), mmap_mode='r')
+
+    def similar(self, pin_ids, limit):
+        """id пинов, похожих на переданные, по сумме сходства — лучшие первыми."""
+        import numpy as np
+
+        ids = np.asarray(sorted(set(pin_ids)), dtype=np.int64)
+        if not len(ids) or not len(self.index):
+            return []
+        position = np.minimum(np.searchsorted(self.index, ids), len(self.index) - 1)
+        position = position[self.index[position] == ids]
+        if not len(position):
+            return []
+        neighbors = self.neighbors[position].ravel()
+        scores = self.scores[position].ravel()
+        keep = (neighbors > 0) & ~np.isin(neighbors, ids)
+        candidates, inverse = np.unique(neighbors[keep], return_inverse=True)
+        totals = np.bincount(inverse, weights=scores[keep])
+        return candidates[np.argsort(-totals, kind='stable')[:limit]].tolist()
+
+
+def _open(directory):
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as f:
+            return RelatedModel(os.path.join(directory, f.read().strip()))
+    except (OSError, ValueError, ImportError):
+        return None
+
+
+def get_model():
+    """Текущая модель или None, если её ещё не собирали (или нет NumPy)."""
+    global _model, _checked_at
+    now = time.monotonic()
+    if now - _checked_at > RELOAD_INTERVAL:
+        with _lock:
+            if now - _checked_at > RELOAD_INTERVAL:
+                _checked_at = now
+                try:
+                    with open(os.path.join(model_dir(), CURRENT_FILE)) as f:
+                        version = f.read().strip()
+                except OSError:
+                    version = None
+                if version is None:
+                    _model = None
+                elif _model is None or _model.version != version:
+                    _model = _open(model_dir())
+    return _model
+
+
+def model_version():
+    model = get_model()
+    return model.version if model is not None else ''
+
+
+def similar_ids(pin_ids, limit):
+    model = get_model()
+    return model.similar(pin_ids, limit) if model is not None else []
+
+
+def related_pins(pin_ids, limit=12, exclude_user=None):
+    """Похожие пины (только обработанные) в порядке убывания сходства."""
+    ids = similar_ids(pin_ids, limit * 2)
+    pins = Pin.objects.filter(pk__in=ids, processing_status=Pin.STATUS_READY).select_related('user')
+    if exclude_user is not None:
+        pins = pins.exclude(user=exclude_user)
+    found = {pin.pk: pin for pin in pins}
+    return [found[pin_id] for pin_id in ids if pin_id in found][:limit]
+
+
+def recommend_for(user, limit=200):
+    """id пинов для ленты: похожие на те, что пользователь недавно сохранял в свои доски."""
+    if get_model() is None:
+        return []
+    saved = Membership.objects.filter(board__user=user).order_by('-pk').values_list('pin_id', flat=True)
+    return similar_ids(list(saved[:RECENT_SAVES]), limit)
@@ -0,0 +1,231 @@
+import re
+from collections import Counter
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import OuterRef, Q, Subquery, Sum, Value, IntegerField
+from django.utils.module_loading import import_string
+
+from .models import Pin, Board, SearchIndexEntry
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+CYRILLIC_RE = re.compile(r'[а-я]')
+MAX_TERM_LENGTH = 64
+
+# Веса полей: совпадение в заголовке важнее, чем в описании
+WEIGHT_TITLE = 3
+WEIGHT_TAG = 2
+WEIGHT_DESCRIPTION = 1
+WEIGHT_USERNAME = 1
+
+# Окончания для упрощённого стемминга русских слов (от длинных к коротким)
+RU_ENDINGS = sorted([
+    'иями', 'ями', 'ами', 'иях', 'ях', 'ах', 'ией', 'ием', 'иям', 'ям', 'ам', 'ом', 'ем',
+    'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый',
+    'ой', 'им', 'ым', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+    'ешь', 'ете', 'ите', 'ует', 'уют', 'ить', 'ыть', 'ать', 'ять', 'еть', 'ла', 'ли', 'ло',
+    'ся', 'сь', 'ть', 'ов', 'ев', 'ью', 'ья', 'ье', 'ия', 'ию', 'ии',
+    'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю', 'ь', 'й',
+], key=len, reverse=True)
+MIN_STEM_LENGTH = 3
+
+
+def normalize(word):
+    return word.lower().replace('ё', 'е')
+
+
+def stem(word):
+    """Отрезаем самое длинное известное окончание, если останется хотя бы 3 буквы."""
+    if CYRILLIC_RE.search(word):
+        for ending in RU_ENDINGS:
+            if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+                return word[:-len(ending)]
+    elif len(word) > MIN_STEM_LENGTH + 1 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """Текст -> список термов (нормализованных и стеммированных)."""
+    terms = []
+    for word in TOKEN_RE.findall(normalize(text or '')):
+        if len(word) < 2:
+            continue
+        terms.append(stem(word)[:MAX_TERM_LENGTH])
+    return terms
+
+
+class LikeSearchBackend:
+    """Прежний поиск через icontains. Индекс не ведёт."""
+
+    def search_pins(self, queryset, query):
+        matched = Pin.objects.filter(
+            Q(tags__name__icontains=query) | Q(title__icontains=query) | Q(description__icontains=query)
+        ).values('pk')
+        return queryset.filter(pk__in=matched).annotate(relevance_bucket=Value(0, output_field=IntegerField()))
+
+    def search_boards(self, queryset, query):
+        return queryset.filter(title__icontains=query)
+
+    def search_users(self, queryset, query):
+        return queryset.filter(username__icontains=query)
+
+    def index_pin(self, pin):
+        pass
+
+    def index_board(self, board):
+        pass
+
+    def index_user(self, user):
+        pass
+
+    def remove(self, kind, object_id):
+        pass
+
+    def rebuild(self, batch_size=1000):
+        return 0
+
+
+class InvertedIndexBackend:
+    """
+    Инвертированный индекс в таблице SearchIndexEntry.
+    Результаты ранжируются по сумме весов совпавших термов.
+    """
+
+    # --- Поиск ---
+
+    def _term_filters(self, query):
+        """
+        Условия на термы запроса. Каждое условие — отдельный поиск по индексу
+        (kind, term): OR внутри одного WHERE многие СУБД превращают в полный скан.
+        """
+        words = [normalize(w) for w in TOKEN_RE.findall(query or '') if len(w) >= 2]
+        if not words:
+            return []
+        # Последнее слово может быть недописано — ищем по префиксу (диапазоном, а не LIKE)
+        last = words.pop()[:MAX_TERM_LENGTH]
+        prefix = stem(last)
+        if len(last) >= MIN_STEM_LENGTH:
+            filters = [Q(term__gte=prefix, term__lt=prefix + '\uffff')]
+        else:
+            filters = [Q(term=prefix)]
+        exact = {stem(w)[:MAX_TERM_LENGTH] for w in words} - {prefix}
+        if exact:
+            filters.append(Q(term__in=exact))
+        return filters
+
+    def _search(self, queryset, kind, query, annotation='search_score', sign=1):
+        filters = self._term_filters(query)
+        if not filters:
+            return queryset.none()
+        entries = SearchIndexEntry.objects.filter(kind=kind)
+        matched = Q()
+        for term_filter in filters:
+            matched |= Q(pk__in=entries.filter(term_filter).values('object_id'))
+        condition = Q()
+        for term_filter in filters:
+            condition |= term_filter
+        scores = (
+            entries.filter(condition, object_id=OuterRef('pk'))
+            .values('object_id')
+            .annotate(total=Sum('weight') * sign)
+            .values('total')
+        )
+        return queryset.filter(matched).annotate(**{annotation: Subquery(scores, output_field=IntegerField())})
+
+    def search_pins(self, queryset, query):
+        # Корзина релевантности ленты = -score: лучшие совпадения идут первыми
+        return self._search(queryset, SearchIndexEntry.KIND_PIN, query, annotation='relevance_bucket', sign=-1)
+
+    def search_boards(self, queryset, query):
+        return self._search(queryset, SearchIndexEntry.KIND_BOARD, query).order_by('-search_score', '-created_at')
+
+    def search_users(self, queryset, query):
+        return self._search(queryset, SearchIndexEntry.KIND_USER, query).order_by('-search_score', 'username')
+
+    # --- Индексация ---
+
+    def pin_terms(self, pin):
+        terms = Counter()
+        for term in tokenize(pin.title):
+            terms[term] += WEIGHT_TITLE
+        for tag in pin.tags.all():
+            for term in tokenize(tag.name):
+                terms[term] += WEIGHT_TAG
+        for term in tokenize(pin.description):
+            terms[term] += WEIGHT_DESCRIPTION
+        for term in tokenize(pin.user.username):
+            terms[term] += WEIGHT_USERNAME
+        return terms
+
+    def board_terms(self, board):
+        return Counter({term: WEIGHT_TITLE for term in tokenize(board.title)})
+
+    def user_terms(self, user):
+        terms = Counter()
+        for term in tokenize(user.username):
+            terms[term] += WEIGHT_TITLE
+        profile = getattr(user, 'profile', None)
+        if profile is not None:
+            for term in tokenize(profile.display_name):
+                terms[term] += WEIGHT_TAG
+        return terms
+
+    def _entries(self, kind, object_id, terms):
+        return [
+            SearchIndexEntry(kind=kind, object_id=object_id, term=term, weight=weight)
+            for term, weight in terms.items()
+        ]
+
+    def _replace(self, kind, object_id, terms):
+        self.remove(kind, object_id)
+        SearchIndexEntry.objects.bulk_create(self._entries(kind, object_id, terms))
+
+    def index_pin(self, pin):
+        self._replace(SearchIndexEntry.KIND_PIN, pin.pk, self.pin_terms(pin))
+
+    def index_board(self, board):
+        self._replace(SearchIndexEntry.KIND_BOARD, board.pk, self.board_terms(board))
+
+    def index_user(self, user):
+        self._replace(SearchIndexEntry.KIND_USER, user.pk, self.user_terms(user))
+
+    def remove(self, kind, object_id):
+        SearchIndexEntry.objects.filter(kind=kind, object_id=object_id).delete()
+
+    def index_queryset(self, kind, queryset, batch_size=1000):
+        """Индексирует объекты queryset потоком, пачками по batch_size строк индекса."""
+        terms_for = {
+            SearchIndexEntry.KIND_PIN: self.pin_terms,
+            SearchIndexEntry.KIND_BOARD: self.board_terms,
+            SearchIndexEntry.KIND_USER: self.user_terms,
+        }[kind]
+        total = 0
+        entries = []
+        for obj in queryset.iterator(chunk_size=batch_size):
+            entries.extend(self._entries(kind, obj.pk, terms_for(obj)))
+            total += 1
+            if len(entries) >= batch_size:
+                SearchIndexEntry.objects.bulk_create(entries)
+                entries = []
+        SearchIndexEntry.objects.bulk_create(entries)
+        return total
+
+    def rebuild(self, batch_size=1000):
+        """Полная переиндексация."""
+        SearchIndexEntry.objects.all().delete()
+        return (
+            self.index_queryset(SearchIndexEntry.KIND_PIN,
+                                Pin.objects.select_related('user').prefetch_related('tags').order_by('pk'), batch_size)
+            + self.index_queryset(SearchIndexEntry.KIND_BOARD, Board.objects.order_by('pk'), batch_size)
+            + self.index_queryset(SearchIndexEntry.KIND_USER,
+                                  User.objects.select_related('profile').order_by('pk'), batch_size)
+        )
+
+
+@lru_cache(maxsize=None)
+def get_backend():
+    """Бэкенд поиска из settings.SEARCH_BACKEND (по умолчанию — инвертированный индекс)."""
+    path = getattr(settings, 'SEARCH_BACKEND', 'core.search.InvertedIndexBackend')
+    return import_string(path)()
@@ -0,0 +1,254 @@
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+
+from . import assets
+
+# Файлы хранилища и превью названы хэшем содержимого (ab/abcdef….mp4, ab/abcdef…-480.webp) и на месте
+# не переписываются (очистка EXIF сохраняет новый файл, core/media.py): по такому адресу всегда
+# те же байты, поэтому браузер может кэшировать их навсегда
+HASHED_NAME_RE = re.compile(r'(?:^|/)([0-9a-f]{2})/(\1[0-9a-f]{14,})(?:-\d+)?\.[A-Za-z0-9]+$')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+# Служебные каталоги MEDIA_ROOT: недокачанные загрузки и реестр превью наружу не отдаём
+PRIVATE_PREFIXES = ('uploads/', 'thumbs/registry/')
+# Имена собранной статики (core/assets.py): css/site.0123456789ab.css
+STATIC_HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[A-Za-z0-9]+$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024
+
+
+def cache_max_age():
+    return getattr(settings, 'MEDIA_CACHE_MAX_AGE', 60 * 60 * 24)
+
+
+def static_cache_max_age():
+    return getattr(settings, 'STATIC_CACHE_MAX_AGE', 60 * 5)
+
+
+def offload_mode():
+    """None, 'x-accel-redirect' (nginx) или 'x-sendfile' (Apache, lighttpd)."""
+    return getattr(settings, 'MEDIA_OFFLOAD', None)
+
+
+def resolve(name, root=None):
+    """(нормализованное имя, абсолютный путь, stat) файла из MEDIA_ROOT (или root) или Http404."""
+    private = root is None
+    root = os.path.realpath(settings.MEDIA_ROOT if root is None else root)
+    path = os.path.realpath(os.path.join(root, name.lstrip('/')))
+    if not path.startswith(root + os.sep):
+        raise Http404
+    # Скрытые каталоги проверяем по нормализованному имени: pins/../uploads/… ведёт туда же
+    name = os.path.relpath(path, root).replace(os.sep, '/')
+    if private and name.startswith(PRIVATE_PREFIXES):
+        raise Http404
+    try:
+        info = os.stat(path)
+    except OSError:
+        raise Http404
+    if not stat.S_ISREG(info.st_mode):
+        raise Http404
+    return name, path, info
+
+
+def etag_for(info):
+    # Только по самому файлу: имя говорит, каким файл должен быть, а не каким его отдали
+    return f'"{info.st_mtime_ns:x}-{info.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    (start, end) включительно для 'bytes=a-b', 'bytes=a-' и 'bytes=-n'; None — заголовка нет
+    или он нам не подходит (несколько диапазонов): тогда отдаём файл целиком, это разрешено RFC 9110.
+    ValueError — диапазон за пределами файла (416).
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        length = int(last)
+        if length == 0:
+            raise ValueError
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError
+    return start, end
+
+
+class RangeFile:
+    """
+    Читает только [start, end] открытого файла. fileno() оставлен, поэтому wsgi.file_wrapper
+    (gunicorn, uWSGI) по-прежнему шлёт тело через os.sendfile с текущей позиции на Content-Length байт.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def _range_allowed(request, etag, last_modified):
+    # If-Range: диапазон только если файл не изменился, иначе — целиком
+    condition = request.headers.get('If-Range')
+    if not condition:
+        return True
+    if condition.startswith('"') or condition.startswith('W/'):
+        return condition == etag
+    since = parse_http_date_safe(condition)
+    return since is not None and int(last_modified) <= since
+
+
+def serve_media(request, path):
+    """
+    Отдаёт файл из MEDIA_ROOT с поддержкой Range (перемотка видео), If-None-Match / If-Modified-Since
+    и долгим Cache-Control для файлов с хэшем в имени. Тело не читается в память: FileResponse
+    или передача веб-серверу (MEDIA_OFFLOAD).
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    name, full_path, info = resolve(path)
+    etag = etag_for(info)
+    last_modified = int(info.st_mtime)  # HTTP-даты с точностью до секунды
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if HASHED_NAME_RE.search(name) else f'public, max-age={cache_max_age()}',
+        'Accept-Ranges': 'bytes',
+    }
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:  # 304 или 412
+        for header, value in headers.items():
+            not_modified.headers[header] = value
+        return not_modified
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if encoding:
+        # .gz/.bz2 отдаём как есть, а не с Content-Encoding: браузер не должен их распаковывать
+        content_type = 'application/octet-stream'
+
+    mode = offload_mode()
+    if mode:
+        # Веб-сервер сам отдаст файл и сам разберёт Range; мы только проверили путь и условия
+        response = HttpResponse(content_type=content_type, headers=headers)
+        if mode == 'x-accel-redirect':
+            prefix = getattr(settings, 'MEDIA_OFFLOAD_PREFIX', '/protected-media/')
+            response.headers['X-Accel-Redirect'] = prefix + quote(name)
+        else:
+            response.headers['X-Sendfile'] = full_path
+        return response
+
+    size = info.st_size
+    start, end, status = 0, size - 1, 200
+    if request.headers.get('Range') and _range_allowed(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers['Range'], size)
+        except ValueError:
+            response = HttpResponse(status=416, headers=headers)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            return response
+        if byte_range:
+            (start, end), status = byte_range, 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    length = max(end - start + 1, 0)
+
+    if request.method == 'HEAD':
+        response = HttpResponse(status=status, content_type=content_type, headers=headers)
+    else:
+        response = FileResponse(
+            RangeFile(open(full_path, 'rb'), start, length),
+            status=status, content_type=content_type, headers=headers,
+        )
+        response.block_size = BLOCK_SIZE
+    response.headers['Content-Length'] = str(length)
+    return response
+
+
+def accepted_encodings(request):
+    """Кодировки из Accept-Encoding, кроме явно запрещённых (q=0)."""
+    encodings = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = params.strip().partition('=')[2] if params.strip().startswith('q=') else '1'
+        try:
+            if float(quality) > 0:
+                encodings.add(coding.strip().lower())
+        except ValueError:
+            pass
+    return encodings
+
+
+def serve_static(request, path):
+    """
+    Отдаёт собранную статику из STATIC_ROOT: сжатую заранее копию (.br или .gz, core/assets.py),
+    если браузер её принимает, и Cache-Control immutable для имён с хэшем. Range не поддерживается:
+    файлы небольшие, а диапазон по сжатому телу браузеру всё равно не нужен.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+    root = settings.STATIC_ROOT
+    if not root:
+        raise Http404
+    name, full_path, info = resolve(path, root)
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if encoding:
+        content_type = 'application/octet-stream'
+    headers = {
+        'Cache-Control': IMMUTABLE_CACHE_CONTROL if STATIC_HASHED_NAME_RE.search(name) else f'public, max-age={static_cache_max_age()}',
+        'Vary': 'Accept-Encoding',
+    }
+    if assets.is_compressible(name):
+        accepted = accepted_encodings(request)
+        for coding, suffix in assets.ENCODINGS:
+            if coding not in accepted:
+                continue
+            try:
+                variant_info = os.stat(full_path + suffix)
+            except OSError:
+                continue
+            full_path, info = full_path + suffix, variant_info
+            headers['Content-Encoding'] = coding
+            break
+
+    # ETag и Last-Modified — у выбранного варианта: у .gz и .br они разные
+    etag = etag_for(info)
+    last_modified = int(info.st_mtime)
+    headers.update({'ETag': etag, 'Last-Modified': http_date(last_modified)})
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        for header, value in headers.items():
+            not_modified.headers[header] = value
+        return not_modified
+
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type, headers=headers)
+    else:
+        response = FileResponse(open(full_path, 'rb'), content_type=content_type, headers=headers)
+        response.block_size = BLOCK_SIZE
+    response.headers['Content-Length'] = str(info.st_size)
+    return response
@@ -1,21 +1,265 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, pre_save, post_save, pre_delete, post_delete, m2m_changed
+from django.core.signals import request_finished
 from django.dispatch import receiver
-from django.core.exceptions import ValidationError
-from django.utils.translation import gettext_lazy as _
-from .models import Pin, ForbiddenTag
+from django.utils import timezone
+from django.contrib.auth.models import User
+from taggit.models import Tag
+from .models import Pin, Board, Profile, ForbiddenTag, SearchHistory, SearchIndexEntry
+from .interests import record_search
+from .forbidden import ForbiddenTagsError, find_forbidden, bump_version
+from .search import get_backend
+from . import blobs, boards, engagement, fragments, history, tagstats, viewer
 
 
+@receiver(m2m_changed, sender=Pin.tags.through)
+def check_forbidden_tags(sender, instance, action, model, pk_set, **kwargs):
+    # Основная проверка — в PinForm.clean_tags, до записи пина (её же использует админка).
+    # Здесь страховка для остальных путей и для тега, запрещённого уже после проверки формы:
+    # теги не добавятся, но сам пин к этому моменту уже записан. Поэтому pin.save() и tags.add()
+    # вызывают в одной transaction.atomic — ForbiddenTagsError откатит и пин (см. views._save_pin)
+    if action != 'pre_add' or not isinstance(instance, Pin) or not pk_set:
+        return
+    names = model.objects.filter(pk__in=pk_set).values_list('name', flat=True)
+    forbidden = find_forbidden(names)
+    if forbidden:
+        raise ForbiddenTagsError(forbidden)
+
+
+@receiver(post_save, sender=ForbiddenTag)
+@receiver(post_delete, sender=ForbiddenTag)
+def invalidate_forbidden_tags(sender, **kwargs):
+    # Этот процесс сверит версию сразу, остальные — не позже чем через forbidden.VERSION_CHECK_INTERVAL
+    bump_version()
+
+
+@receiver(post_save, sender=SearchHistory)
+def update_user_interest(sender, instance, created, **kwargs):
+    # Инкрементально обновляем интересы, чтобы лента не пересчитывала историю.
+    # Поиски с сайта пишутся пачками без post_save — для них то же делает history.flush()
+    if created:
+        record_search(instance.user, instance.query, now=instance.timestamp)
+        tagstats.record_search(instance.query, now=instance.timestamp)
+
+
+@receiver(request_finished)
+def flush_search_history(sender, **kwargs):
+    # Буфер поисков сбрасывается и по времени, даже если новых поисков нет
+    if history.flush_due():
+        history.flush()
+
+
+@receiver(request_finished)
+def flush_engagement(sender, **kwargs):
+    # Показы и сохранения пишутся в БД пачкой уже после ответа, а не при отрисовке ленты.
+    # Там же — раз в снимок на процесс — публикуются новые оценки
+    if engagement.flush_due():
+        engagement.flush()
+    engagement.publish()
+
+
+# --- Профиль создаётся вместе с пользователем: страницам не нужно создавать его при чтении ---
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        Profile.objects.get_or_create(user=instance)
+
+
+# --- Поисковый индекс: обновляем инкрементально при изменении объектов ---
+
+@receiver(post_save, sender=Pin)
+def index_pin(sender, instance, **kwargs):
+    get_backend().index_pin(instance)
+
+
+@receiver(m2m_changed, sender=Pin.tags.through)
+def index_pin_tags(sender, instance, action, **kwargs):
+    # Теги сохраняются после самого пина (form.save_m2m), поэтому переиндексируем ещё раз
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, Pin):
+        get_backend().index_pin(instance)
+
+
+@receiver(post_delete, sender=Pin)
+def unindex_pin(sender, instance, **kwargs):
+    get_backend().remove(SearchIndexEntry.KIND_PIN, instance.pk)
+
+
+@receiver(post_save, sender=Board)
+def index_board(sender, instance, **kwargs):
+    get_backend().index_board(instance)
+
+
+@receiver(post_delete, sender=Board)
+def unindex_board(sender, instance, **kwargs):
+    get_backend().remove(SearchIndexEntry.KIND_BOARD, instance.pk)
+
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, **kwargs):
+    get_backend().index_user(instance)
+
+
+@receiver(post_save, sender=Profile)
+def index_profile(sender, instance, **kwargs):
+    get_backend().index_user(instance.user)
+
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    get_backend().remove(SearchIndexEntry.KIND_USER, instance.pk)
+
+
+# --- Подсчёт ссылок на файлы в контент-адресуемом хранилище (core/blobs.py) ---
+
+MEDIA_FIELDS = {Pin: ('image', 'video', 'poster'), Profile: ('avatar',)}
+
+
+def _media_names(instance):
+    deferred = instance.get_deferred_fields()
+    return {
+        field: getattr(instance, field).name or ''
+        for field in MEDIA_FIELDS[type(instance)]
+        if field not in deferred
+    }
+
+
+@receiver(post_init, sender=Pin)
+@receiver(post_init, sender=Profile)
+def remember_media(sender, instance, **kwargs):
+    # Запоминаем исходные имена файлов, чтобы после сохранения понять, что поменялось
+    instance._original_media = _media_names(instance) if instance.pk else {}
+
+
+@receiver(post_save, sender=Pin)
+@receiver(post_save, sender=Profile)
+def count_media_references(sender, instance, created, **kwargs):
+    original = getattr(instance, '_original_media', {})
+    current = _media_names(instance)
+    for field, name in current.items():
+        if not created and field not in original:
+            continue  # Поле было отложено при загрузке — исходное имя неизвестно, значит его не меняли
+        old = original.get(field, '')
+        if name != old:
+            blobs.acquire(name)
+            blobs.release(old)
+    instance._original_media = current
+
+
+@receiver(post_delete, sender=Pin)
+@receiver(post_delete, sender=Profile)
+def release_media(sender, instance, **kwargs):
+    for name in getattr(instance, '_original_media', {}).values():
+        blobs.release(name)
+
+
+# --- Кэш фрагментов профиля и доски (core/fragments.py): новая версия при любом изменении ---
+
 @receiver(post_save, sender=Pin)
-def check_forbidden_tags(sender, instance, created, **kwargs):
-    # Проверяем всегда (и при создании, и при обновлении)
-    forbidden_tags = set(ForbiddenTag.objects.values_list('tag', flat=True).exclude(tag__exact=''))
-    pin_tags = set(instance.tags.slugs())
-
-    intersection = pin_tags.intersection(forbidden_tags)
-    if intersection:
-        # Если пин только что создан — удаляем его
-        if created or instance.pk:
-            instance.delete()
-        raise ValidationError(
-            _(f'Запрещённые теги: {", ".join(intersection)}. Пин не сохранён.')
-        )
\ No newline at end of file
+@receiver(pre_delete, sender=Pin)  # После удаления связи пина с досками уже не найти
+def invalidate_pin_fragments(sender, instance, **kwargs):
+    fragments.invalidate_pin(instance)
+
+
+@receiver(post_save, sender=Board)
+@receiver(post_delete, sender=Board)
+def invalidate_board_fragments(sender, instance, **kwargs):
+    fragments.invalidate_board(instance.pk, instance.user_id)
+
+
+@receiver(m2m_changed, sender=Board.pins.through)
+def invalidate_board_pins(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        fragments.invalidate_board(instance.pk, instance.user_id)
+        return
+    # pin.boards.add(...): instance — пин, pk_set — доски (при clear — все доски пина)
+    boards = Board.objects.filter(pins=instance) if action == 'pre_clear' else Board.objects.filter(pk__in=pk_set)
+    for board_id, owner_id in boards.values_list('pk', 'user_id'):
+        fragments.invalidate_board(board_id, owner_id)
+
+
+# --- Профиль и доски зрителя (core/viewer.py) ---
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=Board)
+@receiver(post_delete, sender=Board)
+def invalidate_viewer(sender, instance, **kwargs):
+    viewer.invalidate(instance.user_id)
+
+
+# --- Счётчик пинов и обложка доски (Board.pin_count, Board.cover_pin_ids) ---
+
+@receiver(m2m_changed, sender=Board.pins.through)
+def refresh_board_stats(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            boards.refresh([instance.pk])
+    elif action == 'pre_clear':
+        # pin.boards.clear(): после очистки доски пина уже не найти
+        instance._cleared_board_ids = list(instance.boards.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        boards.refresh(getattr(instance, '_cleared_board_ids', []))
+    elif action in ('post_add', 'post_remove'):
+        boards.refresh(pk_set)
+
+
+@receiver(pre_delete, sender=Pin)
+def remember_pin_boards(sender, instance, **kwargs):
+    # Связи с досками удаляются каскадом, без m2m_changed
+    instance._board_ids = list(instance.boards.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Pin)
+def refresh_pin_boards(sender, instance, **kwargs):
+    board_ids = getattr(instance, '_board_ids', [])
+    boards.refresh(board_ids)
+    for board_id, owner_id in Board.objects.filter(pk__in=board_ids).values_list('pk', 'user_id'):
+        fragments.invalidate_board(board_id, owner_id)
+
+
+# --- Статистика тегов (core/tagstats.py) ---
+
+@receiver(m2m_changed, sender=Pin.tags.through)
+def count_pin_tags(sender, instance, action, pk_set, **kwargs):
+    if not isinstance(instance, Pin):
+        return
+    if action == 'post_add':
+        tagstats.record_tagged(pk_set)
+    elif action == 'post_remove':
+        tagstats.record_untagged(pk_set)
+    elif action == 'pre_clear':
+        tagstats.record_untagged(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Pin)
+def uncount_pin_tags(sender, instance, **kwargs):
+    # Связи с тегами удаляются каскадом, без m2m_changed
+    tagstats.record_untagged(instance.tags.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tag_index(sender, **kwargs):
+    # Этот процесс пересоберёт индекс подсказок при следующем запросе, остальные — по tagstats.VERSION_CHECK_INTERVAL
+    tagstats.bump_version()
+
+
+# --- Популярность пинов (core/engagement.py) ---
+
+@receiver(pre_save, sender=Pin)
+def initial_popularity(sender, instance, **kwargs):
+    # Новый пин сразу получает оценку по свежести, иначе оказался бы в самом конце ленты
+    if instance._state.adding and not instance.popularity:
+        instance.popularity = engagement.score(
+            instance.view_count, instance.save_count, instance.created_at or timezone.now(),
+        )
+
+
+@receiver(m2m_changed, sender=Board.pins.through)
+def count_saves(sender, instance, action, reverse, pk_set, **kwargs):
+    if action != 'post_add' or not pk_set:
+        return
+    # board.pins.add(пины) или pin.boards.add(доски)
+    engagement.record_saves([instance.pk] * len(pk_set) if reverse else pk_set)
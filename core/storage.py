@@ -0,0 +1,96 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+TMP_DIR = os.path.join('uploads', 'tmp')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файлы хранятся под именем хэша содержимого: pins/images/ab/ab12...ef.jpg.
+    Одинаковая картинка, загруженная тысячей пользователей, лежит на диске один раз;
+    ссылки из Pin и Profile считает core/blobs.py.
+    """
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        tmp_dir = self.path(TMP_DIR)
+        os.makedirs(tmp_dir, exist_ok=True)
+
+        # Хэшируем на лету, пока пишем во временный файл на том же диске
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            return self._store(tmp_path, directory, extension, digest.hexdigest(), size)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def adopt(self, path, name, sha256=None):
+        """Забирает уже лежащий на этом диске файл (например, собранный из кусков) без копирования."""
+        if sha256 is None:
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(chunk)
+            sha256 = digest.hexdigest()
+        try:
+            return self._store(path, os.path.dirname(name), os.path.splitext(name)[1].lower(),
+                               sha256, os.path.getsize(path))
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _store(self, tmp_path, directory, extension, sha256, size):
+        from .blobs import dhash, register, touch
+
+        name = '/'.join(filter(None, [directory, sha256[:2], f'{sha256}{extension}']))
+        target = self.path(name)
+        with transaction.atomic():
+            # Запись о файле блокируется до конца транзакции: сборщик мусора не удалит файл
+            # между проверкой ниже и моментом, когда модель возьмёт на него ссылку
+            known = touch(name)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+                if self.file_permissions_mode is not None:
+                    os.chmod(target, self.file_permissions_mode)
+            if known:
+                return name
+
+            phash = None
+            if extension in IMAGE_EXTENSIONS:
+                try:
+                    phash = dhash(target)
+                except OSError:
+                    pass
+            register(name, sha256, size, phash)
+        return name
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя определяет хэш содержимого, совпадение исходных имён не важно
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        # Пустые каталоги-префиксы не оставляем
+        directory = os.path.dirname(self.path(name))
+        try:
+            if os.path.realpath(directory) != os.path.realpath(settings.MEDIA_ROOT):
+                os.rmdir(directory)
+        except OSError:
+            pass
@@ -0,0 +1,261 @@
+import heapq
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+from taggit.models import Tag, TaggedItem
+
+from .models import Pin, TagCount, TagStat
+
+# Тренды: активность за окно против средней за предыдущую неделю
+TRENDING_WINDOW_HOURS = 24
+BASELINE_DAYS = 7
+# Сглаживание: тег с 1 упоминанием и нулевой историей не должен обгонять популярные
+TRENDING_PRIOR = 2
+TAGS_CACHE_TIMEOUT = 300
+# Часовые счётчики старше недели сворачиваются в суточные, старше 90 дней — удаляются
+COMPACT_AFTER = timedelta(days=7)
+RETENTION = timedelta(days=90)
+
+# Подсказки: индекс префиксов в памяти процесса, пересобирается при новых тегах (версия — последний
+# id тега в БД, процесс сверяет её не чаще раза в VERSION_CHECK_INTERVAL секунд, как список запрещённых
+# тегов) и раз в AUTOCOMPLETE_REFRESH секунд — так подхватываются удаления, переименования и счётчики
+VERSION_CHECK_INTERVAL = 5
+AUTOCOMPLETE_REFRESH = 600
+AUTOCOMPLETE_LIMIT = 10
+SHORT_PREFIX = 2
+
+_lock = threading.Lock()
+_index = None
+_index_version = None
+_index_built_at = 0
+_checked_at = 0
+
+
+def hour_of(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def normalize(name):
+    return name.strip().lower().replace('ё', 'е')
+
+
+# --- Счётчики ---
+
+def _bump(tag_ids, field, now=None):
+    hour = hour_of(now or timezone.now())
+    # Строка часа создаётся один раз, дальше — атомарный инкремент одним UPDATE на все теги
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, hour=hour) for tag_id in tag_ids], ignore_conflicts=True)
+    TagStat.objects.filter(tag_id__in=tag_ids, hour=hour).update(**{field: F(field) + 1})
+
+
+def _change_counts(tag_ids, delta):
+    TagCount.objects.bulk_create([TagCount(tag_id=tag_id) for tag_id in tag_ids], ignore_conflicts=True)
+    TagCount.objects.filter(tag_id__in=tag_ids).update(pins=F('pins') + delta)
+
+
+def record_tagged(tag_ids, now=None):
+    """Теги поставили пину."""
+    tag_ids = list(tag_ids)
+    if tag_ids:
+        _bump(tag_ids, 'added', now)
+        _change_counts(tag_ids, 1)
+
+
+def record_tagged_many(counts, now=None):
+    """Пачка пинов (импорт): {tag_id: сколько пинов получили тег}. Один UPDATE на каждое различное число."""
+    hour = hour_of(now or timezone.now())
+    TagStat.objects.bulk_create([TagStat(tag_id=tag_id, hour=hour) for tag_id in counts], ignore_conflicts=True)
+    TagCount.objects.bulk_create([TagCount(tag_id=tag_id) for tag_id in counts], ignore_conflicts=True)
+    by_count = defaultdict(list)
+    for tag_id, count in counts.items():
+        by_count[count].append(tag_id)
+    for count, tag_ids in by_count.items():
+        TagStat.objects.filter(tag_id__in=tag_ids, hour=hour).update(added=F('added') + count)
+        TagCount.objects.filter(tag_id__in=tag_ids).update(pins=F('pins') + count)
+
+
+def record_untagged_many(counts):
+    """Пачка пинов удалена: {tag_id: сколько из них было с тегом}."""
+    by_count = defaultdict(list)
+    for tag_id, count in counts.items():
+        by_count[count].append(tag_id)
+    for count, tag_ids in by_count.items():
+        TagCount.objects.filter(tag_id__in=tag_ids).update(pins=F('pins') - count)
+
+
+def record_untagged(tag_ids):
+    """Теги сняли с пина (или пин удалили)."""
+    tag_ids = list(tag_ids)
+    if tag_ids:
+        _change_counts(tag_ids, -1)
+
+
+def record_search(query, now=None):
+    """Поиск '#тег' — тоже сигнал интереса к тегу."""
+    query = query.strip()
+    if not query.startswith('#') or len(query) < 2:
+        return
+    name = query[1:]
+    # iexact не во всех СУБД понимает регистр кириллицы
+    tag_ids = list(Tag.objects.filter(Q(name__iexact=name) | Q(name=name.lower())).values_list('pk', flat=True))
+    if tag_ids:
+        _bump(tag_ids, 'searches', now)
+
+
+# --- Тренды и облако тегов ---
+
+def _tag_dicts(scored):
+    tags = Tag.objects.in_bulk([tag_id for tag_id, _ in scored])
+    return [
+        {'name': tags[tag_id].name, 'slug': tags[tag_id].slug, 'score': round(score, 3)}
+        for tag_id, score in scored if tag_id in tags
+    ]
+
+
+def trending(limit=20, window_hours=TRENDING_WINDOW_HOURS, now=None):
+    """
+    Теги, активность которых за последние window_hours выросла сильнее всего
+    относительно средней за BASELINE_DAYS до этого. Результат кэшируется на TAGS_CACHE_TIMEOUT.
+    """
+    now = now or timezone.now()
+    key = f'core:tags:trending:{limit}:{window_hours}:{hour_of(now):%Y%m%d%H}'
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    start = hour_of(now) - timedelta(hours=window_hours - 1)
+    baseline_start = start - timedelta(days=BASELINE_DAYS)
+    activity = Sum(F('added') + F('searches'))
+    recent = dict(
+        TagStat.objects.filter(hour__gte=start).values('tag').annotate(total=activity).values_list('tag', 'total')
+    )
+    baseline = dict(
+        TagStat.objects.filter(hour__gte=baseline_start, hour__lt=start, tag__in=list(recent))
+        .values('tag').annotate(total=activity).values_list('tag', 'total')
+    )
+    windows = BASELINE_DAYS * 24 / window_hours
+    scores = {
+        tag_id: total / (baseline.get(tag_id, 0) / windows + TRENDING_PRIOR)
+        for tag_id, total in recent.items() if total
+    }
+    result = _tag_dicts(heapq.nlargest(limit, scores.items(), key=lambda item: item[1]))
+    cache.set(key, result, TAGS_CACHE_TIMEOUT)
+    return result
+
+
+def popular(limit=50):
+    """Облако тегов: больше всего пинов сейчас."""
+    key = f'core:tags:popular:{limit}'
+    result = cache.get(key)
+    if result is None:
+        rows = TagCount.objects.filter(pins__gt=0).order_by('-pins').values_list('tag_id', 'pins')[:limit]
+        result = _tag_dicts(list(rows))
+        cache.set(key, result, TAGS_CACHE_TIMEOUT)
+    return result
+
+
+# --- Подсказки по префиксу ---
+
+class TagPrefixIndex:
+    """Отсортированные нормализованные имена: префикс ищется двоичным поиском."""
+
+    def __init__(self, rows):
+        entries = sorted((normalize(name), pins or 0, name) for name, pins in rows)
+        self.keys = [key for key, _, _ in entries]
+        self.counts = [pins for _, pins, _ in entries]
+        self.names = [name for _, _, name in entries]
+        self.short_answers = {}
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        # Под короткий префикс подходят тысячи тегов — ответ для него запоминаем
+        short = len(prefix) <= SHORT_PREFIX
+        if short and (prefix, limit) in self.short_answers:
+            return self.short_answers[prefix, limit]
+        lo = bisect_left(self.keys, prefix)
+        hi = bisect_left(self.keys, prefix + '\uffff', lo)
+        # Самые используемые из подходящих
+        best = [self.names[i] for i in heapq.nlargest(limit, range(lo, hi), key=self.counts.__getitem__)]
+        if short:
+            self.short_answers[prefix, limit] = best
+        return best
+
+
+def current_version():
+    return Tag.objects.aggregate(Max('pk'))['pk__max']
+
+
+def bump_version():
+    """Теги изменили в этом процессе: сверить версию при следующем запросе, не дожидаясь интервала."""
+    global _checked_at
+    _checked_at = 0
+
+
+def get_index():
+    global _index, _index_version, _index_built_at, _checked_at
+    now = time.monotonic()
+    fresh = now - _checked_at < VERSION_CHECK_INTERVAL and now - _index_built_at <= AUTOCOMPLETE_REFRESH
+    if _index is not None and fresh:
+        return _index
+    version = current_version()
+    with _lock:
+        stale = time.monotonic() - _index_built_at > AUTOCOMPLETE_REFRESH
+        if _index is None or version != _index_version or stale:
+            _index = TagPrefixIndex(Tag.objects.values_list('name', 'usage__pins').iterator(10000))
+            _index_version = version
+            _index_built_at = time.monotonic()
+        _checked_at = time.monotonic()
+    return _index
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT):
+    return get_index().complete(prefix, limit)
+
+
+# --- Обслуживание ---
+
+def compact(now=None):
+    """
+    Сворачивает часовые строки старше COMPACT_AFTER в одну строку за сутки (hour = полночь)
+    и удаляет строки старше RETENTION. Возвращает (свёрнуто суток, удалено строк).
+    """
+    now = now or timezone.now()
+    removed, _ = TagStat.objects.filter(hour__lt=now - RETENTION).delete()
+    days = (
+        TagStat.objects.filter(hour__lt=now - COMPACT_AFTER).exclude(hour__hour=0)
+        .annotate(day=TruncDay('hour')).values_list('day', flat=True).distinct()
+    )
+    compacted = 0
+    for day in sorted(set(days)):
+        with transaction.atomic():
+            rows = TagStat.objects.filter(hour__gte=day, hour__lt=day + timedelta(days=1))
+            totals = list(rows.values('tag').annotate(added_total=Sum('added'), searches_total=Sum('searches')))
+            rows.delete()
+            TagStat.objects.bulk_create([
+                TagStat(tag_id=row['tag'], hour=day, added=row['added_total'], searches=row['searches_total'])
+                for row in totals
+            ])
+        compacted += 1
+    return compacted, removed
+
+
+def rebuild_counts():
+    """Пересчитывает TagCount по taggit_taggeditem (исправляет расхождения)."""
+    counts = (
+        TaggedItem.objects.filter(content_type__app_label=Pin._meta.app_label, content_type__model=Pin._meta.model_name)
+        .values('tag').annotate(total=Count('pk')).values_list('tag', 'total')
+    )
+    with transaction.atomic():
+        TagCount.objects.all().delete()
+        TagCount.objects.bulk_create([TagCount(tag_id=tag_id, pins=total) for tag_id, total in counts], batch_size=1000)
+    return TagCount.objects.count()
@@ -0,0 +1,46 @@
+from django import template
+from django.conf import settings
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
+
+from core.thumbnails import lookup, widths_for
+
+register = template.Library()
+
+
+def _srcset(name, fmt, preset):
+    entry = lookup(name)
+    if entry is not None:
+        # Производные готовы — отдаём прямые ссылки на файлы
+        items = [
+            (f"{settings.MEDIA_URL}{path}", key.split('.')[0])
+            for key, path in sorted(entry['variants'].items(), key=lambda item: int(item[0].split('.')[0]))
+            if key.endswith(f'.{fmt}')
+        ]
+    else:
+        # Ещё не готовы — ссылки на view, который запустит генерацию при первом запросе
+        items = [
+            (reverse('thumbnail', args=[preset, width, fmt, name]), width)
+            for width in widths_for(preset)
+        ]
+    return ', '.join(f'{url} {width}w' for url, width in items)
+
+
+@register.simple_tag
+def picture(image, preset='pin', sizes='100vw', **attrs):
+    """
+    <picture> с WebP и JPEG вариантами нужной ширины вместо оригинала:
+        {% picture pin.image sizes="(max-width: 768px) 100vw, 33vw" class="card-img-top" alt=pin.title %}
+    """
+    if not image:
+        return ''
+    attributes = format_html_join(' ', '{}="{}"', ((key.replace('_', '-'), value) for key, value in attrs.items()))
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" loading="lazy" {}>'
+        '</picture>',
+        _srcset(image.name, 'webp', preset), sizes,
+        image.url, _srcset(image.name, 'jpeg', preset), sizes, attributes,
+    )
+
@@ -1,3 +1,633 @@
-from django.test import TestCase
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from taggit.models import TaggedItem
+
+from core import blobs, boards, deletion, engagement, feed, history, media, metrics, related, thumbnails, transfer, uploads
+from core.forbidden import ForbiddenTagMatcher, ForbiddenTagsError
+from core.models import Board, ForbiddenTag, MediaBlob, MediaJob, Pin, UploadSession, User
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix='pinterest-tests-')
+
+
+def jpeg(color, size=(600, 400), orientation=None):
+    from PIL import Image
+
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', exif=exif.tobytes())
+    return ContentFile(buffer.getvalue(), name='photo.jpg')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, THUMBNAIL_WORKERS=0, QUERY_BUDGET_STRICT=True)
+class MediaTestCase(TestCase):
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Буферы процесса (показы, сохранения) не должны перетекать между тестами
+        engagement._views.clear()
+        engagement._saves.clear()
+        engagement._published = None
+        thumbnails._registry_cache.clear()
+        history._buffer.clear()
+        history._last_query.clear()
+
+    def tearDown(self):
+        # Поиски из запросов теста пишем, пока есть тестовая база, а не при выходе процесса
+        history.flush()
+        engagement._views.clear()
+        engagement._saves.clear()
+
+
+class QueryBudgetTests(MediaTestCase):
+    """Ключевые страницы укладываются в QUERY_BUDGETS — иначе middleware бросит QueryBudgetExceeded."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer', password='x')
+        cls.author = User.objects.create_user('author', password='x')
+        image = jpeg((200, 30, 30))
+        cls.pins = []
+        for number in range(30):
+            pin = Pin(user=cls.author, title=f'Пин {number}', image=image)
+            pin.save()
+            pin.tags.add('осень', f'тег{number % 5}')
+            cls.pins.append(pin)
+        cls.board = Board.objects.create(user=cls.viewer, title='Идеи')
+        cls.board.pins.add(*cls.pins[:10])
+        Board.objects.create(user=cls.author, title='Своё').pins.add(*cls.pins[10:20])
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.viewer)
+
+    def assertWithinBudget(self, url, data=None):
+        # Первый запрос — с холодным кэшем фрагментов, второй — с тёплым
+        for _ in range(2):
+            response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_home(self):
+        self.assertWithinBudget(reverse('home'))
+        self.assertWithinBudget(reverse('home'), {'q': '#осень'})
+
+    def test_home_feed_next_page(self):
+        response = self.client.get(reverse('home'))
+        cursor = re.search(r'data-next-cursor="([^"]+)"', response.content.decode()).group(1)
+        self.assertWithinBudget(reverse('home_feed'), {'cursor': cursor})
+
+    def test_profiles(self):
+        self.assertWithinBudget(reverse('profile'))
+        self.assertWithinBudget(reverse('user_profile', args=['author']))
+
+    def test_board_detail(self):
+        self.assertWithinBudget(reverse('board_detail', args=[self.board.pk]))
+
+    def test_tags_and_searches(self):
+        self.assertWithinBudget(reverse('tags_autocomplete'), {'q': 'те'})
+        self.assertWithinBudget(reverse('recent_searches'))
+
+
+class CountingLock:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entered = 0
+
+    def __enter__(self):
+        self.lock.acquire()
+        self.entered += 1
+
+    def __exit__(self, *exc_info):
+        self.lock.release()
+
+
+class MetricsTests(MediaTestCase):
+
+    def test_request_queries_merge_into_registry_once(self):
+        before = metrics.databases().get('default', {}).get('queries', 0)
+        lock = CountingLock()
+        with mock.patch.object(metrics, '_lock', lock):
+            with metrics.track() as current:
+                for _ in range(5):
+                    User.objects.count()
+        # Общая блокировка — один раз на весь блок, а не на каждый запрос
+        self.assertEqual(lock.entered, 1)
+        self.assertEqual(current.queries, 5)
+        self.assertEqual(metrics.databases()['default']['queries'], before + 5)
+
+
+class TagsTrendingTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('tagger')
+        for number in range(3):
+            Pin.objects.create(user=user, title=f'Пин {number}', image='pins/images/x.jpg').tags.add(f'тег{number}')
+        self.client.force_login(user)
+
+    def test_limit_is_clamped(self):
+        for kind in ('popular', 'trending'):
+            response = self.client.get(reverse('tags_trending'), {'kind': kind, 'limit': -1})
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['tags']), 1)
+        response = self.client.get(reverse('tags_trending'), {'kind': 'popular', 'limit': 1000})
+        self.assertEqual(len(response.json()['tags']), 3)
+
+    def test_bad_limit(self):
+        response = self.client.get(reverse('tags_trending'), {'limit': 'много'})
+        self.assertEqual(response.status_code, 400)
+
+
+class ThumbnailViewTests(MediaTestCase):
+
+    def test_only_pin_images_and_avatars(self):
+        pin = Pin(user=User.objects.create_user('owner'), title='Картинка', image=jpeg((120, 10, 10)))
+        pin.save()
+        response = self.client.get(reverse('thumbnail', args=['pin', 236, 'webp', pin.image.name]))
+        self.assertEqual(response.status_code, 302)
+
+        # Тот же JPEG в скрытых каталогах и под чужим назначением превью не получает
+        hidden = os.path.join(MEDIA_ROOT, 'uploads', 'partial', 'stolen.part')
+        os.makedirs(os.path.dirname(hidden), exist_ok=True)
+        shutil.copy(pin.image.path, hidden)
+        with mock.patch.object(thumbnails, 'schedule') as schedule:
+            for preset, name in [
+                ('pin', 'uploads/partial/stolen.part'),
+                ('pin', 'pins/images/../../uploads/partial/stolen.part'),
+                ('pin', 'thumbs/registry/../../uploads/partial/stolen.part'),
+                ('avatar', pin.image.name),
+            ]:
+                response = self.client.get(reverse('thumbnail', args=[preset, 64 if preset == 'avatar' else 236, 'webp', name]))
+                self.assertEqual(response.status_code, 404, name)
+        schedule.assert_not_called()
+
+
+class MediaServeTests(MediaTestCase):
+
+    def test_private_directories_hidden_after_normalization(self):
+        pin = Pin(user=User.objects.create_user('owner'), title='Картинка', image=jpeg((120, 10, 10)))
+        pin.save()
+        self.assertEqual(self.client.get(f'/media/{pin.image.name}').status_code, 200)
+        hidden = os.path.join(MEDIA_ROOT, 'uploads', 'partial', 'secret.part')
+        os.makedirs(os.path.dirname(hidden), exist_ok=True)
+        with open(hidden, 'wb') as f:
+            f.write(b'secret')
+        for path in ['uploads/partial/secret.part', 'pins/../uploads/partial/secret.part', '../etc/passwd']:
+            self.assertEqual(self.client.get(f'/media/{path}').status_code, 404, path)
+
+
+class ThumbnailSweepTests(MediaTestCase):
+
+    def test_thumbnails_survive_sweep_after_exif_strip(self):
+        user = User.objects.create_user('owner')
+        pin = Pin(user=user, title='С EXIF', image=jpeg((10, 120, 10), orientation=6))
+        pin.save()
+        original = pin.image.name
+
+        media.process_pin(Pin.objects.get(pk=pin.pk))
+        pin.refresh_from_db()
+        self.assertNotEqual(pin.image.name, original)
+        self.assertEqual((pin.width, pin.height), (400, 600))
+        thumbnails.schedule(pin.image.name)
+        entry = thumbnails.lookup(pin.image.name)
+        self.assertTrue(entry['variants'])
+
+        # Всё на диске «старое»: сборщик рассматривает каждый файл
+        blobs.sweep_orphans(now=timezone.now() + blobs.GC_GRACE * 2)
+        thumbnails._registry_cache.clear()
+        self.assertEqual(thumbnails.lookup(pin.image.name), entry)
+        for relative in entry['variants'].values():
+            self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, relative)), relative)
+        self.assertTrue(os.path.exists(pin.image.path))
+
+    def test_registry_entry_dropped_with_missing_variant(self):
+        user = User.objects.create_user('owner')
+        pin = Pin(user=user, title='Без EXIF', image=jpeg((10, 10, 120)))
+        pin.save()
+        thumbnails.schedule(pin.image.name)
+        entry = thumbnails.lookup(pin.image.name)
+        os.remove(os.path.join(MEDIA_ROOT, next(iter(entry['variants'].values()))))
+
+        blobs.sweep_orphans(now=timezone.now() + blobs.GC_GRACE * 2)
+        # Запись удалена — следующий показ пересоздаст превью, а не отдаст ссылку на 404
+        self.assertIsNone(thumbnails.lookup(pin.image.name))
+        thumbnails.schedule(pin.image.name)
+        for relative in thumbnails.lookup(pin.image.name)['variants'].values():
+            self.assertTrue(os.path.exists(os.path.join(MEDIA_ROOT, relative)), relative)
+
+
+def slow_transcode(pin, path):
+    time.sleep(0.5)
+    # Второй воркер в это время ищет брошенные задачи
+    slow_transcode.reclaimed = media.claim_jobs(1, 'other-worker')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, MEDIA_TRANSCODE_HOOKS=[f'{__name__}.slow_transcode'])
+class MediaJobHeartbeatTests(TransactionTestCase):
+
+    def test_long_transcode_is_not_reclaimed(self):
+        pin = Pin.objects.create(user=User.objects.create_user('owner'), title='Видео', video='pins/videos/x.mp4')
+        media.enqueue(pin)
+        job, = media.claim_jobs(1, 'worker')
+        with mock.patch.object(media, 'stale_after', return_value=timedelta(seconds=0.2)), \
+                mock.patch.object(media, 'heartbeat_interval', return_value=0.05), \
+                mock.patch.object(media, 'extract_poster', return_value=None):
+            self.assertTrue(media.run_job(job, max_attempts=3))
+        self.assertEqual(slow_transcode.reclaimed, [])
+        self.assertEqual(MediaJob.objects.get(pk=job.pk).status, MediaJob.STATUS_DONE)
+
+
+class ChunkedUploadTests(MediaTestCase):
+    video = b'\x00\x00\x00\x18ftypmp42' + bytes(range(256)) * 12
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('uploader')
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('upload_init'), json.dumps({
+            'size': len(self.video), 'filename': 'clip.mp4', 'content_type': 'video/mp4',
+        }), content_type='application/json')
+        self.upload_id = response.json()['upload_id']
+        self.url = reverse('upload_chunk', args=[self.upload_id])
+
+    def put(self, offset, data):
+        return self.client.put(self.url, data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_resume_after_lost_response(self):
+        self.assertEqual(self.put(0, self.video[:1000]).json(), {'offset': 1000})
+        # Ответ потерялся, клиент повторяет кусок: 409 и смещение, с которого продолжать
+        response = self.put(0, self.video[:1000])
+        self.assertEqual((response.status_code, response.json()), (409, {'offset': 1000}))
+        self.assertEqual(self.client.get(self.url).json()['offset'], 1000)
+        self.assertEqual(self.put(1000, self.video[1000:]).json(), {'offset': len(self.video)})
+
+        response = self.client.post(reverse('upload_finalize', args=[self.upload_id]), {'title': 'Видео', 'tags': 'кино'})
+        self.assertEqual(response.status_code, 200)
+        pin = Pin.objects.get(pk=response.json()['pin_id'])
+        with pin.video.open('rb') as f:
+            self.assertEqual(f.read(), self.video)
+
+    def test_concurrent_retry_loses_compare_and_swap(self):
+        self.put(0, self.video[:1000])
+        receive = uploads.receive_chunk
+
+        def slow_receive(*args):
+            path = receive(*args)
+            # Пока этот запрос читал кусок, тот же кусок принял параллельный повтор
+            UploadSession.objects.filter(pk=self.upload_id).update(offset=2000)
+            return path
+
+        with mock.patch('core.views.receive_chunk', slow_receive):
+            response = self.put(1000, self.video[1000:2000])
+        self.assertEqual((response.status_code, response.json()), (409, {'offset': 2000}))
+        directory = os.path.dirname(uploads.partial_path(UploadSession.objects.get(pk=self.upload_id)))
+        self.assertFalse([name for name in os.listdir(directory) if name.endswith('.chunk')])
+
+    def test_abandoned_sessions_expire(self):
+        self.put(0, self.video[:1000])
+        session = UploadSession.objects.get(pk=self.upload_id)
+        stray = os.path.join(os.path.dirname(uploads.partial_path(session)), 'stray.chunk')
+        open(stray, 'wb').close()
+        self.assertEqual(uploads.expire_sessions(), (0, 0))
+        self.assertEqual(uploads.expire_sessions(timezone.now() + timedelta(days=2)), (1, 1))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(os.path.exists(uploads.partial_path(session)) or os.path.exists(stray))
+
+
+class TransferTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.author = User.objects.create_user('author')
+        self.importer = User.objects.create_user('importer')
+        board = Board.objects.create(user=self.author, title='Осень')
+        for number in range(5):
+            pin = Pin(user=self.author, title=f'Пин {number}', image=jpeg((40 * number, 80, 80)))
+            pin.save()
+            pin.tags.add('осень', f'тег{number}')
+            if number < 2:
+                board.pins.add(pin)
+        self.directory = tempfile.mkdtemp(dir=MEDIA_ROOT)
+        self.archive = os.path.join(self.directory, 'pins.zip')
+        with open(self.archive, 'wb') as out:
+            transfer.write_archive(self.author, out, batch_size=2)
+        self.checkpoint = self.archive + '.checkpoint'
+
+    def run_import(self):
+        source = transfer.open_source(self.archive)
+        try:
+            return transfer.Importer(self.importer, source, batch_size=2, checkpoint=self.checkpoint).run()
+        finally:
+            source.close()
+
+    def snapshot(self, user):
+        return sorted(
+            (pin.title, pin.created_at, sorted(tag.name for tag in pin.tags.all()), pin.image.name,
+             sorted(board.title for board in pin.boards.all()))
+            for pin in Pin.objects.filter(user=user).prefetch_related('tags', 'boards')
+        )
+
+    def test_round_trip(self):
+        engagement._saves.clear()
+        refcounts = dict(MediaBlob.objects.values_list('name', 'refcount'))
+        self.assertEqual(self.run_import(), 5)
+        self.assertEqual(self.snapshot(self.importer), self.snapshot(self.author))
+        # Те же файлы по тому же хэшу: новых копий нет, ссылок стало вдвое больше
+        self.assertEqual(dict(MediaBlob.objects.values_list('name', 'refcount')),
+                         {name: count * 2 for name, count in refcounts.items()})
+        board = Board.objects.get(user=self.importer)
+        self.assertEqual((board.title, board.pin_count), ('Осень', 2))
+        self.assertEqual(sum(engagement._saves.values()), 2)
+
+    def test_resume_from_checkpoint(self):
+        real_import = transfer.Importer._import
+        calls = []
+
+        def crash_on_second_batch(importer, records):
+            calls.append(len(records))
+            if len(calls) == 2:
+                raise RuntimeError('сбой посреди импорта')
+            return real_import(importer, records)
+
+        with mock.patch.object(transfer.Importer, '_import', crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.run_import()
+        self.assertEqual(Pin.objects.filter(user=self.importer).count(), 2)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['imported'], 2)
+
+        # Повторный запуск продолжает с checkpoint: без дублей и пропусков
+        self.assertEqual(self.run_import(), 3)
+        self.assertEqual(self.snapshot(self.importer), self.snapshot(self.author))
+
+
+class RelatedTests(SimpleTestCase):
+
+    def test_feature_shared_by_all_pins_gives_no_nan(self):
+        import numpy as np
+
+        pin_ids = np.array([1, 2, 3], dtype=np.int64)
+        # Признак 7 есть у всех трёх пинов (вес IDF 0), признак 9 — только у 1 и 2
+        keys = np.sort(np.array(
+            [(1 << 32) | 7, (1 << 32) | 9, (2 << 32) | 7, (2 << 32) | 9, (3 << 32) | 7], dtype=np.int64,
+        ))
+        neighbors, scores = related.compute(pin_ids, keys, np.arange(3), k=2)
+        self.assertFalse(np.isnan(scores).any())
+        self.assertEqual(neighbors[:, 0].tolist(), [2, 1, 0])
+        self.assertAlmostEqual(float(scores[0, 0]), 1.0, places=5)
+
+
+class BatchSaveTests(MediaTestCase):
+
+    def test_apply_batch_counts_new_saves_only(self):
+        user = User.objects.create_user('saver')
+        author = User.objects.create_user('author')
+        pins = [Pin.objects.create(user=author, title=f'Пин {n}', image='pins/images/x.jpg') for n in range(3)]
+        board = Board.objects.create(user=user, title='Пакет')
+        engagement._saves.clear()
+
+        boards.apply_batch(user, [(board.pk, pin.pk) for pin in pins], [])
+        self.assertEqual(dict(engagement._saves), {pin.pk: 1 for pin in pins})
+        # Уже сохранённые пины повторно не считаются
+        boards.apply_batch(user, [(board.pk, pin.pk) for pin in pins], [])
+        self.assertEqual(dict(engagement._saves), {pin.pk: 1 for pin in pins})
+
+        engagement.flush()
+        self.assertEqual(sorted(Pin.objects.filter(pk__in=[p.pk for p in pins]).values_list('save_count', flat=True)), [1, 1, 1])
+
+
+class BoardStatsTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        user = User.objects.create_user('owner')
+        self.pins = [Pin.objects.create(user=user, title=f'Пин {n}', image='pins/images/x.jpg') for n in range(6)]
+        self.board = Board.objects.create(user=user, title='Доска')
+
+    def stats(self):
+        self.board.refresh_from_db()
+        return self.board.pin_count, self.board.cover_pin_ids
+
+    def test_maintained_by_m2m_changes(self):
+        self.board.pins.add(*self.pins)
+        self.assertEqual(self.stats(), (6, [pin.pk for pin in self.pins[:boards.COVER_SIZE]]))
+        self.board.pins.remove(self.pins[0])
+        self.pins[1].boards.clear()
+        self.assertEqual(self.stats(), (4, [pin.pk for pin in self.pins[2:]]))
+        # Удалённый пин пропадает из счётчика и обложки сразу, до фоновой очистки связей
+        deletion.delete_pin(self.pins[2])
+        self.assertEqual(self.stats(), (3, [pin.pk for pin in self.pins[3:]]))
+        self.board.pins.clear()
+        self.assertEqual(self.stats(), (0, []))
+
+    def test_reconcile_repairs_drift(self):
+        self.board.pins.add(*self.pins[:2])
+        Board.objects.filter(pk=self.board.pk).update(pin_count=40, cover_pin_ids=[])
+        out = io.StringIO()
+        call_command('reconcile_board_stats', stdout=out)
+        self.assertIn('исправлено: 1', out.getvalue())
+        self.assertEqual(self.stats(), (2, [pin.pk for pin in self.pins[:2]]))
+
+
+class BoardBatchTests(MediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('owner')
+        cls.stranger = User.objects.create_user('stranger')
+        cls.pins = [Pin.objects.create(user=cls.stranger, title=f'Пин {n}', image='pins/images/x.jpg') for n in range(3)]
+        cls.board = Board.objects.create(user=cls.owner, title='Своя')
+        cls.foreign = Board.objects.create(user=cls.stranger, title='Чужая')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.owner)
+
+    def batch(self, add=(), remove=()):
+        return self.client.post(reverse('board_batch'), json.dumps({
+            'add': [{'board': board.pk, 'pin': pin.pk} for board, pin in add],
+            'remove': [{'board': board.pk, 'pin': pin.pk} for board, pin in remove],
+        }), content_type='application/json')
+
+    def test_foreign_board_rejects_whole_batch(self):
+        response = self.batch(add=[(self.board, self.pins[0]), (self.foreign, self.pins[1])])
+        self.assertEqual(response.status_code, 403)
+        self.assertIn(str(self.foreign.pk), response.json()['error'])
+        # Своя доска из того же пакета тоже не изменилась
+        self.assertFalse(self.board.pins.exists())
+        self.assertEqual(self.batch(remove=[(self.foreign, self.pins[0])]).status_code, 403)
+
+    def test_missing_pin_and_bad_payload(self):
+        response = self.client.post(reverse('board_batch'), json.dumps({'add': [{'board': self.board.pk, 'pin': 10 ** 6}]}),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+        for payload in ['не json', json.dumps({'add': {'board': 1}}), json.dumps({'add': [{'board': 'x', 'pin': 1}]})]:
+            response = self.client.post(reverse('board_batch'), payload, content_type='application/json')
+            self.assertEqual(response.status_code, 400, payload)
+        self.assertEqual(self.batch(add=[(self.board, self.pins[0])], remove=[(self.board, self.pins[0])]).status_code, 400)
+        self.assertFalse(self.board.pins.exists())
+
+    def test_anonymous(self):
+        self.client.logout()
+        self.assertEqual(self.batch(add=[(self.board, self.pins[0])]).status_code, 302)
+        self.assertFalse(self.board.pins.exists())
+
+    def test_add_and_remove(self):
+        response = self.batch(add=[(self.board, pin) for pin in self.pins])
+        self.assertEqual(response.json()['added'], 3)
+        response = self.batch(add=[(self.board, self.pins[0])], remove=[(self.board, self.pins[1])])
+        result = response.json()
+        self.assertEqual((result['added'], result['removed']), (0, 1))
+        self.assertEqual(result['boards'][str(self.board.pk)], {
+            'pin_count': 2, 'cover_pin_ids': [self.pins[0].pk, self.pins[2].pk],
+        })
+
+
+class FeedCursorTests(MediaTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = User.objects.create_user('viewer')
+        author = User.objects.create_user('author')
+        cls.pins = [Pin.objects.create(user=author, title=f'Пин {n}', image='pins/images/x.jpg') for n in range(40)]
+
+    def walk(self, between_pages):
+        queryset = feed.feed_queryset(self.viewer)
+        seen, cursor = [], None
+        for page_number in range(20):
+            page, cursor = feed.paginate(queryset, cursor, page_size=7)
+            seen += [pin.pk for pin in page]
+            if cursor is None:
+                return seen
+            between_pages(page_number, set(seen))
+        self.fail('Лента не закончилась')
+
+    def boost_unseen(self, seen):
+        # Ещё не показанные пины резко набирают сохранения и обгоняют курсор
+        unseen = sorted({pin.pk for pin in self.pins} - seen)
+        engagement.record_saves(unseen[-3:] * 50)
+        # Сохранения из прошлого снимка: их оценки публикуются уже в текущем
+        snapshot = engagement.current_snapshot()
+        with mock.patch.object(engagement, 'current_snapshot', return_value=snapshot - 1):
+            engagement.flush()
+        # Как будто публикует каждый процесс по очереди: повторы не должны ничего менять
+        engagement._published = None
+        engagement.publish()
+
+    def test_rescoring_within_snapshot_does_not_move_cursor(self):
+        seen = self.walk(lambda page_number, seen: self.boost_unseen(seen))
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), {pin.pk for pin in self.pins})
+        self.assertTrue(Pin.objects.filter(scored_snapshot=engagement.current_snapshot()).exists())
+
+    def test_cursor_from_previous_snapshot(self):
+        snapshot = engagement.current_snapshot()
+
+        def between_pages(page_number, seen):
+            self.boost_unseen(seen)
+            if page_number == 1:
+                # Граница снимка посреди прокрутки: оценки публикуются, курсор остаётся от прошлого снимка
+                patcher = mock.patch.object(engagement, 'current_snapshot', return_value=snapshot + 1)
+                patcher.start()
+                self.addCleanup(patcher.stop)
+
+        seen = self.walk(between_pages)
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(set(seen), {pin.pk for pin in self.pins})
+        self.assertTrue(Pin.objects.filter(scored_snapshot=snapshot + 1).exists())
+
+
+    def test_feed_page_does_not_rescore(self):
+        engagement.record_saves([pin.pk for pin in self.pins[:5]])
+        engagement.flush()
+        with CaptureQueriesContext(connection) as queries:
+            feed.paginate(feed.feed_queryset(self.viewer), page_size=7)
+        self.assertFalse([query for query in queries if query['sql'].startswith('UPDATE')])
+        self.assertEqual(Pin.objects.filter(pending_snapshot__isnull=False).count(), 5)
+
+    def test_repeated_rescore_keeps_previous_popularity(self):
+        pks = [pin.pk for pin in self.pins[:5]]
+        engagement.record_saves(pks)
+        engagement.flush()
+        snapshot = engagement.current_snapshot() + 1
+        before = dict(Pin.objects.filter(pk__in=pks).values_list('pk', 'popularity'))
+
+        # Два процесса выбрали одни и те же пины: второй UPDATE не находит строк
+        self.assertEqual(engagement.rescore(pks, snapshot), 5)
+        self.assertEqual(engagement.rescore(pks, snapshot), 0)
+        self.assertEqual(dict(Pin.objects.filter(pk__in=pks).values_list('pk', 'previous_popularity')), before)
+
+
+class ForbiddenTagRejectionTests(MediaTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('author')
+        self.client.force_login(self.user)
+        ForbiddenTag.objects.create(tag='спам*')
+
+    def assertNothingWritten(self):
+        self.assertFalse(Pin.all_objects.exists())
+        self.assertFalse(TaggedItem.objects.exists())
+        self.assertFalse(MediaBlob.objects.exists())
+
+    def upload(self):
+        return self.client.post(reverse('upload_pin'), {
+            'title': 'Реклама', 'tags': 'осень, спамер', 'image': jpeg((10, 10, 10)),
+        })
+
+    def test_form_rejects_before_writing(self):
+        response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('спамер', str(response.context['form'].errors['tags']))
+        self.assertNothingWritten()
+
+    def test_tag_forbidden_after_form_check_rolls_back_pin(self):
+        # Матчер формы ещё не видит новое правило — запись остановит сигнал, и пин откатится вместе с тегами
+        with mock.patch('core.forms.find_forbidden', return_value=[]):
+            response = self.upload()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('спамер', str(response.context['form'].errors['tags']))
+        self.assertNothingWritten()
+
+    def test_outside_forms_inside_atomic(self):
+        with self.assertRaises(ForbiddenTagsError):
+            with transaction.atomic():
+                pin = Pin.objects.create(user=self.user, title='Из shell', image='pins/images/x.jpg')
+                pin.tags.add('спамер')
+        self.assertFalse(Pin.all_objects.exists())
+
+
+class ForbiddenTagMatcherTests(SimpleTestCase):
+
+    def test_patterns(self):
+        matcher = ForbiddenTagMatcher(['спам*', '*казино', '*ставк*', 'точно'])
+        self.assertEqual(matcher.match('спамер'), 'спам*')
+        self.assertEqual(matcher.match('онлайнказино'), '*казино')
+        self.assertIsNone(matcher.match('казиноонлайн'))
+        self.assertEqual(matcher.match('лучшиеставки'), '*ставк*')
+        self.assertEqual(matcher.match('Точно'), 'точно')
+        self.assertIsNone(matcher.match('неточно'))
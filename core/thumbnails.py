@@ -0,0 +1,216 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+
+# Ширины производных изображений по назначению (карточка пина, аватар)
+DEFAULT_WIDTHS = {
+    'pin': (236, 474, 736),
+    'avatar': (64, 160, 320),
+}
+# Из каких файлов MEDIA_ROOT превью делаются по назначению: всё остальное (загрузки, реестр,
+# видео, сами превью) генератору не отдаём
+SOURCE_PREFIXES = {
+    'pin': ('pins/images/', 'pins/posters/'),
+    'avatar': ('avatars/',),
+}
+# Форматы: WebP для современных браузеров и JPEG как запасной
+FORMATS = {'webp': ('WEBP', 80), 'jpeg': ('JPEG', 85)}
+THUMBS_DIR = 'thumbs'
+REGISTRY_DIR = os.path.join(THUMBS_DIR, 'registry')
+
+# После неудачной генерации следующая попытка не раньше чем через FAILURE_DELAY * 2^(неудач - 1)
+FAILURE_DELAY = 60
+FAILURE_MAX_DELAY = 60 * 60 * 24
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+_in_flight = set()
+_registry_cache = OrderedDict()
+REGISTRY_CACHE_SIZE = 2048
+
+
+def widths_for(preset):
+    return getattr(settings, 'THUMBNAIL_WIDTHS', DEFAULT_WIDTHS)[preset]
+
+
+def registry_path(media_root, name):
+    key = hashlib.sha1(name.encode()).hexdigest()
+    return os.path.join(media_root, REGISTRY_DIR, key[:2], f'{key}.json')
+
+
+def generate_derivatives(media_root, name, widths):
+    """
+    Создаёт уменьшенные копии MEDIA_ROOT/name для всех ширин и форматов.
+    Запускается в отдельном процессе, поэтому работает только с путями, без ORM.
+    Имена файлов строятся от хэша содержимого: одинаковые картинки дают одни и те же файлы.
+    """
+    from PIL import Image, ImageOps
+
+    source = os.path.join(media_root, name)
+    digest = hashlib.sha256()
+    with open(source, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    content_hash = digest.hexdigest()[:20]
+
+    variants = {}
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        for width in sorted(widths):
+            copy = image.copy()
+            copy.thumbnail((width, width * 10))
+            for fmt, (pil_format, quality) in FORMATS.items():
+                relative = os.path.join(THUMBS_DIR, content_hash[:2], f'{content_hash}-{copy.width}.{fmt}')
+                target = os.path.join(media_root, relative)
+                if not os.path.exists(target):
+                    os.makedirs(os.path.dirname(target), exist_ok=True)
+                    out = copy.convert('RGB') if pil_format == 'JPEG' else copy
+                    tmp = f'{target}.{os.getpid()}.tmp'
+                    out.save(tmp, pil_format, quality=quality)
+                    os.replace(tmp, target)
+                variants[f'{copy.width}.{fmt}'] = relative.replace(os.sep, '/')
+            if width >= image.width:
+                break  # Не увеличиваем: хватит одной копии размером с оригинал
+
+    # name — по нему core/blobs.sweep_orphans проверяет, нужен ли ещё исходник
+    entry = {'name': name, 'hash': content_hash, 'variants': variants}
+    _write(registry_path(media_root, name), entry)
+    return entry
+
+
+def lookup(name):
+    """Запись реестра для исходного файла или None, если производных ещё нет."""
+    path = registry_path(str(settings.MEDIA_ROOT), name)
+    try:
+        # Запись могли удалить или пересоздать в другом процессе: кэш сверяем по mtime файла
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        _registry_cache.pop(name, None)
+        return None
+    cached = _registry_cache.get(name)
+    if cached is not None and cached[0] == mtime:
+        _registry_cache.move_to_end(name)
+        return cached[1]
+    entry = _read(path)
+    if entry is None or 'variants' not in entry:
+        return None  # Нет записи или отметка о неудаче (_record_failure)
+    _registry_cache[name] = (mtime, entry)
+    _registry_cache.move_to_end(name)
+    if len(_registry_cache) > REGISTRY_CACHE_SIZE:
+        _registry_cache.popitem(last=False)
+    return entry
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(path, entry):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(entry, f)
+    os.replace(tmp, path)
+
+
+def _record_failure(media_root, name, error):
+    """
+    Вместо записи с производными кладёт в реестр отметку о неудаче: битый файл не ставится
+    в пул заново на каждый показ карточки, а повторяется с растущей паузой.
+    """
+    logger.warning('Не удалось создать превью %s: %r', name, error)
+    path = registry_path(media_root, name)
+    previous = _read(path) or {}
+    if 'variants' in previous:
+        return  # Другой процесс уже справился
+    failures = previous.get('failures', 0) + 1
+    delay = min(FAILURE_DELAY * 2 ** (failures - 1), FAILURE_MAX_DELAY)
+    try:
+        _write(path, {'name': name, 'failures': failures, 'retry_at': time.time() + delay})
+    except OSError:
+        logger.exception('Не удалось записать отметку о неудаче для %s', name)
+
+
+def _backing_off(media_root, name):
+    entry = _read(registry_path(media_root, name))
+    return entry is not None and entry.get('retry_at', 0) > time.time()
+
+
+def remove(name):
+    """Удаляет производные файла и его запись в реестре (исходник удалён, см. blobs._delete_if_unused)."""
+    media_root = str(settings.MEDIA_ROOT)
+    entry = _read(registry_path(media_root, name)) or {}
+    removed = 0
+    for relative in entry.get('variants', {}).values():
+        try:
+            os.remove(os.path.join(media_root, relative))
+            removed += 1
+        except OSError:
+            pass
+    forget(name)
+    return removed
+
+
+def forget(name):
+    """Удаляет только запись реестра: производные общие с другим файлом того же содержимого или пересоздадутся."""
+    _registry_cache.pop(name, None)
+    try:
+        os.remove(registry_path(str(settings.MEDIA_ROOT), name))
+    except OSError:
+        pass
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=settings.THUMBNAIL_WORKERS)
+        return _executor
+
+
+def schedule(name, preset='pin'):
+    """
+    Ставит генерацию в пул процессов и сразу возвращается.
+    THUMBNAIL_WORKERS = 0 — генерировать прямо в запросе (удобно в тестах).
+    Файл, для которого генерация недавно не удалась, пропускается до конца паузы.
+    """
+    widths = widths_for(preset)
+    media_root = str(settings.MEDIA_ROOT)
+    if _backing_off(media_root, name):
+        return
+    if not settings.THUMBNAIL_WORKERS:
+        try:
+            generate_derivatives(media_root, name, widths)
+        except Exception as exc:
+            _record_failure(media_root, name, exc)
+        return
+    with _executor_lock:
+        if name in _in_flight:
+            return
+        _in_flight.add(name)
+    future = _get_executor().submit(generate_derivatives, media_root, name, widths)
+    future.add_done_callback(lambda f: _done(media_root, name, f))
+
+
+def _done(media_root, name, future):
+    try:
+        error = future.exception()
+        if error is not None:
+            _record_failure(media_root, name, error)
+    finally:
+        _in_flight.discard(name)
@@ -0,0 +1,447 @@
+"""
+Импорт и экспорт пинов пачками (import_pins, export_pins, /export/).
+
+Архив — ZIP: файлы медиа под media/<имя в хранилище> и в конце pins.jsonl, по строке JSON на пин:
+    {"title": ..., "description": ..., "tags": [...], "created_at": "...",
+     "image": "media/pins/images/ab/ab….jpg", "video": null, "width": 640, "height": 480,
+     "boards": ["Название доски", ...]}
+Экспорт пишет архив потоком: файлы копируются кусками, JSONL копится во временном файле,
+поэтому память не растёт с числом пинов. Импорт читает тот же архив (или pins.jsonl рядом с каталогом media/).
+"""
+import io
+import json
+import os
+import tempfile
+import time
+import zipfile
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, DateTimeField, F, FloatField, IntegerField, Prefetch, Q, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from taggit.models import Tag, TaggedItem
+
+from . import boards as board_stats, engagement, fragments, tagstats
+from .forbidden import get_matcher
+from .models import Board, MediaBlob, MediaJob, Pin, SearchIndexEntry
+from .search import get_backend
+
+METADATA_NAME = 'pins.jsonl'
+MEDIA_PREFIX = 'media/'
+COPY_CHUNK = 1024 * 1024
+# Поле пина -> каталог в хранилище и допустимые расширения (как у формы загрузки)
+MEDIA_FIELDS = {
+    'image': ('pins/images', ('.jpg', '.jpeg', '.png', '.gif', '.webp')),
+    'video': ('pins/videos', ('.mp4', '.webm', '.mov')),
+}
+TITLE_MAX_LENGTH = Pin._meta.get_field('title').max_length
+TAG_MAX_LENGTH = Tag._meta.get_field('name').max_length
+
+
+class ImportRejected(Exception):
+    """Архив целиком не подходит для импорта (нет pins.jsonl, битый ZIP)."""
+
+
+# --- Экспорт ---
+
+def pin_record(pin):
+    record = {
+        'id': pin.pk,
+        'title': pin.title,
+        'description': pin.description,
+        'tags': [tag.name for tag in pin.tags.all()],
+        'created_at': pin.created_at.isoformat(),
+        'width': pin.width,
+        'height': pin.height,
+        'boards': [board.title for board in pin.boards.all()],
+    }
+    for field in MEDIA_FIELDS:
+        name = getattr(pin, field).name
+        record[field] = MEDIA_PREFIX + name if name else None
+    return record
+
+
+def _archive_steps(user, out, batch_size):
+    """
+    Пишет архив в out и уступает управление после каждого куска: stream_archive
+    в этот момент забирает готовые байты. out может не поддерживать seek (ответ, stdout).
+    """
+    pins = (
+        Pin.objects.filter(user=user).order_by('pk')
+        .prefetch_related('tags', Prefetch('boards', queryset=Board.objects.filter(user=user).only('id', 'title')))
+    )
+    written = set()  # Один файл у нескольких пинов кладём в архив один раз
+    with tempfile.SpooledTemporaryFile(max_size=COPY_CHUNK) as metadata, \
+            zipfile.ZipFile(out, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for pin in pins.iterator(chunk_size=batch_size):
+            record = pin_record(pin)
+            for field in MEDIA_FIELDS:
+                arcname = record[field]
+                if not arcname or arcname in written:
+                    continue
+                try:
+                    source = default_storage.open(arcname[len(MEDIA_PREFIX):], 'rb')
+                except OSError:
+                    record[field] = None  # Файла нет на диске — пин выгружаем без него
+                    continue
+                written.add(arcname)
+                # Картинки и видео уже сжаты — кладём как есть
+                with source, archive.open(arcname, 'w', force_zip64=True) as entry:
+                    for chunk in iter(lambda: source.read(COPY_CHUNK), b''):
+                        entry.write(chunk)
+                        yield
+            metadata.write(json.dumps(record, ensure_ascii=False).encode() + b'\n')
+        metadata.seek(0)
+        info = zipfile.ZipInfo(METADATA_NAME, date_time=timezone.now().timetuple()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with archive.open(info, 'w', force_zip64=True) as entry:
+            for chunk in iter(lambda: metadata.read(COPY_CHUNK), b''):
+                entry.write(chunk)
+                yield
+    yield
+
+
+def write_archive(user, out, batch_size=500):
+    """Выгружает все пины пользователя в файл out (открытый на запись в двоичном режиме)."""
+    for _ in _archive_steps(user, out, batch_size):
+        pass
+
+
+class _Pipe:
+    """Приёмник для zipfile без seek: байты забирает генератор ответа."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def stream_archive(user, batch_size=500):
+    """Архив кусками для StreamingHttpResponse."""
+    pipe = _Pipe()
+    for _ in _archive_steps(user, pipe, batch_size):
+        data = pipe.take()
+        if data:
+            yield data
+
+
+# --- Импорт ---
+
+class ZipSource:
+    def __init__(self, path):
+        self.archive = zipfile.ZipFile(path)
+        if METADATA_NAME not in self.archive.namelist():
+            raise ImportRejected(f'В архиве нет {METADATA_NAME}.')
+
+    def lines(self):
+        with self.archive.open(METADATA_NAME) as raw:
+            yield from enumerate(io.TextIOWrapper(raw, encoding='utf-8'), 1)
+
+    def open(self, name):
+        try:
+            return self.archive.open(name)
+        except KeyError:
+            raise FileNotFoundError(name)
+
+    def close(self):
+        self.archive.close()
+
+
+class DirectorySource:
+    """pins.jsonl и каталог media/ рядом с ним — распакованный архив."""
+
+    def __init__(self, path, base_dir=None):
+        self.path = path
+        self.base_dir = os.path.realpath(base_dir or os.path.dirname(os.path.abspath(path)))
+
+    def lines(self):
+        with open(self.path, encoding='utf-8') as f:
+            yield from enumerate(f, 1)
+
+    def open(self, name):
+        path = os.path.realpath(os.path.join(self.base_dir, name))
+        if not path.startswith(self.base_dir + os.sep):
+            raise FileNotFoundError(name)
+        return open(path, 'rb')
+
+    def close(self):
+        pass
+
+
+def open_source(path, media_dir=None):
+    if zipfile.is_zipfile(path):
+        return ZipSource(path)
+    if not os.path.isfile(path):
+        raise ImportRejected(f'Нет файла {path}.')
+    return DirectorySource(path, media_dir)
+
+
+class Importer:
+    """
+    Импортирует строки pins.jsonl пачками: один bulk_create пинов, меток taggit, связей с досками
+    и задач обработки медиа на пачку. После каждой пачки номер строки пишется в файл checkpoint —
+    прерванный импорт продолжается с него.
+    """
+
+    def __init__(self, user, source, batch_size=500, checkpoint=None, log=None):
+        self.user = user
+        self.source = source
+        self.batch_size = batch_size
+        self.checkpoint = checkpoint
+        self.log = log or (lambda message: None)
+        self.imported = 0
+        self.imported_before = 0  # По checkpoint, в прошлых запусках
+        self.rejected = 0
+        self.elapsed = 0.0
+        self.content_type = ContentType.objects.get_for_model(Pin)
+
+    @property
+    def rate(self):
+        return self.imported / self.elapsed if self.elapsed else 0.0
+
+    def run(self):
+        done = self._load_checkpoint()
+        batch = []
+        for number, line in self.source.lines():
+            if number <= done or not line.strip():
+                continue
+            batch.append((number, line))
+            if len(batch) >= self.batch_size:
+                self._run_batch(batch)
+                batch = []
+        if batch:
+            self._run_batch(batch)
+        return self.imported
+
+    def _load_checkpoint(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return 0
+        with open(self.checkpoint, encoding='utf-8') as f:
+            state = json.load(f)
+        self.imported_before = state['imported']
+        self.log(f'Продолжаем со строки {state["line"] + 1} (уже импортировано {state["imported"]})')
+        return state['line']
+
+    def _save_checkpoint(self, line):
+        if not self.checkpoint:
+            return
+        tmp = f'{self.checkpoint}.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'line': line, 'imported': self.imported_before + self.imported, 'saved_at': timezone.now().isoformat()}, f)
+        os.replace(tmp, self.checkpoint)
+
+    def _reject(self, number, message):
+        self.rejected += 1
+        self.log(f'Строка {number}: {message}')
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        records = self._validate(batch)
+        imported = self._import(records) if records else 0
+        self.imported += imported
+        self.elapsed += time.perf_counter() - started
+        self._save_checkpoint(batch[-1][0])
+        self.log(f'Строка {batch[-1][0]}: импортировано {self.imported}, {self.rate:.0f} пинов/с')
+
+    # Проверка пачки
+
+    def _validate(self, batch):
+        matcher = get_matcher()  # Один матчер запрещённых тегов на всю пачку
+        stored = {}  # Файл, встреченный в пачке несколько раз, сохраняем один раз
+        records = []
+        for number, line in batch:
+            try:
+                record = self._parse(line)
+            except ValueError as exc:
+                self._reject(number, str(exc))
+                continue
+            forbidden = matcher.find(record['tags'])
+            if forbidden:
+                self._reject(number, f'запрещённые теги: {", ".join(forbidden)}')
+                continue
+            try:
+                for field in MEDIA_FIELDS:
+                    if record[field]:
+                        if record[field] not in stored:
+                            stored[record[field]] = self._store_media(field, record[field])
+                        record[field] = stored[record[field]]
+            except (OSError, ValueError) as exc:
+                self._reject(number, f'файл {exc}')
+                continue
+            records.append(record)
+        return records
+
+    def _parse(self, line):
+        try:
+            data = json.loads(line)
+        except ValueError:
+            raise ValueError('не JSON')
+        if not isinstance(data, dict):
+            raise ValueError('ожидается объект')
+        title = str(data.get('title') or '').strip()
+        if not title:
+            raise ValueError('нет заголовка')
+        tags = data.get('tags') or []
+        if not isinstance(tags, list):
+            raise ValueError('tags должен быть списком')
+        tags = list(dict.fromkeys(str(tag).strip()[:TAG_MAX_LENGTH] for tag in tags if str(tag).strip()))
+        boards = data.get('boards') or []
+        if not isinstance(boards, list):
+            raise ValueError('boards должен быть списком')
+        record = {
+            'title': title[:TITLE_MAX_LENGTH],
+            'description': str(data.get('description') or ''),
+            'tags': tags,
+            'boards': list(dict.fromkeys(str(board).strip()[:200] for board in boards if str(board).strip())),
+            'created_at': parse_datetime(str(data.get('created_at') or '')),
+            'width': data.get('width') if isinstance(data.get('width'), int) else None,
+            'height': data.get('height') if isinstance(data.get('height'), int) else None,
+        }
+        for field in MEDIA_FIELDS:
+            record[field] = data.get(field) or None
+        if not record['image'] and not record['video']:
+            raise ValueError('нужно изображение или видео')
+        if record['created_at'] and timezone.is_naive(record['created_at']):
+            record['created_at'] = timezone.make_aware(record['created_at'])
+        return record
+
+    def _store_media(self, field, name):
+        directory, extensions = MEDIA_FIELDS[field]
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in extensions:
+            raise ValueError(f'{name}: неподдерживаемый тип')
+        # Хранилище само называет файл хэшем содержимого: повторный импорт не создаёт копий
+        with self.source.open(name) as f:
+            return default_storage.save(f'{directory}/import{extension}', File(f))
+
+    # Запись пачки
+
+    def _import(self, records):
+        with transaction.atomic():
+            last_pk = Pin.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            pins = Pin.objects.bulk_create([
+                Pin(
+                    user=self.user, title=record['title'], description=record['description'],
+                    image=record['image'], video=record['video'],
+                    width=record['width'], height=record['height'],
+                    # Превью, EXIF и постер видео — в run_media_worker, как у обычной загрузки
+                    processing_status=Pin.STATUS_PENDING,
+                )
+                for record in records
+            ])
+            pin_ids = [pin.pk for pin in pins]
+            if pin_ids[0] is None:
+                # MySQL не возвращает id после bulk_create: вставленные строки — новые пины пользователя
+                pin_ids = list(
+                    Pin.objects.filter(user=self.user, pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)
+                )
+                if len(pin_ids) != len(records):
+                    raise RuntimeError('Не удалось сопоставить вставленные пины — повторите импорт с checkpoint.')
+            self._set_dates(pin_ids, records)
+            self._assign_tags(pin_ids, records)
+            self._add_to_boards(pin_ids, records)
+            self._acquire_media(records)
+            MediaJob.objects.bulk_create([MediaJob(pin_id=pin_id) for pin_id in pin_ids])
+            self._index(pin_ids)
+            fragments.bump(fragments.USER, self.user.pk)
+        return len(pin_ids)
+
+    def _set_dates(self, pin_ids, records):
+        # created_at — auto_now_add, bulk_create его перезаписывает: возвращаем исходное время одним UPDATE
+        now = timezone.now()
+        created = {pin_id: record['created_at'] or now for pin_id, record in zip(pin_ids, records)}
+        Pin.objects.filter(pk__in=pin_ids).update(
+            created_at=Case(*[When(pk=pk, then=Value(value)) for pk, value in created.items()],
+                            output_field=DateTimeField()),
+            popularity=Case(*[When(pk=pk, then=Value(engagement.score(0, 0, value))) for pk, value in created.items()],
+                            output_field=FloatField()),
+        )
+
+    def _tag_ids(self, names):
+        """{имя в нижнем регистре: id тега}. Недостающие теги создаются одним bulk_create."""
+        def existing(names):
+            lowered = [name.lower() for name in names]
+            # iexact не во всех СУБД понимает регистр кириллицы — ищем и как есть, и в нижнем регистре
+            rows = Tag.objects.filter(Q(name__in=names) | Q(name__in=lowered)).values_list('name', 'pk')
+            return {name.lower(): pk for name, pk in rows}
+
+        wanted = {name.lower(): name for name in names}
+        found = existing(list(wanted.values()))
+        missing = [name for key, name in wanted.items() if key not in found]
+        if missing:
+            Tag.objects.bulk_create([Tag(name=name, slug=Tag().slugify(name)) for name in missing], ignore_conflicts=True)
+            found.update(existing(missing))
+            for name in missing:
+                if name.lower() not in found:
+                    # Слаг совпал с чужим тегом — taggit подберёт свободный сам
+                    tag = Tag(name=name)
+                    tag.save()
+                    found[name.lower()] = tag.pk
+            tagstats.bump_version()
+        return found
+
+    def _assign_tags(self, pin_ids, records):
+        tag_ids = self._tag_ids([tag for record in records for tag in record['tags']])
+        items = {
+            (pin_id, tag_ids[tag.lower()])
+            for pin_id, record in zip(pin_ids, records)
+            for tag in record['tags']
+        }
+        TaggedItem.objects.bulk_create(
+            [TaggedItem(content_type=self.content_type, object_id=pin_id, tag_id=tag_id) for pin_id, tag_id in items],
+            ignore_conflicts=True,
+        )
+        tagstats.record_tagged_many(Counter(tag_id for _, tag_id in items))
+
+    def _add_to_boards(self, pin_ids, records):
+        titles = {title for record in records for title in record['boards']}
+        if not titles:
+            return
+        boards = dict(Board.objects.filter(user=self.user, title__in=titles).values_list('title', 'pk'))
+        for title in titles - boards.keys():
+            # Новых досок немного — обычный create, с индексом поиска и кэшем через сигналы
+            boards[title] = Board.objects.create(user=self.user, title=title).pk
+        Membership = Board.pins.through
+        memberships = [
+            Membership(board_id=boards[title], pin_id=pin_id)
+            for pin_id, record in zip(pin_ids, records)
+            for title in record['boards']
+        ]
+        Membership.objects.bulk_create(memberships, ignore_conflicts=True)
+        # m2m_changed bulk_create не шлёт — сохранения для популярности считаем сами
+        engagement.record_saves([membership.pin_id for membership in memberships])
+        board_ids = {boards[title] for title in titles}
+        board_stats.refresh(board_ids)
+        for board_id in board_ids:
+            fragments.invalidate_board(board_id, self.user.pk)
+
+    def _acquire_media(self, records):
+        # bulk_create не шлёт post_save — ссылки на файлы считаем сами, одним UPDATE
+        references = Counter(record[field] for record in records for field in MEDIA_FIELDS if record[field])
+        MediaBlob.objects.filter(name__in=references).update(refcount=F('refcount') + Case(
+            *[When(name=name, then=Value(count)) for name, count in references.items()],
+            default=Value(0), output_field=IntegerField(),
+        ))
+
+    def _index(self, pin_ids):
+        backend = get_backend()
+        pins = Pin.objects.filter(pk__in=pin_ids).select_related('user').prefetch_related('tags').order_by('pk')
+        if hasattr(backend, 'index_queryset'):
+            backend.index_queryset(SearchIndexEntry.KIND_PIN, pins)
+        else:
+            for pin in pins:
+                backend.index_pin(pin)
@@ -0,0 +1,231 @@
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.db import connection, transaction
+from django.utils import timezone
+
+# Типы файлов по полям формы пина и их «магические» первые байты
+ALLOWED_TYPES = {
+    'image': ('image/jpeg', 'image/png', 'image/gif', 'image/webp'),
+    'video': ('video/mp4', 'video/webm', 'video/quicktime'),
+}
+PARTIAL_DIR = os.path.join('uploads', 'partial')
+COPY_CHUNK = 1024 * 1024
+
+
+def max_size(field):
+    return settings.UPLOAD_MAX_SIZES[field]
+
+
+def looks_like(field, head):
+    """Проверка по первым байтам: расширение и Content-Type клиент может подделать."""
+    if field == 'image':
+        return (
+            head.startswith(b'\xff\xd8\xff')             # JPEG
+            or head.startswith(b'\x89PNG\r\n\x1a\n')     # PNG
+            or head[:6] in (b'GIF87a', b'GIF89a')        # GIF
+            or (head[:4] == b'RIFF' and head[8:12] == b'WEBP')
+        )
+    if field == 'video':
+        return (
+            head[4:8] in (b'ftyp', b'moov', b'mdat', b'free', b'wide')  # MP4 / MOV
+            or head.startswith(b'\x1a\x45\xdf\xa3')                      # WebM / Matroska
+        )
+    return False
+
+
+class UploadRejected(Exception):
+    pass
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """
+    Проверяет тип и размер файла пина во время приёма multipart-запроса.
+    Плохой файл обрывает загрузку на первом же куске, а не после записи всего тела.
+    Причина сохраняется в request.upload_errors[поле].
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.request.upload_errors = {}
+        # Тело больше любого лимита — оборвём на первом же файле
+        self.too_large = content_length > sum(settings.UPLOAD_MAX_SIZES.values()) + COPY_CHUNK
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        self.received = 0
+        self.checked = False
+        if field_name in ALLOWED_TYPES:
+            if self.too_large:
+                self._reject(field_name, 'Файл слишком большой.')
+            if content_type not in ALLOWED_TYPES[field_name]:
+                self._reject(field_name, 'Неподдерживаемый тип файла.')
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.field_name in ALLOWED_TYPES:
+            if not self.checked:
+                self.checked = True
+                if not looks_like(self.field_name, raw_data[:16]):
+                    self._reject(self.field_name, 'Содержимое файла не похоже на изображение или видео.')
+            self.received += len(raw_data)
+            if self.received > max_size(self.field_name):
+                self._reject(self.field_name, 'Файл слишком большой.')
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+    def _reject(self, field, message):
+        self.request.upload_errors[field] = message
+        raise StopUpload(connection_reset=True)
+
+
+# --- Докачиваемая загрузка по частям ---
+
+def partial_path(session):
+    return os.path.join(settings.MEDIA_ROOT, PARTIAL_DIR, f'{session.pk}.part')
+
+
+def receive_chunk(session, offset, stream, length, chunk_sha256=''):
+    """
+    Принимает кусок из потока запроса в отдельный файл .chunk рядом с .part, не держа его в памяти
+    целиком. Без транзакции и блокировок: медленный клиент занимает только свой файл, а не строку
+    сессии. Возвращает путь к файлу; в .part его переносит append_chunk(). Кусок с неверной
+    контрольной суммой отбрасывается.
+    """
+    if offset + length > session.size:
+        raise UploadRejected('Кусок выходит за объявленный размер файла.')
+    directory = os.path.dirname(partial_path(session))
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{session.pk}.{uuid.uuid4().hex}.chunk')
+    digest = hashlib.sha256()
+    written = 0
+    try:
+        with open(path, 'wb') as f:
+            while written < length:
+                data = stream.read(min(COPY_CHUNK, length - written))
+                if not data:
+                    break
+                if offset == 0 and written == 0 and not looks_like('video', data[:16]):
+                    raise UploadRejected('Содержимое файла не похоже на видео.')
+                f.write(data)
+                digest.update(data)
+                written += len(data)
+        if written != length or (chunk_sha256 and digest.hexdigest() != chunk_sha256.lower()):
+            raise UploadRejected('Кусок повреждён, отправьте его ещё раз.')
+    except BaseException:
+        discard_chunk(path)
+        raise
+    return path
+
+
+def append_chunk(session, offset, chunk_path):
+    """Дописывает принятый кусок в .part с места offset (хвост неудачной попытки отрезается)."""
+    try:
+        with open(partial_path(session), 'ab') as f, open(chunk_path, 'rb') as chunk:
+            f.truncate(offset)
+            shutil.copyfileobj(chunk, f, COPY_CHUNK)
+    finally:
+        discard_chunk(chunk_path)
+
+
+def discard_chunk(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def finalize(session):
+    """Проверяет размер и контрольную сумму и переносит файл в pins/videos/. Возвращает имя в storage."""
+    path = partial_path(session)
+    if os.path.getsize(path) != session.size:
+        raise UploadRejected('Файл загружен не полностью.')
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''):
+            digest.update(chunk)
+    if session.sha256 and digest.hexdigest() != session.sha256.lower():
+        raise UploadRejected('Контрольная сумма не совпала.')
+    name = f'pins/videos/{os.path.basename(session.filename)}'
+    if hasattr(default_storage, 'adopt'):
+        # Тот же диск: перенос без копирования
+        return default_storage.adopt(path, name, sha256=digest.hexdigest())
+    with open(path, 'rb') as f:
+        name = default_storage.save(name, File(f))
+    os.remove(path)
+    return name
+
+
+def discard(session):
+    try:
+        os.remove(partial_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def session_ttl():
+    return timedelta(hours=getattr(settings, 'UPLOAD_SESSION_TTL_HOURS', 24))
+
+
+def expire_sessions(now=None, dry_run=False):
+    """
+    Удаляет сессии, в которые не писали дольше UPLOAD_SESSION_TTL_HOURS, вместе с их .part,
+    .part без сессии (например, пользователь удалён) и брошенные .chunk оборванных запросов.
+    Возвращает (сессий, файлов).
+    """
+    from .models import UploadSession
+
+    cutoff = (now or timezone.now()) - session_ttl()
+    sessions = files = 0
+    stale = UploadSession.objects.filter(updated_at__lt=cutoff).values_list('pk', flat=True)
+    for pk in stale.iterator():
+        with transaction.atomic():
+            # updated_at перепроверяем под блокировкой: только что принятый кусок его сдвинул.
+            # Сессию, которую сейчас завершают (views.upload_finalize), пропускаем
+            queryset = UploadSession.objects.filter(pk=pk, updated_at__lt=cutoff)
+            if connection.features.has_select_for_update_skip_locked:
+                queryset = queryset.select_for_update(skip_locked=True)
+            session = queryset.first()
+            if session is None:
+                continue
+            if not dry_run:
+                discard(session)
+                session.delete()
+        sessions += 1
+
+    directory = os.path.join(settings.MEDIA_ROOT, PARTIAL_DIR)
+    try:
+        entries = list(os.scandir(directory))
+    except FileNotFoundError:
+        entries = []
+    parts = {entry.name[:-len('.part')]: entry for entry in entries if entry.name.endswith('.part')}
+    known = {str(pk) for pk in UploadSession.objects.filter(pk__in=_uuids(parts)).values_list('pk', flat=True)}
+    # Кусок принимается минуты, а не сутки: старый .chunk остался от упавшего процесса
+    chunks = [entry for entry in entries if entry.name.endswith('.chunk')]
+    for entry in [entry for key, entry in parts.items() if key not in known] + chunks:
+        if entry.stat().st_mtime >= cutoff.timestamp():
+            continue
+        if not dry_run:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                continue
+        files += 1
+    return sessions, files
+
+
+def _uuids(keys):
+    result = []
+    for key in keys:
+        try:
+            result.append(uuid.UUID(key))
+        except ValueError:
+            pass
+    return result
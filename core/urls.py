@@ -1,21 +1,40 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth.views import LogoutView
-from .views import home, profile, upload_pin, edit_pin, upload_board, login_view, register, upload_avatar, add_to_board, remove_from_board, delete_pin, board_detail, delete_board
+from .views import home, home_feed, profile, upload_pin, edit_pin, upload_board, login_view, register, upload_avatar, add_to_board, remove_from_board, delete_pin, board_detail, delete_board, delete_account, board_batch, export_pins, thumbnail, upload_init, upload_chunk, upload_finalize, cache_stats, metrics_view, tags_trending, tags_autocomplete, recent_searches
+from . import async_views
+
+# Под ASGI главная, профиль и доска — асинхронные (core/async_views.py), под WSGI — синхронные
+if settings.ASYNC_VIEWS:
+    home, profile, board_detail = async_views.home, async_views.profile, async_views.board_detail
 
 urlpatterns = [
     path('', home, name='home'),
+    path('feed/', home_feed, name='home_feed'),
     path('login/', login_view, name='login'),
     path('register/', register, name='register'),
     path('logout/', LogoutView.as_view(next_page='login'), name='logout'),
     path('profile/upload_avatar/', upload_avatar, name='upload_avatar'),
     path('profile/', profile, name='profile'),
+    path('profile/delete/', delete_account, name='delete_account'),
     path('profile/<str:username>/', profile, name='user_profile'),
     path('upload_pin/', upload_pin, name='upload_pin'),
+    path('upload/', upload_init, name='upload_init'),
+    path('upload/<uuid:upload_id>/', upload_chunk, name='upload_chunk'),
+    path('upload/<uuid:upload_id>/finalize/', upload_finalize, name='upload_finalize'),
     path('upload_board/', upload_board, name='upload_board'),
     path('add_to_board/<int:pin_id>/', add_to_board, name='add_to_board'),
     path('remove_from_board/<int:board_id>/<int:pin_id>/', remove_from_board, name='remove_from_board'),
     path('delete_pin/<int:pin_id>/', delete_pin, name='delete_pin'),
     path('board/<int:board_id>/', board_detail, name='board_detail'),
+    path('boards/batch/', board_batch, name='board_batch'),
     path('board/<int:board_id>/delete/', delete_board, name='delete_board'),
     path('pin/<int:pin_id>/edit/', edit_pin, name='edit_pin'),
+    path('export/', export_pins, name='export_pins'),
+    path('tags/trending/', tags_trending, name='tags_trending'),
+    path('tags/autocomplete/', tags_autocomplete, name='tags_autocomplete'),
+    path('search/recent/', recent_searches, name='recent_searches'),
+    path('cache-stats/', cache_stats, name='cache_stats'),
+    path('metrics/', metrics_view, name='metrics'),
+    path('thumbs/<str:preset>/<int:width>/<str:fmt>/<path:name>', thumbnail, name='thumbnail'),
 ]
\ No newline at end of file
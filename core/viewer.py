@@ -0,0 +1,46 @@
+"""
+Данные зрителя для всех шаблонов: профиль (аватар и имя в шапке) и его доски (список «Сохранить
+в доску» на каждой карточке ленты).
+
+ViewerMiddleware кладёт в request.viewer ленивый объект, контекстный процессор отдаёт его шаблонам
+как {{ viewer }}: за запрос данные загружаются не больше одного раза, сколько бы карточек ни было.
+Между запросами они лежат в кэше фрагментов (core/fragments.py) под версией VIEWER пользователя —
+её повышают сигналы при изменении профиля или досок (core/signals.py).
+"""
+from django.utils.functional import SimpleLazyObject
+
+from . import fragments
+from .models import Board, Profile
+
+
+class Viewer:
+    """profile — None у анонимного пользователя (и у старого аккаунта без профиля), boards — [Board(id, title)]."""
+
+    def __init__(self, profile=None, boards=()):
+        self.profile = profile
+        self.boards = list(boards)
+
+
+ANONYMOUS = Viewer()
+
+
+def _load(user):
+    return Viewer(
+        Profile.objects.filter(user=user).first(),
+        Board.objects.filter(user=user).only('id', 'title').order_by('pk'),
+    )
+
+
+def get(user):
+    if not user.is_authenticated:
+        return ANONYMOUS
+    return fragments.get_or_render('viewer', [(fragments.VIEWER, user.pk)], lambda: _load(user))
+
+
+def lazy(request):
+    # request.user читаем при первом обращении: асинхронные view подменяют его уже загруженным
+    return SimpleLazyObject(lambda: get(request.user))
+
+
+def invalidate(user_id):
+    fragments.bump(fragments.VIEWER, user_id)
@@ -1,12 +1,32 @@
+import json
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.contrib.auth import login, authenticate
+from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.forms import AuthenticationForm
+from django.db import transaction
 from django.db.models import Q
 from django.contrib import messages
+from django.http import Http404, JsonResponse, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_POST
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.template.loader import render_to_string
 from .models import Pin, Board, Profile, ForbiddenTag, User
 from .forms import PinForm, BoardForm, ProfileForm, RegisterForm  # Импорты форм
-from .models import SearchHistory
+from .models import UploadSession
+from .feed import FEED_PAGE_SIZE, feed_queryset, paginate
+from .interests import interests_for
+from .search import get_backend
+from . import deletion, engagement, fragments, history, metrics, related, serve, tagstats, thumbnails, transfer
+from .media import enqueue as enqueue_media
+from .boards import BatchRejected, apply_batch, attach_covers, parse_operations
+from .forbidden import ForbiddenTagsError, find_forbidden
+from .uploads import ALLOWED_TYPES, LimitedUploadHandler, UploadRejected, append_chunk, receive_chunk, discard_chunk, finalize as finalize_upload
+
+ALLOWED_VIDEO_TYPES = ALLOWED_TYPES['video']
 
 
 def register(request):
@@ -33,74 +53,105 @@ def login_view(request):
     return render(request, 'core/login.html', {'form': form})
 
 
+def _recommendations(user, query):
+    # Рекомендации только без активного поиска: (теги интересов, id авторов, похожие пины)
+    if query:
+        return set(), set(), []
+    interest_tags, interest_users = interests_for(user)  # Одна строка UserInterest
+    return interest_tags, interest_users, related.recommend_for(user)
+
+
+def _feed_page(request, query, recommendations=None):
+    # Одна страница ленты: пины (со связанными user/profile/tags) и курсор следующей
+    interest_tags, interest_users, related_pins = recommendations or _recommendations(request.user, query)
+    pins = feed_queryset(request.user, query, interest_tags, interest_users, related_pins)
+    page, next_cursor = paginate(pins, request.GET.get('cursor'))
+    # Показы копятся в памяти и пишутся пачкой после ответа (core/engagement.py)
+    engagement.record_views([pin.pk for pin in page])
+    return page, next_cursor
+
+
+def _home_feed_html(request, query, recommendations):
+    # Доски для «Сохранить в доску» карточки берут из {{ viewer }} (core/viewer.py)
+    pins, next_cursor = _feed_page(request, query, recommendations)
+    return render_to_string('core/home_pins.html', {
+        'pins': pins,
+        'next_cursor': next_cursor,
+        'query': query,
+    }, request=request)
+
+
+def _home_users_html(viewer, query):
+    users = User.objects.filter(is_active=True).exclude(pk=viewer.pk).select_related('profile')
+    if query:
+        users = get_backend().search_users(users, query)
+    return render_to_string('core/home_users.html', {'users': users[:FEED_PAGE_SIZE]})
+
+
 @login_required
 def home(request):
     query = request.GET.get('q')
 
-    # Сохраняем поиск в историю, если есть query
+    # Сохраняем поиск в историю, если есть query (пачками, см. core/history.py)
     if query:
-        SearchHistory.objects.create(user=request.user, query=query)
+        history.record(request.user, query)
 
-    # Стандартный поиск (если есть query)
-    pins = Pin.objects.exclude(user=request.user)
-    boards = Board.objects.exclude(user=request.user)
-    users = User.objects.exclude(pk=request.user.pk)
+    # Лента и пользователи — отдельные фрагменты: асинхронная версия (core/async_views.py)
+    # собирает их параллельно и отдаёт страницу потоком
+    return render(request, 'core/home.html', {
+        'query': query,
+        'feed_html': _home_feed_html(request, query, _recommendations(request.user, query)),
+        'users_html': _home_users_html(request.user, query),
+    })
 
-    if query:
-        users = users.filter(username__icontains=query)
-        pins = pins.filter(
-            Q(tags__name__icontains=query) | Q(title__icontains=query) | Q(description__icontains=query)
-        ).distinct()
-        boards = boards.filter(title__icontains=query).distinct()
-    else:
-        # Рекомендации без query: все пины/доски, кроме своих
-        pins = pins.all()
-        boards = boards.all()
-
-    # Собираем интересы из истории поиска
-    history = SearchHistory.objects.filter(user=request.user).order_by('-timestamp')[:20]  # Последние 20 запросов
-    interest_tags = set()
-    interest_users = set()
-
-    for hist in history:
-        q = hist.query.strip().lower()
-        if q.startswith('#'):  # Если как тег
-            interest_tags.add(q[1:])  # Добавляем без #
-        else:
-            # Проверяем, если query — логин пользователя
-            matching_users = User.objects.filter(username__icontains=q)
-            for u in matching_users:
-                interest_users.add(u.id)
 
-    # Сортировка пинов: сначала релевантные (по тегам или от интересных пользователей), потом остальные
-    if not query:  # Только для рекомендаций (без активного поиска)
-        relevant_pins = pins.filter(
-            Q(tags__name__in=interest_tags) | Q(user__id__in=interest_users)
-        ).distinct()
+@login_required
+def home_feed(request):
+    # Фрагмент ленты для бесконечной прокрутки (?cursor=...&q=...)
+    query = request.GET.get('q')
+    pins, next_cursor = _feed_page(request, query)
+    return render(request, 'core/home_feed.html', {
+        'pins': pins,
+        'next_cursor': next_cursor,
+        'query': query,
+    })
 
-        other_pins = pins.exclude(pk__in=relevant_pins.values_list('pk', flat=True))
 
-        pins = list(relevant_pins) + list(other_pins)  # Сверху релевантные
+def _profile_pins_html(viewed_user, is_own_profile):
+    def render_pins():
+        user_pins = Pin.objects.filter(user=viewed_user)
+        if not is_own_profile:
+            # Чужие пины показываем только после обработки (EXIF ещё не вычищен)
+            user_pins = user_pins.filter(processing_status=Pin.STATUS_READY)
+        return render_to_string('core/profile_pins.html', {'pins': user_pins, 'is_own_profile': is_own_profile})
+
+    variant = 'owner' if is_own_profile else 'public'
+    return fragments.get_or_render('profile_pins', [(fragments.USER, viewed_user.pk)], render_pins, variant)
+
+
+def _profile_boards_html(viewed_user):
+    def render_boards():
+        # Счётчик и обложки хранятся в самой доске: два запроса на любое число досок
+        user_boards = attach_covers(Board.objects.filter(user=viewed_user))
+        return render_to_string('core/profile_boards.html', {'boards': user_boards})
+
+    return fragments.get_or_render('profile_boards', [(fragments.USER, viewed_user.pk)], render_boards)
 
-    # Аналогично для досок (если нужно, можно добавить похожую сортировку)
 
-    context = {
-        'pins': pins,
-        'boards': boards,
-        'users': users,
-        'query': query,
-    }
-    return render(request, 'core/home.html', context)
 @login_required
 def profile(request, username=None):
-    # 1. Находим пользователя
+    # 1. Находим пользователя (профиль — тем же запросом)
     if username:
-        viewed_user = get_object_or_404(User, username=username)
+        viewed_user = get_object_or_404(User.objects.select_related('profile'), username=username, is_active=True)
     else:
         viewed_user = request.user
 
-    # 2. Получаем профиль (используем get_or_create, чтобы избежать 404, если профиль не создался при регистрации)
-    profile_obj, created = Profile.objects.get_or_create(user=viewed_user)
+    # 2. Профиль создаётся вместе с пользователем (core/signals.py). У старого аккаунта без профиля
+    # показываем пустой, несохранённый: GET ничего не пишет, профиль появится при первом сохранении формы
+    try:
+        profile_obj = viewed_user.profile
+    except Profile.DoesNotExist:
+        profile_obj = Profile(user=viewed_user)
     is_own_profile = (viewed_user == request.user)
 
     # 3. Обработка сохранения формы (только для владельца)
@@ -115,34 +166,68 @@ def profile(request, username=None):
         else:
             form = ProfileForm(instance=profile_obj)
 
-    # 4. Данные для отображения
-    user_pins = Pin.objects.filter(user=viewed_user)
-    user_boards = Board.objects.filter(user=viewed_user)
-
+    # 4. Сетки пинов и досок берём из кэша фрагментов (core/fragments.py):
+    # пока пользователь и его доски не менялись, страница не ходит за ними в БД
     context = {
         'form': form,
         'profile_user': viewed_user,
         'profile': profile_obj,
-        'pins': user_pins,
-        'boards': user_boards,
+        'pins_html': _profile_pins_html(viewed_user, is_own_profile),
+        'boards_html': _profile_boards_html(viewed_user),
         'is_own_profile': is_own_profile,
     }
     return render(request, 'core/profile.html', context)
 
 
+def _add_upload_errors(request, form):
+    # Ошибки, найденные LimitedUploadHandler ещё во время приёма файла
+    for field, error in getattr(request, 'upload_errors', {}).items():
+        form.add_error(field, error)
+
+
+def _save_pin(form, **fields):
+    """
+    Записывает пин формы вместе с тегами одной транзакцией. Если тег запретили уже после проверки формы,
+    сигнал check_forbidden_tags откатит и сам пин, а ошибка попадёт в форму. Возвращает пин или None.
+    """
+    try:
+        with transaction.atomic():
+            pin = form.save(commit=False)
+            for name, value in fields.items():
+                setattr(pin, name, value)
+            pin.save()
+            form.save_m2m()
+    except ForbiddenTagsError as exc:
+        form.add_error('tags', exc)
+        return None
+    return pin
+
+
 @login_required
+@csrf_exempt
 def upload_pin(request):
+    # Обработчик загрузки ставим до чтения тела запроса, поэтому CSRF проверяем внутри
+    request.upload_handlers.insert(0, LimitedUploadHandler(request))
+    return _upload_pin(request)
+
+
+@csrf_protect
+def _upload_pin(request):
     if request.method == 'POST':
         form = PinForm(request.POST, request.FILES)
-        if form.is_valid():
-            pin = form.save(commit=False)
-            pin.user = request.user
-            pin.save()
-            form.save_m2m()
+        _add_upload_errors(request, form)
+        pin = _save_pin(form, user=request.user) if form.is_valid() else None
+        if pin is not None:
+            # Тяжёлая обработка файла — в run_media_worker, запрос ждёт только записи на диск
+            enqueue_media(pin)
             return redirect('profile')
     else:
         form = PinForm()
-    return render(request, 'core/upload_pin.html', {'form': form})
+    return render(request, 'core/upload_pin.html', {
+        'form': form,
+        'chunked_threshold': settings.UPLOAD_CHUNKED_THRESHOLD,
+        'chunk_size': settings.UPLOAD_CHUNK_SIZE,
+    })
 
 
 # В views.py для upload_board передайте user в форму
@@ -196,7 +281,7 @@ def add_to_board(request, pin_id):
         pin = get_object_or_404(Pin, id=pin_id)
         board = get_object_or_404(Board, id=board_id, user=request.user)
 
-        if pin in board.pins.all():
+        if board.pins.filter(pk=pin.pk).exists():
             messages.warning(request, "Этот пин уже есть в данной доске.")
         else:
             board.pins.add(pin)
@@ -218,40 +303,280 @@ def remove_from_board(request, board_id, pin_id):
 @login_required
 def delete_pin(request, pin_id):
     pin = get_object_or_404(Pin, id=pin_id, user=request.user)
-    pin.delete()
+    # Пин сразу скрывается, строки и файлы вычистит run_deletions (core/deletion.py)
+    deletion.delete_pin(pin)
     return redirect('profile')
 
+def _board_pins_html(board, is_own_board):
+    def render_pins():
+        return render_to_string('core/board_pins.html', {
+            'board': board,
+            'pins': board.pins.select_related('user'),
+            'is_own_board': is_own_board,
+        })
+
+    variant = 'owner' if is_own_board else 'public'
+    return fragments.get_or_render('board_pins', [(fragments.BOARD, board.pk)], render_pins, variant)
+
+
+def _board_related_html(board):
+    def render_related():
+        # Похожие на пины доски — из заранее собранной модели (core/related.py)
+        pins = related.related_pins(board.pins.order_by('-pk').values_list('pk', flat=True)[:related.RECENT_SAVES])
+        return render_to_string('core/board_related.html', {'pins': pins})
+
+    return fragments.get_or_render('board_related', [(fragments.BOARD, board.pk)], render_related, related.model_version())
+
+
 @login_required
 def board_detail(request, board_id):
     # Получаем доску. Если доска чужая — смотреть можно, если приватная (по желанию) — можно ограничить
-    board = get_object_or_404(Board, id=board_id)
+    board = get_object_or_404(Board.objects.select_related('user'), id=board_id)
+    is_own_board = board.user == request.user
+
     return render(request, 'core/board_detail.html', {
         'board': board,
-        'is_own_board': board.user == request.user
+        'is_own_board': is_own_board,
+        'related_html': _board_related_html(board),
+        'pins_html': _board_pins_html(board, is_own_board),
     })
 
+
+@login_required
+@require_POST
+def board_batch(request):
+    """
+    Много операций с досками за один запрос:
+        {"add": [{"board": 1, "pin": 10}, ...], "remove": [{"board": 2, "pin": 11}, ...]}
+    """
+    try:
+        data = json.loads(request.body)
+        result = apply_batch(
+            request.user, parse_operations(data.get('add', [])), parse_operations(data.get('remove', []))
+        )
+    except (ValueError, AttributeError):
+        return JsonResponse({'error': 'Некорректный запрос.'}, status=400)
+    except BatchRejected as exc:
+        return JsonResponse({'error': str(exc)}, status=exc.status)
+    return JsonResponse(result)
+
+
+@login_required
+def export_pins(request):
+    # Архив собирается на лету (core/transfer.py): память не зависит от числа пинов
+    response = StreamingHttpResponse(transfer.stream_archive(request.user), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="pins-{request.user.username}.zip"'
+    return response
+
+
 @login_required
 def delete_board(request, board_id):
     # Удалять может только владелец
     board = get_object_or_404(Board, id=board_id, user=request.user)
-    board.delete()
+    deletion.delete_board(board)
     messages.success(request, "Доска успешно удалена.")
     return redirect('profile')
 
 
 @login_required
+@require_POST
+def delete_account(request):
+    # Вход закрывается сразу, пины, доски и файлы run_deletions удаляет в фоне
+    deletion.delete_account(request.user)
+    logout(request)
+    messages.success(request, "Аккаунт удалён.")
+    return redirect('login')
+
+
+@login_required
+@csrf_exempt
 def edit_pin(request, pin_id):
+    request.upload_handlers.insert(0, LimitedUploadHandler(request))
+    return _edit_pin(request, pin_id)
+
+
+@csrf_protect
+def _edit_pin(request, pin_id):
     # Находим пин, проверяя, что он принадлежит текущему пользователю
     pin = get_object_or_404(Pin, id=pin_id, user=request.user)
 
     if request.method == 'POST':
         # Передаем request.FILES, чтобы можно было загрузить новое фото
         form = PinForm(request.POST, request.FILES, instance=pin)
-        if form.is_valid():
-            form.save()
+        _add_upload_errors(request, form)
+        if form.is_valid() and _save_pin(form) is not None:
+            if 'image' in form.changed_data or 'video' in form.changed_data:
+                enqueue_media(pin)
             messages.success(request, "Пин успешно обновлен!")
             return redirect('profile')
     else:
         form = PinForm(instance=pin)
 
-    return render(request, 'core/edit_pin.html', {'form': form, 'pin': pin})
\ No newline at end of file
+    return render(request, 'core/edit_pin.html', {'form': form, 'pin': pin})
+
+
+# --- Докачиваемая загрузка больших видео: init -> куски -> finalize ---
+
+@login_required
+@require_POST
+def upload_init(request):
+    try:
+        data = json.loads(request.body)
+        size = int(data['size'])
+        filename = str(data['filename'])[:255]
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Некорректный запрос.'}, status=400)
+    content_type = data.get('content_type', '')
+    if content_type not in ALLOWED_VIDEO_TYPES:
+        return JsonResponse({'error': 'Неподдерживаемый тип файла.'}, status=400)
+    if not 0 < size <= settings.UPLOAD_CHUNKED_MAX_SIZE:
+        return JsonResponse({'error': 'Файл слишком большой.'}, status=400)
+
+    session = UploadSession.objects.create(
+        user=request.user, filename=filename, content_type=content_type, size=size,
+        sha256=str(data.get('sha256', ''))[:64],
+    )
+    return JsonResponse({'upload_id': str(session.pk), 'offset': 0, 'chunk_size': settings.UPLOAD_CHUNK_SIZE})
+
+
+@login_required
+def upload_chunk(request, upload_id):
+    # GET — узнать, с какого места продолжать; PUT — дописать кусок с заголовком Upload-Offset
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user, status=UploadSession.STATUS_OPEN)
+    if request.method == 'GET':
+        return JsonResponse({'offset': session.offset, 'size': session.size})
+    if request.method != 'PUT':
+        return HttpResponseNotAllowed(['GET', 'PUT'])
+
+    try:
+        offset = int(request.headers['Upload-Offset'])
+        length = int(request.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return JsonResponse({'error': 'Нужны заголовки Upload-Offset и Content-Length.'}, status=400)
+    if length > settings.UPLOAD_CHUNK_SIZE:
+        return JsonResponse({'error': 'Слишком большой кусок.'}, status=413)
+
+    if offset != session.offset:
+        # Клиент не знает, что часть уже принята (или потеряна) — сообщаем актуальное смещение
+        return JsonResponse({'offset': session.offset}, status=409)
+    # Кусок читается из сети вне транзакции — в свой файл .chunk, а смещение сдвигается
+    # compare-and-swap: из двух одновременных повторов одного куска его примет только один
+    try:
+        chunk = receive_chunk(session, offset, request, length, request.headers.get('X-Chunk-SHA256', ''))
+    except UploadRejected as exc:
+        return JsonResponse({'error': str(exc), 'offset': session.offset}, status=400)
+    sessions = UploadSession.objects.filter(pk=session.pk, status=UploadSession.STATUS_OPEN)
+    if not sessions.filter(offset=offset).update(offset=offset + length, updated_at=timezone.now()):
+        discard_chunk(chunk)
+        current = sessions.values_list('offset', flat=True).first()
+        if current is None:
+            raise Http404
+        return JsonResponse({'offset': current}, status=409)
+    try:
+        append_chunk(session, offset, chunk)
+    except OSError:
+        # Кусок не дописан — возвращаем смещение, клиент отправит его снова
+        sessions.filter(offset=offset + length).update(offset=offset)
+        raise
+    return JsonResponse({'offset': offset + length})
+
+
+@login_required
+@require_POST
+def upload_finalize(request, upload_id):
+    session = get_object_or_404(UploadSession, pk=upload_id, user=request.user, status=UploadSession.STATUS_OPEN)
+    # Метаданные пина — обычными полями формы; видео уже лежит на диске
+    form = PinForm(request.POST, request.FILES, instance=Pin(user=request.user, video=session.filename))
+    if not form.is_valid():
+        return JsonResponse({'errors': form.errors}, status=400)
+    try:
+        with transaction.atomic():
+            # Под блокировкой: двойное нажатие не создаст два пина, а дописывающий кусок запрос — подождёт
+            session = get_object_or_404(
+                UploadSession.objects.select_for_update(), pk=session.pk, status=UploadSession.STATUS_OPEN,
+            )
+            # Теги сверяем ещё раз до переноса файла: список запрещённых мог пополниться после проверки формы
+            forbidden = find_forbidden(form.cleaned_data['tags'])
+            if forbidden:
+                raise ForbiddenTagsError(forbidden)
+            try:
+                name = finalize_upload(session)
+            except UploadRejected as exc:
+                return JsonResponse({'error': str(exc)}, status=400)
+
+            pin = form.save(commit=False)
+            pin.video.name = name
+            pin.save()
+            form.save_m2m()
+            enqueue_media(pin)
+            UploadSession.objects.filter(pk=session.pk).update(status=UploadSession.STATUS_COMPLETE)
+    except ForbiddenTagsError as exc:
+        return JsonResponse({'errors': {'tags': exc.messages}}, status=400)
+    return JsonResponse({'pin_id': pin.pk, 'redirect': reverse('profile')})
+
+
+def thumbnail(request, preset, width, fmt, name):
+    # Ленивая генерация превью: первый запрос ставит задачу в пул и получает оригинал,
+    # следующие — готовый файл. Воркер запроса на генерации не блокируется.
+    # Только картинки пинов и аватары: загрузки и реестр превью скрыты (serve.PRIVATE_PREFIXES),
+    # а генерация из любого файла MEDIA_ROOT дала бы нагрузить пул чем угодно
+    if preset not in thumbnails.SOURCE_PREFIXES or width not in thumbnails.widths_for(preset) or fmt not in thumbnails.FORMATS:
+        raise Http404
+    name, _, _ = serve.resolve(name)
+    if not name.startswith(thumbnails.SOURCE_PREFIXES[preset]):
+        raise Http404
+
+    entry = thumbnails.lookup(name)
+    if entry is None:
+        thumbnails.schedule(name, preset)
+        entry = thumbnails.lookup(name)  # При THUMBNAIL_WORKERS = 0 уже готово
+    if entry is None:
+        return redirect(settings.MEDIA_URL + name)
+
+    # Ближайший вариант не меньше запрошенного (маленькие оригиналы не увеличиваются)
+    available = sorted(
+        (int(key.split('.')[0]), path) for key, path in entry['variants'].items() if key.endswith(f'.{fmt}')
+    )
+    path = next((path for w, path in available if w >= width), available[-1][1])
+    return redirect(settings.MEDIA_URL + path)
+
+
+@staff_member_required
+def cache_stats(request):
+    # Попадания и промахи кэша фрагментов в этом процессе
+    return JsonResponse(fragments.stats())
+
+
+def metrics_view(request):
+    # Сборщик Prometheus ходит с токеном, персонал — из браузера
+    token = settings.METRICS_TOKEN
+    authorized = bool(token) and request.headers.get('Authorization') == f'Bearer {token}'
+    if not (authorized or request.user.is_staff):
+        return HttpResponse(status=403)
+    if request.GET.get('format') == 'json':
+        # Скользящее окно за последние минуты: p50/p95 по каждому маршруту
+        return JsonResponse(metrics.rolling_summary())
+    return HttpResponse(metrics.prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@login_required
+def tags_trending(request):
+    # ?kind=popular — облако самых используемых тегов, иначе — растущие за последние сутки
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), 100)
+        window = min(max(int(request.GET.get('window', tagstats.TRENDING_WINDOW_HOURS)), 1), 24 * 7)
+    except ValueError:
+        return JsonResponse({'error': 'Некорректный запрос.'}, status=400)
+    if request.GET.get('kind') == 'popular':
+        return JsonResponse({'tags': tagstats.popular(limit)})
+    return JsonResponse({'tags': tagstats.trending(limit, window)})
+
+
+@login_required
+def tags_autocomplete(request):
+    return JsonResponse({'tags': tagstats.autocomplete(request.GET.get('q', ''))})
+
+
+@login_required
+def recent_searches(request):
+    return JsonResponse({'queries': history.recent_searches(request.user)})
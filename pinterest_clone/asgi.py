@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'pinterest_clone.settings')
+# Асинхронные главная, профиль и доска (core/async_views.py); DJANGO_ASYNC_VIEWS=0 — синхронные
+os.environ.setdefault('DJANGO_ASYNC_VIEWS', '1')
 
 application = get_asgi_application()
@@ -23,11 +23,16 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MediaMiddleware',  # /media/ с Range и кэшированием, без сессий, см. core/serve.py
+    'core.middleware.StaticMiddleware',  # Собранная статика: .br/.gz и вечный кэш, см. core/assets.py
+    'core.middleware.MetricsMiddleware',  # Метрики запросов, см. core/metrics.py
+    'core.middleware.ReplicaMiddleware',  # Чтение с реплик и возврат на основную базу после записи, см. core/db.py
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.middleware.ViewerMiddleware',  # request.viewer: профиль и доски пользователя, см. core/viewer.py
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'django.middleware.locale.LocaleMiddleware',  # Для русского языка
@@ -46,6 +51,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'core.context_processors.viewer',  # {{ viewer }}: профиль и доски пользователя
             ],
         },
     },
@@ -77,6 +83,8 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 STATICFILES_DIRS = [BASE_DIR / 'static']
+# Сюда собирает статику manage.py build_assets
+STATIC_ROOT = BASE_DIR / 'var' / 'static'
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
@@ -88,4 +96,125 @@ LOGOUT_REDIRECT_URL = '/'
 LOGIN_URL = '/login/'
 
 # Для тегов
-TAGGIT_CASE_INSENSITIVE = True
\ No newline at end of file
+TAGGIT_CASE_INSENSITIVE = True
+# Поиск: 'core.search.InvertedIndexBackend' (индекс) или 'core.search.LikeSearchBackend' (icontains)
+SEARCH_BACKEND = 'core.search.InvertedIndexBackend'
+
+# Превью изображений (core/thumbnails.py): ширины по назначению и размер пула процессов.
+# THUMBNAIL_WORKERS = 0 — генерировать синхронно в запросе
+THUMBNAIL_WIDTHS = {
+    'pin': (236, 474, 736),
+    'avatar': (64, 160, 320),
+}
+THUMBNAIL_WORKERS = 2
+
+# Дополнительные шаги обработки видео в run_media_worker: пути к функциям f(pin, video_path)
+MEDIA_TRANSCODE_HOOKS = []
+# Задача обработки, воркер которой не отмечался дольше стольких минут, возвращается в очередь.
+# Живой воркер отмечается каждую треть срока, даже посреди долгого перекодирования
+MEDIA_JOB_STALE_MINUTES = 15
+
+# Лимиты загрузки (core/uploads.py). Обычная форма: по полям пина, в байтах
+UPLOAD_MAX_SIZES = {
+    'image': 20 * 1024 * 1024,
+    'video': 200 * 1024 * 1024,
+}
+# Видео больше порога браузер грузит по частям через /upload/ с докачкой
+UPLOAD_CHUNKED_THRESHOLD = 20 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNKED_MAX_SIZE = 4 * 1024 * 1024 * 1024
+# Брошенные загрузки по частям (и их .part) удаляет manage.py sweep_media через столько часов без новых кусков
+UPLOAD_SESSION_TTL_HOURS = 24
+
+# Медиа хранятся по хэшу содержимого (core/storage.py): одинаковые файлы лежат на диске один раз
+STORAGES = {
+    'default': {'BACKEND': 'core.storage.ContentAddressedStorage'},
+    # Минифицированная статика с хэшем в имени и сжатыми копиями (core/assets.py)
+    'staticfiles': {'BACKEND': 'core.assets.CompressedManifestStaticFilesStorage'},
+}
+
+# Кэш. Фрагменты профиля и доски (core/fragments.py) работают и с локальной памятью,
+# и с файловым бэкендом ('django.core.cache.backends.filebased.FileBasedCache'),
+# который общий для всех процессов на одной машине
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+# Модель похожих пинов (build_related_pins): файлы NumPy, которые процессы открывают через memory map
+RELATED_PINS_DIR = BASE_DIR / 'var' / 'related'
+
+# История поиска пишется пачками (core/history.py): по стольку записей или раз в столько секунд.
+# SEARCH_HISTORY_FLUSH_SIZE = 1 — писать сразу
+SEARCH_HISTORY_FLUSH_SIZE = 100
+SEARCH_HISTORY_FLUSH_INTERVAL = 5
+
+# Метрики запросов (core/metrics.py): /metrics/ в формате Prometheus для персонала
+# или по заголовку "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+# Бюджеты SQL-запросов по имени маршрута: превышение пишется в лог,
+# при QUERY_BUDGET_STRICT = True (в тестах) — исключение QueryBudgetExceeded
+QUERY_BUDGETS = {
+    'home': 15,
+    'home_feed': 12,
+    'profile': 12,
+    'user_profile': 12,
+    'board_detail': 12,
+    'tags_autocomplete': 5,
+    'recent_searches': 5,
+}
+QUERY_BUDGET_STRICT = False
+
+# Асинхронные версии главной, профиля и доски (core/async_views.py). Включается в asgi.py;
+# под WSGI асинхронные view только мешают — там остаются синхронные из core/views.py
+ASYNC_VIEWS = os.environ.get('DJANGO_ASYNC_VIEWS') == '1'
+
+# Отдача медиа (core/serve.py): Range, ETag, Cache-Control. Файлы с хэшем в имени кэшируются навсегда,
+# остальные — на MEDIA_CACHE_MAX_AGE секунд. MEDIA_SERVE = False — /media/ целиком отдаёт веб-сервер.
+MEDIA_SERVE = True
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24
+# Передача тела веб-серверу: None, 'x-accel-redirect' (nginx, internal-location MEDIA_OFFLOAD_PREFIX)
+# или 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+MEDIA_OFFLOAD = os.environ.get('MEDIA_OFFLOAD') or None
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+# Постоянные соединения с проверкой перед запросом: не открываем новое соединение на каждый запрос
+DATABASES['default'].update(CONN_MAX_AGE=60, CONN_HEALTH_CHECKS=True)
+# Реплики для чтения (core/db.py): DB_REPLICA_HOSTS=host1,host2:3307 — алиасы replica1, replica2
+# с теми же базой и пользователем. Без переменной всё читается с основной базы.
+for _number, _host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    _host, _, _port = _host.strip().partition(':')
+    DATABASES[f'replica{_number}'] = {
+        **DATABASES['default'], 'HOST': _host, 'PORT': _port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['core.db.ReplicaRouter']
+# View, чьи GET-запросы читают с реплик
+REPLICA_READ_VIEWS = [
+    'home', 'home_feed', 'profile', 'user_profile', 'board_detail',
+    'tags_trending', 'tags_autocomplete', 'recent_searches',
+]
+# После изменяющего запроса столько секунд читаем с основной базы (больше обычного отставания реплик)
+REPLICA_STICKY_SECONDS = 5
+# Как часто перепроверять реплику и какое отставание (MySQL, секунды) считать неисправностью
+REPLICA_HEALTH_INTERVAL = 10
+REPLICA_MAX_LAG = 10
+
+# Показы и сохранения пинов (core/engagement.py) копятся в памяти процесса и пишутся пачкой
+# после ответа: при стольких пинах со счётчиками или раз в столько секунд
+ENGAGEMENT_FLUSH_SIZE = 500
+ENGAGEMENT_FLUSH_INTERVAL = 10
+# Популярность в ленте: пин на столько часов новее стоит наравне с вдвое более вовлекающим.
+# После изменения — manage.py rescore_pins
+POPULARITY_HALF_LIFE_HOURS = 72
+# Новые оценки попадают в ленту раз в столько минут: между границами порядок не меняется,
+# и прокрутка ленты не пропускает и не повторяет пины
+POPULARITY_SNAPSHOT_MINUTES = 15
+
+# Статика (core/assets.py, core/serve.py): после каждого изменения в static/ — manage.py build_assets.
+# Файлы с хэшем в имени кэшируются навсегда, остальные — на STATIC_CACHE_MAX_AGE секунд.
+# STATIC_SERVE = False — /static/ отдаёт веб-сервер (тогда ему нужно gzip_static/brotli_static)
+STATIC_SERVE = True
+STATIC_CACHE_MAX_AGE = 60 * 5
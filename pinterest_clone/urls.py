@@ -1,10 +1,12 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.conf.urls.static import static
+
+from core.serve import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('core.urls')),
-
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+    # Обычно медиа перехватывает core.middleware.MediaMiddleware раньше; маршрут — на случай, если его убрали
+    path(settings.MEDIA_URL.strip('/') + '/<path:path>', serve_media, name='media'),
+]
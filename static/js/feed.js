@@ -0,0 +1,36 @@
+// Бесконечная прокрутка: когда доскроллили до маркера — подгружаем следующую страницу
+(function () {
+    const feed = document.getElementById('feed');
+    let loading = false;
+
+    const observer = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            if (entry.isIntersecting) loadMore(entry.target);
+        });
+    }, {rootMargin: '600px'});
+
+    function watch() {
+        const sentinel = feed.querySelector('.feed-sentinel');
+        if (sentinel) observer.observe(sentinel);
+    }
+
+    function loadMore(sentinel) {
+        if (loading) return;
+        loading = true;
+        observer.unobserve(sentinel);
+
+        const params = new URLSearchParams({cursor: sentinel.dataset.nextCursor});
+        if (feed.dataset.query) params.set('q', feed.dataset.query);
+
+        fetch(feed.dataset.feedUrl + '?' + params.toString(), {credentials: 'same-origin'})
+            .then(function (response) { return response.text(); })
+            .then(function (html) {
+                sentinel.remove();
+                feed.insertAdjacentHTML('beforeend', html);
+                loading = false;
+                watch();
+            });
+    }
+
+    watch();
+})();